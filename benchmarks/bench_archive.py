@@ -0,0 +1,76 @@
+"""Archive cost per sample, bytes per sample with and without compression, and the time to read
+a range of samples, for a week of simulated samples.
+
+Run from the project root:
+
+    python -m benchmarks.bench_archive [--batteries 14] [--days 7] [--sample-interval 10] [--range-hours 1]
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+from eflexcan2mqtt.archive import SampleArchive, read_samples
+from eflexcan2mqtt.message_handler import MessageHandler
+from eflexcan2mqtt.simulator import BusSimulator
+
+logger = logging.getLogger(__name__)
+
+# 2024-05-12 00:00:00 UTC
+START_TIME = 1715472000.0
+
+
+def directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def run(batteries: int, days: int, sample_interval: int, range_hours: float) -> None:
+    # The sets of an hour of simulated cycles, archived over and over.
+    simulator = BusSimulator(batteries, seed = 1)
+    message_handler = MessageHandler(logger)
+    cycles = []
+    for _ in range(3600 // sample_interval):
+        simulator.feed(message_handler, cycles = 1)
+        cycles.append([(battery.node_id, battery.data10, battery.data60) for battery in simulator.batteries])
+    samples_per_day = 86400 // sample_interval
+
+    with tempfile.TemporaryDirectory() as path:
+        archive = SampleArchive(path, logger, retention_days = 0)
+        start = time.perf_counter()
+        timestamp = START_TIME
+        for sample in range(days * samples_per_day):
+            for node_id, data10, data60 in cycles[sample % len(cycles)]:
+                archive.add(node_id, data10, data60, timestamp)
+            timestamp += sample_interval
+        archive.close()
+        add_time = time.perf_counter() - start
+        start = time.perf_counter()
+        archive.close_segments()
+        close_time = time.perf_counter() - start
+
+        rows = archive.rows
+        compressed = directory_size(path)
+        print(f"{batteries} batteries, a sample every {sample_interval} s for {days} days: {rows:,} samples")
+        print(f"append            {add_time / rows * 1e6:8.2f} us per sample")
+        print(f"close segments    {close_time * 1e3:8.1f} ms for {days - 1} days, in a worker thread")
+        print(f"size              {compressed / rows:8.2f} bytes per sample, {compressed:,} bytes"
+              " (the last day uncompressed)")
+
+        # A range in the middle of the last, memory-mapped, day and of the first, compressed, day.
+        for label, range_start in (("read mapped", START_TIME + (days - 0.5) * 86400),
+                                   ("read compressed", START_TIME + 0.5 * 86400)):
+            start = time.perf_counter()
+            count = sum(1 for _ in read_samples(path, range_start, range_start + range_hours * 3600))
+            elapsed = time.perf_counter() - start
+            print(f"{label:16}  {elapsed * 1e3:8.2f} ms for {count:,} samples in {range_hours} h")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batteries", type = int, default = 14)
+    parser.add_argument("--days", type = int, default = 7)
+    parser.add_argument("--sample-interval", type = int, default = 10)
+    parser.add_argument("--range-hours", type = float, default = 1)
+    args = parser.parse_args()
+    run(args.batteries, args.days, args.sample_interval, args.range_hours)
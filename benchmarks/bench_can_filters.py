@@ -0,0 +1,57 @@
+"""Frames dropped by the battery CAN filters, and the event loop thread CPU time saved, replaying
+a mixed traffic candump log to the SocketCANReader.
+
+The kernel drops the frames not matching the filters before they are queued on the socket. Over
+a socket pair, the filters are applied, as the kernel does, to the frames sent. With --vcan, the
+filters are installed on the CAN socket of a virtual CAN interface, which must be up.
+
+Run from the project root:
+
+    python -m benchmarks.bench_can_filters [--repeat 200] [--vcan vcan0]
+"""
+
+import argparse
+import logging
+from typing import List
+from eflexcan2mqtt.decode import BATTERY_CAN_FILTERS
+from eflexcan2mqtt.socketcan_reader import CAN_FILTER, CAN_FRAME, pack_can_filters
+from .bench_socketcan_reader import native_reader, replay
+from .frames import load_frames, pack_frames
+
+logger = logging.getLogger(__name__)
+
+
+def kernel_filter(raw_frames: List[bytes], can_filters) -> List[bytes]:
+    """The frames passing the CAN_RAW_FILTER filters: any filter with can_id & can_mask == frame id & can_mask."""
+    packed = pack_can_filters(can_filters)
+    filters = [CAN_FILTER.unpack_from(packed, offset) for offset in range(0, len(packed), CAN_FILTER.size)]
+    return [raw_frame for raw_frame in raw_frames
+            if any(CAN_FRAME.unpack(raw_frame)[0] & can_mask == can_id & can_mask for can_id, can_mask in filters)]
+
+
+def run(repeat: int, vcan: str | None) -> None:
+    raw_frames = pack_frames(load_frames())
+
+    filtered_frames = kernel_filter(raw_frames, BATTERY_CAN_FILTERS)
+    if vcan is None:
+        filtered = replay(native_reader, filtered_frames, repeat)
+    else:
+        # All frames are sent, and those not matching the filters dropped by the kernel.
+        filtered = replay(native_reader, raw_frames, repeat, vcan, list(BATTERY_CAN_FILTERS), len(filtered_frames))
+    unfiltered = replay(native_reader, raw_frames, repeat, vcan)
+
+    dropped = 1 - len(filtered_frames) / len(raw_frames)
+    print(f"{len(raw_frames)} frames replayed {repeat} times over {vcan or 'a socket pair'}")
+    print(f"frames dropped by the filters  {dropped:6.1%}")
+    print(f"unfiltered  {unfiltered[1] * len(raw_frames) * 1e3:8.3f} ms CPU per replay")
+    print(f"filtered    {filtered[1] * len(filtered_frames) * 1e3:8.3f} ms CPU per replay")
+    saved = 1 - filtered[1] * len(filtered_frames) / (unfiltered[1] * len(raw_frames))
+    print(f"CPU saved   {saved:6.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type = int, default = 200)
+    parser.add_argument("--vcan", help = "A virtual CAN interface to replay the frames over, such as vcan0")
+    args = parser.parse_args()
+    run(args.repeat, args.vcan)
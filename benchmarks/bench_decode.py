@@ -0,0 +1,53 @@
+"""Per battery decode cost of parse_battery_data, compared to the original decoder, using
+the batteries compiled from the mixed traffic candump log.
+
+Run from the project root:
+
+    python -m benchmarks.bench_decode [--repeat 20000]
+"""
+
+import argparse
+import logging
+import timeit
+from eflexcan2mqtt.decode import parse_battery_data
+from eflexcan2mqtt.message_handler import MessageHandler
+from .frames import load_frames
+from . import legacy
+
+logger = logging.getLogger(__name__)
+
+
+def run(repeat: int) -> None:
+    handler = MessageHandler(logger)
+    for frame in load_frames():
+        handler.on_message_received(frame)
+
+    batteries = [(data10, handler.compiled_message60X_data[node_id])
+                 for node_id, data10 in handler.compiled_message10X_data.items()
+                 if node_id in handler.compiled_message60X_data]
+    legacy_batteries = [(list(data10), list(data60)) for data10, data60 in batteries]
+
+    for (data10, data60), (list10, list60) in zip(batteries, legacy_batteries):
+        assert parse_battery_data(data10, data60) == legacy.parse_battery_data(list10, list60)
+
+    def decode_legacy():
+        for data10, data60 in legacy_batteries:
+            legacy.parse_battery_data(data10, data60)
+
+    def decode():
+        for data10, data60 in batteries:
+            parse_battery_data(data10, data60)
+
+    count = repeat * len(batteries)
+    before = min(timeit.repeat(decode_legacy, number = repeat, repeat = 5)) / count
+    after = min(timeit.repeat(decode, number = repeat, repeat = 5)) / count
+
+    print(f"{len(batteries)} batteries decoded {repeat} times")
+    print(f"per battery   before {before * 1e6:8.3f} us   after {after * 1e6:8.3f} us   {before / after:5.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type = int, default = 20000)
+    args = parser.parse_args()
+    run(args.repeat)
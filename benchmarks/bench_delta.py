@@ -0,0 +1,49 @@
+"""Bytes published with and without delta encoding, for simulated batteries published every
+publish interval.
+
+Run from the project root:
+
+    python -m benchmarks.bench_delta [--batteries 14] [--publishes 60] [--publish-interval 60]
+"""
+
+import argparse
+import logging
+from eflexcan2mqtt.delta import DeltaEncoder
+from eflexcan2mqtt.message_handler import MessageHandler
+from eflexcan2mqtt.mqtt_publisher import MQTTPublisher
+from eflexcan2mqtt.replay import InMemoryMQTTClient
+from eflexcan2mqtt.simulator import BusSimulator
+
+logger = logging.getLogger(__name__)
+
+
+def published_bytes(batteries: int, publishes: int, publish_interval: int, delta_encoder: DeltaEncoder | None) -> int:
+    simulator = BusSimulator(batteries, seed = 1)
+    message_handler = MessageHandler(logger)
+    mqtt_client = InMemoryMQTTClient()
+    publisher = MQTTPublisher(logger = logger, message_handler = message_handler, mqtt_client = mqtt_client,
+                              delta_encoder = delta_encoder)
+
+    for _ in range(publishes):
+        simulator.feed(message_handler, cycles = publish_interval)
+        publisher.publish_data()
+    return mqtt_client.payload_bytes
+
+
+def run(batteries: int, publishes: int, publish_interval: int) -> None:
+    full = published_bytes(batteries, publishes, publish_interval, None)
+    delta = published_bytes(batteries, publishes, publish_interval,
+                            DeltaEncoder(deadbands = {'cell_voltages': 1, 'battery_current': 0.1}, keyframe_interval = 3600))
+
+    print(f"{batteries} batteries, {publishes} publishes every {publish_interval} s")
+    print(f"full records   {full:12,} bytes")
+    print(f"delta encoded  {delta:12,} bytes   {delta / full:6.1%} of full")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batteries", type = int, default = 14)
+    parser.add_argument("--publishes", type = int, default = 60)
+    parser.add_argument("--publish-interval", type = int, default = 60)
+    args = parser.parse_args()
+    run(args.batteries, args.publishes, args.publish_interval)
@@ -0,0 +1,66 @@
+"""Memory used by MessageHandler frame assembly, measured with tracemalloc while replaying
+a candump log, compared to the original lists of can.Message objects and lists of ints.
+
+A new can.Message is created for every replayed frame, as the can.Notifier does, so
+messages kept alive by the handler count against it.
+
+Run from the project root:
+
+    python -m benchmarks.bench_frame_assembly [--repeat 200]
+"""
+
+import argparse
+import logging
+import time
+import tracemalloc
+from typing import List, Tuple
+import can
+from eflexcan2mqtt.message_handler import MessageHandler
+from .frames import load_frames
+from .legacy import LegacyMessageHandler
+
+logger = logging.getLogger(__name__)
+
+
+def replay(handler: can.Listener, frames: List[Tuple[int, float, bytes]], repeat: int) -> dict:
+    tracemalloc.start()
+    start_memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+
+    for _ in range(repeat):
+        for arbitration_id, timestamp, data in frames:
+            handler.on_message_received(can.Message(arbitration_id = arbitration_id, timestamp = timestamp, data = data))
+
+    elapsed = time.perf_counter() - start
+    current_memory, peak_memory = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    return {
+        'frames_per_second': len(frames) * repeat / elapsed,
+        'retained': current_memory - start_memory,
+        'peak': peak_memory - start_memory,
+        'blocks': sum(stat.count for stat in snapshot.statistics('filename')),
+    }
+
+
+def run(repeat: int) -> None:
+    frames = [(msg.arbitration_id, msg.timestamp, bytes(msg.data)) for msg in load_frames()]
+
+    before = replay(LegacyMessageHandler(), frames, repeat)
+    after = replay(MessageHandler(logger), frames, repeat)
+
+    print(f"{len(frames)} frames replayed {repeat} times, with tracemalloc enabled")
+    print(f"{'':<22}{'before':>14}{'after':>14}")
+    print(f"{'retained bytes':<22}{before['retained']:>14,}{after['retained']:>14,}")
+    print(f"{'peak bytes':<22}{before['peak']:>14,}{after['peak']:>14,}")
+    print(f"{'live blocks':<22}{before['blocks']:>14,}{after['blocks']:>14,}")
+    print(f"{'frames/s':<22}{before['frames_per_second']:>14,.0f}{after['frames_per_second']:>14,.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type = int, default = 200)
+    args = parser.parse_args()
+    run(args.repeat)
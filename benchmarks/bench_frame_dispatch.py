@@ -0,0 +1,60 @@
+"""Frames per second handled by MessageHandler.on_message_received, replaying a mixed
+traffic candump log, compared to the original string based arbitration id parsing.
+
+Run from the project root:
+
+    python -m benchmarks.bench_frame_dispatch [--repeat 2000]
+"""
+
+import argparse
+import logging
+import time
+from typing import Callable, List
+import can
+from eflexcan2mqtt.decode import ARBITRATION_ID_DISPATCH
+from eflexcan2mqtt.message_handler import MessageHandler
+from .frames import load_frames
+from .legacy import LegacyMessageHandler, parse_arbitration_id
+
+logger = logging.getLogger(__name__)
+
+
+def frames_per_second(handle: Callable[[can.Message], None], frames: List[can.Message], repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for frame in frames:
+            handle(frame)
+    return len(frames) * repeat / (time.perf_counter() - start)
+
+
+def legacy_dispatch(msg: can.Message) -> None:
+    _, _, message_type = parse_arbitration_id(msg.arbitration_id)
+    if message_type not in ('10', '60'):
+        return
+
+
+def dispatch(msg: can.Message) -> None:
+    if ARBITRATION_ID_DISPATCH.get(msg.arbitration_id) is None:
+        return
+
+
+def run(repeat: int) -> None:
+    frames = load_frames()
+
+    results = [
+        ("arbitration id only", frames_per_second(legacy_dispatch, frames, repeat), frames_per_second(dispatch, frames, repeat)),
+        ("on_message_received",
+            frames_per_second(LegacyMessageHandler().on_message_received, frames, repeat),
+            frames_per_second(MessageHandler(logger).on_message_received, frames, repeat)),
+    ]
+
+    print(f"{len(frames)} frames replayed {repeat} times")
+    for name, before, after in results:
+        print(f"{name:<22} before {before:12,.0f} frames/s   after {after:12,.0f} frames/s   {after / before:5.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type = int, default = 2000)
+    args = parser.parse_args()
+    run(args.repeat)
@@ -0,0 +1,53 @@
+"""Cost of writing simulated battery data to InfluxDB in line protocol, per point, and bytes per
+point with and without gzip, against a local InfluxDB stand-in.
+
+Run from the project root:
+
+    python -m benchmarks.bench_influx_write [--batteries 14] [--publishes 200]
+"""
+
+import argparse
+import gzip
+import logging
+import time
+from eflexcan2mqtt.decode import parse_battery_data
+from eflexcan2mqtt.influx_client import InfluxClient, to_line_protocol
+from eflexcan2mqtt.message_handler import MessageHandler
+from eflexcan2mqtt.simulator import BusSimulator
+from tests.mock_influxdb import MockInfluxDB
+
+logger = logging.getLogger(__name__)
+
+
+def run(batteries: int, publishes: int) -> None:
+    simulator = BusSimulator(batteries, seed = 1)
+    simulator.feed(MessageHandler(logger), cycles = 1)
+    payload = [dict(parse_battery_data(battery.data10, battery.data60), time = 1715987138.25)
+               for battery in simulator.batteries]
+
+    body = '\n'.join(to_line_protocol(battery_data) for battery_data in payload).encode('utf-8')
+    print(f"{batteries} batteries, {publishes} publishes")
+    print(f"line protocol    {len(body) / batteries:8.1f} bytes per point")
+    print(f"gzipped          {len(gzip.compress(body, compresslevel = 6)) / batteries:8.1f} bytes per point")
+
+    influxdb = MockInfluxDB().start()
+    try:
+        for compress in (False, True):
+            client = InfluxClient(url = influxdb.url, bucket = "eflex", logger = logger, compress = compress)
+            start = time.perf_counter()
+            for _ in range(publishes):
+                client.publish(payload)
+            elapsed = time.perf_counter() - start
+            client.disconnect()
+            label = "write gzipped" if compress else "write"
+            print(f"{label:15}  {elapsed / (publishes * batteries) * 1e6:8.1f} us per point, {client.requests} requests")
+    finally:
+        influxdb.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batteries", type = int, default = 14)
+    parser.add_argument("--publishes", type = int, default = 200)
+    args = parser.parse_args()
+    run(args.batteries, args.publishes)
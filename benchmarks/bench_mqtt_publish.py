@@ -0,0 +1,96 @@
+"""Compares publishing with paho.mqtt.publish.single (a new connection per publish)
+against the persistent PahoClient connection. Both run inside an asyncio task, the way
+main() publishes, while a heartbeat task measures how long the event loop is stalled.
+
+Run from the project root:
+
+    python -m benchmarks.bench_mqtt_publish [--publishes 50] [--latency 0.005]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import time
+from typing import Callable, List
+import paho.mqtt.publish as publish
+from eflexcan2mqtt.paho_client import PahoClient
+from tests.mock_mqtt_broker import MockMQTTBroker
+
+TOPIC = "eflexbatteries"
+
+logger = logging.getLogger(__name__)
+
+
+def load_payload(battery_count: int = 14) -> List[dict]:
+    with open("sample-battery-data.json", encoding = "utf-8") as sample:
+        batteries = json.load(sample)
+    return [dict(batteries[i % len(batteries)], battery_number = i + 1) for i in range(battery_count)]
+
+
+async def measure(publish_fn: Callable[[], None], publishes: int) -> dict:
+    """Calls publish_fn from the event loop and records how long each call takes,
+    and the largest delay seen by a heartbeat task scheduled every millisecond."""
+
+    stalls: List[float] = []
+    running = True
+
+    async def heartbeat():
+        while running:
+            expected = time.perf_counter() + 0.001
+            await asyncio.sleep(0.001)
+            stalls.append(max(0.0, time.perf_counter() - expected))
+
+    heartbeat_task = asyncio.create_task(heartbeat())
+    latencies: List[float] = []
+    for _ in range(publishes):
+        await asyncio.sleep(0.01)
+        start = time.perf_counter()
+        publish_fn()
+        latencies.append(time.perf_counter() - start)
+
+    running = False
+    await heartbeat_task
+
+    return {
+        'mean': statistics.mean(latencies),
+        'p95': statistics.quantiles(latencies, n = 20)[-1],
+        'max_stall': max(stalls),
+    }
+
+
+def report(name: str, result: dict) -> None:
+    print(f"{name:<22} publish mean {result['mean'] * 1000:8.3f} ms   "
+          f"p95 {result['p95'] * 1000:8.3f} ms   max event loop stall {result['max_stall'] * 1000:8.3f} ms")
+
+
+async def run(publishes: int, latency: float) -> None:
+    broker = MockMQTTBroker(latency = latency).start()
+    payload = load_payload()
+
+    def publish_single():
+        publish.single(topic = TOPIC, hostname = "127.0.0.1", port = broker.port, client_id = "",
+                       qos = 2, keepalive = 60, payload = json.dumps(payload))
+
+    client = PahoClient(topic = TOPIC, hostname = "127.0.0.1", port = broker.port, keepalive = 60,
+                        qos = 2, client_id = "", logger = logger)
+    client.connect()
+    while not client.is_connected:
+        await asyncio.sleep(0.01)
+
+    try:
+        report("publish.single", await measure(publish_single, publishes))
+        report("persistent PahoClient", await measure(lambda: client.publish(payload), publishes))
+        broker.wait_for_messages(publishes * 2)
+    finally:
+        client.disconnect()
+        broker.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--publishes", type = int, default = 50)
+    parser.add_argument("--latency", type = float, default = 0.005, help = "Broker response latency in seconds")
+    args = parser.parse_args()
+    asyncio.run(run(args.publishes, args.latency))
@@ -0,0 +1,63 @@
+"""Frame assembly and publish cost per node, from 8 to 255 simulated nodes, and the number of
+batteries published compared to the original handling, which keyed nodes by the last hex digit
+of the arbitration id. The total cost per node is also shown relative to 8 nodes: it stays about
+1x while the cost per node doesn't grow with the number of nodes, and would reach 16x at 128 nodes
+if it grew linearly.
+
+Run from the project root:
+
+    python -m benchmarks.bench_node_scaling [--cycles 20]
+"""
+
+import argparse
+import logging
+import time
+from eflexcan2mqtt.message_handler import MessageHandler
+from eflexcan2mqtt.mqtt_publisher import MQTTPublisher
+from eflexcan2mqtt.replay import InMemoryMQTTClient
+from eflexcan2mqtt.simulator import BusSimulator
+from .legacy import LegacyMessageHandler
+
+logger = logging.getLogger(__name__)
+
+NODE_COUNTS = (8, 16, 64, 128, 255)
+
+
+def run(cycles: int) -> None:
+    print(f"{cycles} cycles per node count")
+    print(f"{'nodes':>5} {'assembly us/frame':>18} {'publish us/node':>16} {'cost/node vs 8':>15} "
+          f"{'published':>10} {'legacy published':>17}")
+
+    base_cost = None
+    for node_count in NODE_COUNTS:
+        frames = list(BusSimulator(node_count, seed = 1).frames(cycles))
+
+        message_handler = MessageHandler(logger)
+        start = time.perf_counter()
+        for msg in frames:
+            message_handler.on_message_received(msg)
+        assembly_seconds = time.perf_counter() - start
+        assembly = assembly_seconds / len(frames)
+
+        mqtt_client = InMemoryMQTTClient()
+        publisher = MQTTPublisher(logger = logger, message_handler = message_handler, mqtt_client = mqtt_client)
+        start = time.perf_counter()
+        publisher.publish_data()
+        publish = (time.perf_counter() - start) / node_count
+        cost = assembly_seconds / node_count + publish
+        base_cost = base_cost or cost
+
+        legacy_handler = LegacyMessageHandler()
+        for msg in frames:
+            legacy_handler.on_message_received(msg)
+        legacy_published = len(legacy_handler.compiled_message10X_data.keys() & legacy_handler.compiled_message60X_data.keys())
+
+        print(f"{node_count:>5} {assembly * 1e6:>18.2f} {publish * 1e6:>16.2f} {cost / base_cost:>14.2f}x "
+              f"{mqtt_client.batteries:>10} {legacy_published:>17}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cycles", type = int, default = 20)
+    args = parser.parse_args()
+    run(args.cycles)
@@ -0,0 +1,54 @@
+"""Per set cost of sampling the rollup, and cost of summarizing it, for simulated batteries
+publishing a set of messages every second over a publish interval.
+
+Run from the project root:
+
+    python -m benchmarks.bench_rollup [--batteries 14] [--publish-interval 60] [--repeat 20]
+"""
+
+import argparse
+import logging
+import time
+from eflexcan2mqtt.message_handler import MessageHandler
+from eflexcan2mqtt.rollup import Rollup
+from eflexcan2mqtt.simulator import BusSimulator
+
+logger = logging.getLogger(__name__)
+
+
+def run(batteries: int, publish_interval: int, repeat: int) -> None:
+    simulator = BusSimulator(batteries, seed = 1)
+    message_handler = MessageHandler(logger)
+    sets = []
+    for _ in range(publish_interval):
+        simulator.feed(message_handler, cycles = 1)
+        sets.extend((battery.node_id, battery.data10, battery.data60) for battery in simulator.batteries)
+
+    rollup = Rollup(MessageHandler(logger))
+    node_ids = [battery.node_id for battery in simulator.batteries]
+
+    sample_time = summary_time = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for node_id, data10, data60 in sets:
+            rollup._on_set_completed(node_id, data10, data60, 0.0)
+        sample_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        for node_id in node_ids:
+            rollup.summary(node_id)
+        summary_time += time.perf_counter() - start
+        rollup.reset(node_ids)
+
+    print(f"{batteries} batteries, {publish_interval} sets per battery and publish interval")
+    print(f"sample     {sample_time / (repeat * len(sets)) * 1e6:8.2f} us per set")
+    print(f"summarize  {summary_time / (repeat * batteries) * 1e6:8.2f} us per battery")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batteries", type = int, default = 14)
+    parser.add_argument("--publish-interval", type = int, default = 60)
+    parser.add_argument("--repeat", type = int, default = 20)
+    args = parser.parse_args()
+    run(args.batteries, args.publish_interval, args.repeat)
@@ -0,0 +1,50 @@
+"""Encode time and size of the battery data payload of 14 and 64 simulated batteries, for each
+payload format. Formats whose package is not installed are skipped.
+
+Run from the project root:
+
+    python -m benchmarks.bench_serializers [--repeat 2000]
+"""
+
+import argparse
+import time
+from typing import List
+from eflexcan2mqtt.decode import parse_battery_data
+from eflexcan2mqtt.serializers import SERIALIZERS, create_serializer
+from eflexcan2mqtt.simulator import BusSimulator
+
+BATTERY_COUNTS = (14, 64)
+
+
+def simulated_payload(batteries: int) -> List[dict]:
+    simulator = BusSimulator(batteries, seed = 1)
+    for _ in simulator.frames(1):
+        pass
+    return [{**parse_battery_data(battery.data10, battery.data60), 'time': 1715987139} for battery in simulator.batteries]
+
+
+def run(repeat: int) -> None:
+    for batteries in BATTERY_COUNTS:
+        payload = simulated_payload(batteries)
+        print(f"{batteries} batteries, encoded {repeat} times")
+
+        for payload_format in SERIALIZERS:
+            try:
+                serializer = create_serializer(payload_format)
+            except ValueError as e:
+                print(f"  {payload_format:<10} skipped: {e}")
+                continue
+
+            start = time.perf_counter()
+            for _ in range(repeat):
+                data = serializer.serialize(payload)
+            elapsed = (time.perf_counter() - start) / repeat
+
+            print(f"  {payload_format:<10} {elapsed * 1e6:10.1f} us   {len(data):8,} bytes")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type = int, default = 2000)
+    args = parser.parse_args()
+    run(args.repeat)
@@ -0,0 +1,111 @@
+"""Frames per second and CPU time of the event loop thread per frame, reading a replayed mixed
+traffic candump log with the SocketCANReader, compared to a can.Notifier style reader reading
+one frame, into a can.Message, per readiness event.
+
+The frames are sent from another thread over a socket pair, which like a CAN socket keeps the
+frame boundaries, or with --vcan over a virtual CAN interface, which must be up:
+
+    sudo ip link add dev vcan0 type vcan && sudo ip link set up vcan0
+
+Run from the project root:
+
+    python -m benchmarks.bench_socketcan_reader [--repeat 200] [--vcan vcan0]
+"""
+
+import argparse
+import asyncio
+import logging
+import socket
+import threading
+import time
+from typing import Callable, List, Tuple
+from eflexcan2mqtt.message_handler import MessageHandler
+from eflexcan2mqtt.socketcan_reader import SocketCANReader, open_socketcan
+from .frames import load_frames, pack_frames
+from .legacy import LegacySocketReader
+
+logger = logging.getLogger(__name__)
+
+
+class FrameCounter():
+    """Resolves done once total frames are received."""
+
+    def __init__(self, total: int, done: asyncio.Future):
+        self.count = 0
+        self.done = done
+        self._total = total
+
+    def on_message_received(self, msg) -> None:
+        self.count += 1
+        if self.count == self._total:
+            self.done.set_result(None)
+
+
+def open_socket_pair(vcan: str | None, can_filters: List[dict] | None = None) -> Tuple[socket.socket, socket.socket]:
+    """The receiving and sending sockets."""
+    if vcan is None:
+        return socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    sender = socket.socket(socket.AF_CAN, socket.SOCK_RAW, socket.CAN_RAW)
+    sender.bind((vcan,))
+    return open_socketcan(vcan, can_filters), sender
+
+
+def replay(create_reader: Callable, raw_frames: List[bytes], repeat: int, vcan: str | None = None,
+           can_filters: List[dict] | None = None, received: int | None = None) -> Tuple[float, float]:
+    """Replays the frames repeat times to the reader created by create_reader(sock, listeners, loop).
+    With can_filters installed on the vcan socket, only received frames out of each replay reach the
+    reader. Returns the frames received per second, and the event loop thread CPU time per frame
+    received in seconds."""
+
+    loop = asyncio.new_event_loop()
+    receiver, sender = open_socket_pair(vcan, can_filters)
+    total = (len(raw_frames) if received is None else received) * repeat
+    counter = FrameCounter(total, loop.create_future())
+    reader = create_reader(receiver, [MessageHandler(logger), counter], loop)
+
+    def send() -> None:
+        for _ in range(repeat):
+            for raw_frame in raw_frames:
+                sender.send(raw_frame)
+
+    try:
+        reader.start()
+        sender_thread = threading.Thread(target = send)
+        cpu_start, start = time.thread_time(), time.perf_counter()
+        sender_thread.start()
+        loop.run_until_complete(asyncio.wait_for(counter.done, 60))
+        cpu, elapsed = time.thread_time() - cpu_start, time.perf_counter() - start
+        sender_thread.join()
+    finally:
+        reader.stop()
+        receiver.close()
+        sender.close()
+        loop.close()
+
+    return total / elapsed, cpu / total
+
+
+def native_reader(sock: socket.socket, listeners: List, loop: asyncio.AbstractEventLoop) -> SocketCANReader:
+    return SocketCANReader(logger, "bench", listeners, loop, open_socket = lambda: sock)
+
+
+def run(repeat: int, vcan: str | None) -> None:
+    raw_frames = pack_frames(load_frames())
+
+    results = [
+        ("notifier", replay(LegacySocketReader, raw_frames, repeat, vcan)),
+        ("SocketCANReader", replay(native_reader, raw_frames, repeat, vcan)),
+    ]
+
+    print(f"{len(raw_frames)} frames replayed {repeat} times over {vcan or 'a socket pair'}")
+    for name, (frames_per_second, cpu_per_frame) in results:
+        print(f"{name:<16} {frames_per_second:12,.0f} frames/s   {cpu_per_frame * 1e6:6.2f} us CPU per frame")
+    print(f"speedup {results[1][1][0] / results[0][1][0]:5.2f}x   CPU {results[1][1][1] / results[0][1][1]:5.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type = int, default = 200)
+    parser.add_argument("--vcan", help = "A virtual CAN interface to replay the frames over, such as vcan0")
+    args = parser.parse_args()
+    run(args.repeat, args.vcan)
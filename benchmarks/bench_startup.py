@@ -0,0 +1,131 @@
+"""Import time and time to first frame of the service, started in a new interpreter as systemd
+starts it after a restart, compared to importing the modules only needed after the CAN channels
+are read, python-can, psutil, the MQTT client and the split process mode's multiprocessing, eagerly.
+
+Import time is the time main.py spends importing modules, from python -X importtime, with a
+missing config file so it exits once imported. Time to first frame is the time from starting the
+interpreter until the service logs that it reads the CAN channels, from when frames are queued by
+the kernel. The service reads a python-can virtual bus, or with --vcan a virtual CAN interface
+over socketcan, which must be up. The MQTT server it connects to doesn't need to be running.
+
+Exits with status 1 if the median import time is above --budget milliseconds.
+
+Run from the project root:
+
+    python -m benchmarks.bench_startup [--repeat 10] [--budget 150] [--vcan vcan0]
+"""
+
+import argparse
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Set, Tuple
+
+# Modules imported once the CAN channels are read, or only when their feature is used.
+DEFERRED_MODULES = ('can', 'psutil', 'paho.mqtt.client', 'multiprocessing.connection',
+                    'multiprocessing.shared_memory', 'http.client', 'sqlite3', 'cProfile', 'tracemalloc')
+
+CONFIG = """
+[logging]
+log_dir={log_dir}
+
+[can]
+interface={interface}
+channel={channel}
+
+[mqtt]
+hostname=127.0.0.1
+port=1
+topic=eflexbatteries
+publish_interval=3600
+"""
+
+FIRST_FRAME_LOG = "Reading CAN channels"
+
+
+def import_time(args: List[str]) -> Tuple[float, Set[str]]:
+    """The total import time in seconds of running python with args, and the modules imported."""
+
+    result = subprocess.run([sys.executable, '-X', 'importtime', *args], capture_output = True, text = True)
+    total = 0
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        modules.add(name.strip())
+        # Only top level imports are counted, as their cumulative time includes the nested imports.
+        if not name.startswith('  '):
+            total += int(cumulative)
+    return total / 1e6, modules
+
+
+def time_to_first_frame(config_path: str, log_path: str, timeout: float = 30) -> float:
+    """Seconds from starting the service until it logs that it reads the CAN channels."""
+
+    if os.path.exists(log_path):
+        os.remove(log_path)
+    start = time.perf_counter()
+    service = subprocess.Popen([sys.executable, 'main.py', '--config_path', config_path],
+                               stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            if os.path.exists(log_path):
+                with open(log_path) as log:
+                    if FIRST_FRAME_LOG in log.read():
+                        return time.perf_counter() - start
+            if service.poll() is not None:
+                raise RuntimeError(f"The service exited with code {service.returncode}, see {log_path}.")
+            time.sleep(0.001)
+        raise RuntimeError(f"The service didn't read the CAN channels within {timeout} s, see {log_path}.")
+    finally:
+        service.send_signal(signal.SIGTERM)
+        try:
+            service.wait(10)
+        except subprocess.TimeoutExpired:
+            service.kill()
+
+
+def run(repeat: int, budget: float, vcan: str | None) -> bool:
+    missing_config = os.path.join(tempfile.gettempdir(), 'eflexcan2mqtt-missing.ini')
+    import_times = []
+    for _ in range(repeat):
+        seconds, modules = import_time(['main.py', '--config_path', missing_config])
+        import_times.append(seconds)
+    eager_imports = ''.join(f"import {module}\n" for module in DEFERRED_MODULES)
+    eager_times = [import_time(['-c', f"{eager_imports}import runpy\nrunpy.run_path('main.py', run_name = '__main__')",
+                                '--config_path', missing_config])[0] for _ in range(repeat)]
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        config_path = os.path.join(log_dir, 'eflexcan2mqtt.ini')
+        with open(config_path, 'w') as file:
+            file.write(CONFIG.format(log_dir = log_dir, interface = 'socketcan' if vcan else 'virtual',
+                                     channel = vcan or 'bench_startup'))
+        first_frame_times = [time_to_first_frame(config_path, os.path.join(log_dir, 'eflexcan2mqtt.out'))
+                             for _ in range(repeat)]
+
+    median = statistics.median(import_times)
+    print(f"main.py started {repeat} times, reading {vcan or 'a virtual python-can bus'}")
+    print(f"import time          {median * 1e3:8.1f} ms median   {min(import_times) * 1e3:8.1f} ms min")
+    print(f"eager import time    {statistics.median(eager_times) * 1e3:8.1f} ms median   {min(eager_times) * 1e3:8.1f} ms min")
+    print(f"time to first frame  {statistics.median(first_frame_times) * 1e3:8.1f} ms median   "
+          f"{min(first_frame_times) * 1e3:8.1f} ms min")
+    print(f"deferred modules imported on startup: {', '.join(sorted(modules.intersection(DEFERRED_MODULES))) or 'none'}")
+
+    if median > budget / 1e3:
+        print(f"Import time is above the {budget:.0f} ms budget.")
+        return False
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type = int, default = 10)
+    parser.add_argument("--budget", type = float, default = 150, help = "Maximum median import time, in milliseconds")
+    parser.add_argument("--vcan", help = "A virtual CAN interface to read, such as vcan0")
+    args = parser.parse_args()
+    sys.exit(0 if run(args.repeat, args.budget, args.vcan) else 1)
@@ -0,0 +1,25 @@
+"""
+Frame streams for the benchmarks.
+"""
+
+import os
+from typing import List
+import can
+from eflexcan2mqtt.socketcan_reader import CAN_EFF_FLAG, CAN_FRAME
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+# Three batteries captured from a real bus, interleaved with inverter traffic. Two out of three
+# frames are not battery messages.
+MIXED_TRAFFIC_LOG = os.path.join(DATA_DIR, "eflex-mixed.log")
+
+
+def load_frames(path: str = MIXED_TRAFFIC_LOG) -> List[can.Message]:
+    """Reads all frames of a candump -L log file."""
+    return list(can.io.CanutilsLogReader(path))
+
+
+def pack_frames(frames: List[can.Message]) -> List[bytes]:
+    """The frames as the can_frame structs read from a socketcan socket."""
+    return [CAN_FRAME.pack(frame.arbitration_id | (CAN_EFF_FLAG if frame.is_extended_id else 0), frame.dlc, bytes(frame.data))
+            for frame in frames]
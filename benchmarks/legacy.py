@@ -0,0 +1,170 @@
+"""
+Original implementations of the frame handling and decoding hot paths, kept unchanged
+as the baseline the benchmarks compare against.
+"""
+
+import struct
+import time
+from typing import List
+from can.listener import Listener
+from can.message import Message
+
+MSG_ID_10X_COUNT = 11
+MSG_ID_60X_COUNT = 7
+MSG_10X_FIRST_BYTE_ORDER = [0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x07, 0x08, 0x09, 0x0A, 0x0B]
+MSG_60X_FIRST_BYTE_ORDER = [0x01, 0x02, 0x03, 0x04, 0x05, 0x06]
+MSG_TYPE_10 = '10'
+MSG_TYPE_60 = '60'
+
+
+def parse_arbitration_id(arbitration_id: int):
+    message_id = hex(arbitration_id)[2:5]
+    node_id = str(int(message_id[-1], base=16))
+    message_type = message_id[0:2]
+    return (message_id, node_id, message_type)
+
+
+def parse_serial(serial_bytes: List) -> str:
+    parts = struct.unpack(">cH", bytearray(serial_bytes[4:8]))
+    return (hex(serial_bytes[0]).removeprefix('0x').zfill(2)
+    + hex(serial_bytes[1]).removeprefix('0x').zfill(2)
+    + str(serial_bytes[2])
+    + hex(serial_bytes[3]).removeprefix('0x').zfill(2)
+    + str(parts[0], "UTF-8")
+    + str(parts[1]).zfill(4)
+    )
+
+
+def parse_cell_voltages(data60) -> List[int]:
+    return list(struct.unpack('<HHHHHHHHHHHHHHHH', bytearray(data60[0:32])))
+
+
+def parse_battery_data(data10: List[int], data60: List[int]) -> dict:
+    battery_number, batteries_in_system, battery_voltage, battery_current, battery_soc = struct.unpack('>BBHhB', bytearray(data10[0:7]))
+    average_system_voltage, = struct.unpack(">H", bytearray(data10[10:12]))
+    software_version, hardware_version = struct.unpack('>Hc', bytearray(data10[46:49]))
+    cell_voltages = parse_cell_voltages(data60)
+    pre_volt, insulation_resistance = struct.unpack(">HH", bytearray(data10[35:39]))
+
+    return {
+        'battery_id': parse_serial(data10[49:56]),
+        'battery_number': battery_number,
+        'batteries_in_system': batteries_in_system,
+        'battery_soc': battery_soc,
+        'battery_voltage': battery_voltage/10,
+        'battery_current': battery_current/10,
+        'system_average_voltage': average_system_voltage/10,
+        'pre_volt': pre_volt/10,
+        'insulation_resistance': insulation_resistance,
+        'software_version' : software_version,
+        'hardware_version' : str(hardware_version, 'UTF-8'),
+        'lifetime_discharge_energy' : struct.unpack('>I', bytearray(data10[31:35]))[0],
+        'cell_voltages' : cell_voltages
+    }
+
+
+def _all_messages_received(message_type: str, aggregated_messages: List[Message]) -> bool:
+    message_count = len(aggregated_messages)
+
+    if (message_type == MSG_TYPE_10):
+        if (message_count != MSG_ID_10X_COUNT):
+            return False
+
+        for i, msg in enumerate(aggregated_messages):
+            if msg.data[0] != MSG_10X_FIRST_BYTE_ORDER[i]:
+                return False
+        return True
+
+    elif (message_type == MSG_TYPE_60):
+        if (message_count != MSG_ID_60X_COUNT):
+            return False
+
+        for i, msg in enumerate(aggregated_messages):
+            if i < MSG_ID_60X_COUNT - 1:
+                if msg.data[0] != MSG_60X_FIRST_BYTE_ORDER[i]:
+                    return False
+        return True
+    else:
+        raise ValueError("The argument message_type expected to either be %s or %s", MSG_TYPE_10, MSG_TYPE_60)
+
+
+class LegacyMessageHandler(Listener):
+    """The original MessageHandler, with per instance state."""
+
+    def __init__(self):
+        self._compiled_message10X_data: dict[str, List[int]] = {}
+        self._compiled_message60X_data: dict[str, List[int]] = {}
+        self._aggregated_messages: dict[str, List[Message]] = {}
+        self._timestamps: dict[str, float] = {}
+
+    def on_message_received(self, msg: Message) -> None:
+        message_id, node_id, message_type = parse_arbitration_id(msg.arbitration_id)
+
+        if message_type not in (MSG_TYPE_10, MSG_TYPE_60):
+            return
+
+        if msg.data[0] == 0x01:
+            self._aggregated_messages[message_id] = []
+        elif message_id not in self._aggregated_messages.keys():
+            return
+
+        self._aggregated_messages[message_id].append(msg)
+
+        if _all_messages_received(message_type, self._aggregated_messages[message_id]):
+            compiled_data = []
+
+            for message in self._aggregated_messages[message_id]:
+                compiled_data += message.data[1:8]
+
+            if message_type == MSG_TYPE_10:
+                self._compiled_message10X_data[node_id] = compiled_data
+
+            if message_type == MSG_TYPE_60:
+                self._compiled_message60X_data[node_id] = compiled_data
+                self._timestamps[node_id] = msg.timestamp
+
+            self._aggregated_messages[message_id] = []
+
+    @property
+    def compiled_message10X_data(self):
+        return self._compiled_message10X_data
+
+    @property
+    def compiled_message60X_data(self):
+        return self._compiled_message60X_data
+
+    @property
+    def timestamps(self):
+        return self._timestamps
+
+
+CAN_FRAME = struct.Struct("=IB3x8s")
+
+
+class LegacySocketReader():
+    """A can.Notifier reading a socketcan bus on the event loop: the socket is read once per
+    readiness event, and a can.Message built for each frame, as SocketcanBus.recv does."""
+
+    def __init__(self, sock, listeners: List[Listener], loop):
+        self._sock = sock
+        self._listeners = listeners
+        self._loop = loop
+
+    def start(self) -> None:
+        self._sock.setblocking(False)
+        self._loop.add_reader(self._sock.fileno(), self._on_message_available)
+
+    def _on_message_available(self) -> None:
+        try:
+            raw_frame = self._sock.recv(CAN_FRAME.size)
+        except BlockingIOError:
+            return
+        can_id, length, data = CAN_FRAME.unpack(raw_frame)
+        msg = Message(timestamp = time.time(), arbitration_id = can_id & 0x1FFFFFFF,
+                      is_extended_id = bool(can_id & 0x80000000), is_remote_frame = bool(can_id & 0x40000000),
+                      is_error_frame = bool(can_id & 0x20000000), dlc = length, data = data[:length])
+        for listener in self._listeners:
+            listener.on_message_received(msg)
+
+    def stop(self) -> None:
+        self._loop.remove_reader(self._sock.fileno())
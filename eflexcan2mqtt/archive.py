@@ -0,0 +1,442 @@
+"""
+Local archive of battery samples, in per-day columnar files.
+
+Each set of messages compiled by the MessageHandler is archived as a sample row. The rows of a
+UTC day are stored in a segment directory named after the day, with one file per column. Every
+column has a fixed width, so row i of a column is at offset i * width, and the values are stored
+raw, in the units of the CAN data, in the host's byte order:
+
+    time                        float64, Unix time
+    node_id                     uint8
+    battery_voltage             uint16, in 0.1 V
+    battery_current             int16, in 0.1 A
+    battery_soc                 uint8
+    system_average_voltage      uint16, in 0.1 V
+    lifetime_discharge_energy   uint32
+    pre_volt                    uint16, in 0.1 V
+    insulation_resistance       uint16
+    cell_voltages               16 x uint16, in mV
+
+Sample times never decrease within a segment, so the rows of a time range are found by bisecting
+the time column. Once a segment is closed at the end of its day, each column is compressed with
+zlib, and the segments older than the retention period are deleted, by close_segments.
+
+Segments are read with ArchiveSegment, which memory-maps the columns of uncompressed segments,
+so only the pages of the rows read are loaded. The columns of compressed segments are decompressed
+one segment at a time. read_samples reads the samples of a time range, segment by segment.
+
+The archive can also be read from the command line:
+
+    python -m eflexcan2mqtt.archive /var/lib/eflexcan2mqtt/archive/can0 --start 2026-10-01 --end 2026-10-08
+"""
+
+import argparse
+import bisect
+import calendar
+import csv
+import mmap
+import os
+import shutil
+import sys
+import time
+import zlib
+from array import array
+from datetime import datetime, timezone
+from logging import Logger
+from struct import Struct
+from typing import Collection, Iterator, List, Tuple
+
+from .message_handler import MessageHandler
+
+DEFAULT_RETENTION_DAYS = 30
+DEFAULT_FLUSH_ROWS = 256
+
+CELL_COUNT = 16
+
+# (name, array typecode, values per row, divisor to the decoded value) of each column.
+COLUMNS: Tuple[Tuple[str, str, int, int], ...] = (
+    ('time', 'd', 1, 1),
+    ('node_id', 'B', 1, 1),
+    ('battery_voltage', 'H', 1, 10),
+    ('battery_current', 'h', 1, 10),
+    ('battery_soc', 'B', 1, 1),
+    ('system_average_voltage', 'H', 1, 10),
+    ('lifetime_discharge_energy', 'I', 1, 1),
+    ('pre_volt', 'H', 1, 10),
+    ('insulation_resistance', 'H', 1, 1),
+    ('cell_voltages', 'H', CELL_COUNT, 1),
+)
+
+COMPRESSED_EXTENSION = '.z'
+
+# The numeric fields of the compiled 10X data, in the order of COLUMNS. See decode._DATA10.
+_SAMPLE10 = Struct(">2xHhB3xH19xIHH")
+
+# The cell voltages at the start of the compiled 60X data, little-endian.
+_CELL_VOLTAGES = Struct("<16H")
+
+_DAY_FORMAT = '%Y-%m-%d'
+_SECONDS_PER_DAY = 86400
+
+
+def _day(timestamp: float) -> str:
+    return time.strftime(_DAY_FORMAT, time.gmtime(timestamp))
+
+
+def _day_start(day: str) -> int:
+    return calendar.timegm(time.strptime(day, _DAY_FORMAT))
+
+
+def _segment_days(path: str) -> List[str]:
+    """The days of the segments in the archive directory, oldest first."""
+    days = []
+    for name in os.listdir(path):
+        try:
+            time.strptime(name, _DAY_FORMAT)
+        except ValueError:
+            continue
+        days.append(name)
+    return sorted(days)
+
+
+def _is_compressed(segment_path: str) -> bool:
+    return os.path.exists(os.path.join(segment_path, COLUMNS[0][0] + COMPRESSED_EXTENSION))
+
+
+class SampleArchive():
+    """Appends a sample row of every set of messages compiled by the MessageHandler to the segment
+    of the day of its timestamp, in the archive directory.
+
+    Rows are buffered in memory and appended to the column files every flush_rows rows, and on
+    flush and close. At most flush_rows rows are lost if the process is killed. When the rows can't
+    be written, such as when the disk is full, the error is logged, and the buffered rows are
+    dropped and counted in lost_rows, so the frames are still handled and the buffers don't grow.
+
+    Samples are added as the sets are completed, while the CAN frames are handled, so add only
+    switches to the segment of the next day. Compressing the closed segments and deleting the
+    expired ones reads and writes whole segments, and is done by close_segments, which is called
+    from a worker thread.
+    """
+
+    _buffers: List[array]
+
+    # Days of the segments closed, but not compressed yet.
+    _closed_days: List[str]
+
+    def __init__(self, path: str, logger: Logger, message_handler: MessageHandler | None = None,
+                 retention_days: int = DEFAULT_RETENTION_DAYS, compress: bool = True,
+                 flush_rows: int = DEFAULT_FLUSH_ROWS):
+        self._path = path
+        self._logger = logger
+        self._retention_days = retention_days
+        self._compress = compress
+        self._flush_rows = flush_rows
+
+        self._buffers = [array(typecode) for _, typecode, _, _ in COLUMNS]
+        self._buffered_rows = 0
+        self._segment_day: str | None = None
+        self._segment_start = 0.0
+        self._segment_end = 0.0
+        self._last_time = 0.0
+        self._flush_failed = False
+        self.rows = 0
+        self.lost_rows = 0
+
+        os.makedirs(path, exist_ok = True)
+
+        # The segments left open by a previous run, other than today's, are closed by close_segments.
+        today = _day(time.time())
+        self._closed_days = [day for day in _segment_days(path) if day != today]
+        self._expire_due = True
+
+        if message_handler is not None:
+            message_handler.add_set_completed_callback(self.add)
+
+    def add(self, node_id: int, data10: bytes, data60: bytes, timestamp: float) -> None:
+        """Archives a sample of the compiled 10X and 60X data of the node."""
+
+        if not self._segment_start <= timestamp < self._segment_end:
+            self._open_segment(_day(timestamp))
+
+        # Frames of different nodes may arrive slightly out of order. Sample times are kept
+        # non-decreasing, so that the rows of a time range can be found by bisecting.
+        if timestamp < self._last_time:
+            timestamp = self._last_time
+        self._last_time = timestamp
+
+        buffers = self._buffers
+        buffers[0].append(timestamp)
+        buffers[1].append(node_id)
+        for buffer, value in zip(buffers[2:9], _SAMPLE10.unpack_from(data10)):
+            buffer.append(value)
+        buffers[9].extend(_CELL_VOLTAGES.unpack_from(data60))
+
+        self._buffered_rows += 1
+        self.rows += 1
+        if self._buffered_rows >= self._flush_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        """Appends the buffered rows to the column files of the open segment."""
+
+        if not self._buffered_rows:
+            return
+        segment_path = os.path.join(self._path, self._segment_day)
+        try:
+            for (name, _, _, _), buffer in zip(COLUMNS, self._buffers):
+                with open(os.path.join(segment_path, name), 'ab') as file:
+                    buffer.tofile(file)
+        except OSError as e:
+            self.lost_rows += self._buffered_rows
+            # Logged once, until rows are written again, as it fails every flush_rows samples.
+            if not self._flush_failed:
+                self._flush_failed = True
+                self._logger.error("Failed to write archive segment %s. Samples are dropped until it can be written.",
+                                   self._segment_day, exc_info = e)
+            try:
+                # The columns the rows were appended to before the error are truncated to the others.
+                self._truncate_partial_rows(segment_path)
+            except OSError:
+                pass
+        else:
+            if self._flush_failed:
+                self._flush_failed = False
+                self._logger.warning("Archive segment %s written again. %s samples were dropped.",
+                                     self._segment_day, self.lost_rows)
+        finally:
+            for buffer in self._buffers:
+                del buffer[:]
+            self._buffered_rows = 0
+
+    def close(self) -> None:
+        """Flushes the buffered rows. The segment of the day is left open, to be appended to after a restart."""
+        self.flush()
+
+    @property
+    def close_segments_due(self) -> bool:
+        """Whether there are closed segments to compress, or expired segments may need deleting."""
+        return self._expire_due
+
+    def close_segments(self) -> None:
+        """Compresses the closed segments, and deletes the segments older than the retention period.
+        It may be called from another thread than add, but not from two threads at once."""
+
+        self._expire_due = False
+        while self._closed_days:
+            self._close_segment(self._closed_days.pop(0))
+        self._expire(self._segment_day or _day(time.time()))
+
+    def _open_segment(self, day: str) -> None:
+        self.flush()
+        previous_day = self._segment_day
+        if previous_day is not None and day < previous_day:
+            # A timestamp of a previous day, such as after the clock was set back. The sample is
+            # archived in the open segment, at the time of the last sample.
+            self._segment_start = float('-inf')
+            return
+
+        segment_path = os.path.join(self._path, day)
+        os.makedirs(segment_path, exist_ok = True)
+        if _is_compressed(segment_path):
+            self._decompress_segment(segment_path)
+        self._truncate_partial_rows(segment_path)
+
+        self._segment_day = day
+        self._segment_start = _day_start(day)
+        self._segment_end = self._segment_start + _SECONDS_PER_DAY
+        self._last_time = self._read_last_time(segment_path)
+
+        if previous_day is not None:
+            self._closed_days.append(previous_day)
+            self._expire_due = True
+
+    def _close_segment(self, day: str) -> None:
+        segment_path = os.path.join(self._path, day)
+        if self._compress and not _is_compressed(segment_path):
+            self._truncate_partial_rows(segment_path)
+            self._compress_segment(segment_path)
+
+    def _expire(self, today: str) -> None:
+        """Deletes the segments older than the retention period."""
+
+        if self._retention_days <= 0:
+            return
+        oldest_day = _day(_day_start(today) - self._retention_days * _SECONDS_PER_DAY)
+        for day in _segment_days(self._path):
+            if day < oldest_day:
+                shutil.rmtree(os.path.join(self._path, day))
+                self._logger.info("Deleted archive segment %s, older than %s days.", day, self._retention_days)
+
+    @staticmethod
+    def _read_last_time(segment_path: str) -> float:
+        """The time of the last row of a segment appended to by a previous run, or 0."""
+        last_time = array('d')
+        time_path = os.path.join(segment_path, COLUMNS[0][0])
+        if os.path.exists(time_path) and os.path.getsize(time_path) >= last_time.itemsize:
+            with open(time_path, 'rb') as file:
+                file.seek(-last_time.itemsize, os.SEEK_END)
+                last_time.frombytes(file.read())
+            return last_time[0]
+        return 0.0
+
+    @staticmethod
+    def _truncate_partial_rows(segment_path: str) -> None:
+        """Truncates the columns to the rows written to all of them, should the process have been
+        killed while appending rows."""
+
+        sizes = []
+        for name, typecode, count, _ in COLUMNS:
+            column_path = os.path.join(segment_path, name)
+            width = array(typecode).itemsize * count
+            sizes.append((column_path, width, os.path.getsize(column_path) if os.path.exists(column_path) else 0))
+
+        rows = min(size // width for _, width, size in sizes)
+        for column_path, width, size in sizes:
+            if size > rows * width:
+                os.truncate(column_path, rows * width)
+
+    @staticmethod
+    def _compress_segment(segment_path: str) -> None:
+        for name, _, _, _ in COLUMNS:
+            column_path = os.path.join(segment_path, name)
+            if not os.path.exists(column_path):
+                continue
+            with open(column_path, 'rb') as file:
+                data = zlib.compress(file.read())
+            with open(column_path + COMPRESSED_EXTENSION + '.tmp', 'wb') as file:
+                file.write(data)
+            os.replace(column_path + COMPRESSED_EXTENSION + '.tmp', column_path + COMPRESSED_EXTENSION)
+            os.remove(column_path)
+
+    @staticmethod
+    def _decompress_segment(segment_path: str) -> None:
+        for name, _, _, _ in COLUMNS:
+            column_path = os.path.join(segment_path, name)
+            if not os.path.exists(column_path + COMPRESSED_EXTENSION):
+                continue
+            with open(column_path + COMPRESSED_EXTENSION, 'rb') as file:
+                data = zlib.decompress(file.read())
+            with open(column_path, 'wb') as file:
+                file.write(data)
+            os.remove(column_path + COMPRESSED_EXTENSION)
+
+
+class ArchiveSegment():
+    """The columns of a segment, as memoryviews of their values. Columns of an uncompressed segment
+    are memory-mapped, columns of a compressed segment are decompressed into memory.
+
+    The memoryviews are only valid until the segment is closed.
+    """
+
+    _columns: dict[str, memoryview]
+
+    def __init__(self, segment_path: str):
+        self.path = segment_path
+        self._mmaps: List[mmap.mmap] = []
+        self._views: List[memoryview] = []
+        self._columns = {}
+
+        rows = None
+        for name, typecode, count, _ in COLUMNS:
+            column = self._open_column(os.path.join(segment_path, name), typecode)
+            self._columns[name] = column
+            column_rows = len(column) // count
+            rows = column_rows if rows is None else min(rows, column_rows)
+        self.rows = rows or 0
+
+    def _open_column(self, column_path: str, typecode: str) -> memoryview:
+        if os.path.exists(column_path + COMPRESSED_EXTENSION):
+            with open(column_path + COMPRESSED_EXTENSION, 'rb') as file:
+                data = zlib.decompress(file.read())
+            return self._view(memoryview(data), typecode)
+
+        if not os.path.exists(column_path) or os.path.getsize(column_path) == 0:
+            return memoryview(array(typecode))
+
+        with open(column_path, 'rb') as file:
+            column_mmap = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+        self._mmaps.append(column_mmap)
+        view = memoryview(column_mmap)
+        self._views.append(view)
+        # Ignore the bytes of a row being appended while the segment is read.
+        itemsize = array(typecode).itemsize
+        return self._view(view[:len(view) - len(view) % itemsize], typecode)
+
+    def _view(self, data: memoryview, typecode: str) -> memoryview:
+        view = data.cast(typecode)
+        self._views.extend((data, view))
+        return view
+
+    def column(self, name: str) -> memoryview:
+        """The values of the column. cell_voltages has 16 values per row."""
+        return self._columns[name]
+
+    def row_range(self, start: float, end: float) -> Tuple[int, int]:
+        """The first and past the last row with a time in [start, end)."""
+        times = self._columns['time'][:self.rows]
+        return bisect.bisect_left(times, start), bisect.bisect_left(times, end)
+
+    def close(self) -> None:
+        self._columns.clear()
+        for view in reversed(self._views):
+            view.release()
+        self._views.clear()
+        for column_mmap in self._mmaps:
+            column_mmap.close()
+        self._mmaps.clear()
+
+    def __enter__(self) -> 'ArchiveSegment':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def read_samples(path: str, start: float, end: float, node_ids: Collection[int] | None = None) -> Iterator[dict]:
+    """Reads the samples archived in [start, end), of the node ids if given, as dicts of their
+    decoded values. Segments are read one at a time, so a range of weeks is not loaded at once."""
+
+    first_day, last_day = _day(start), _day(end)
+    for day in _segment_days(path):
+        if not first_day <= day <= last_day:
+            continue
+        with ArchiveSegment(os.path.join(path, day)) as segment:
+            first, last = segment.row_range(start, end)
+            columns = [(name, segment.column(name), count, divisor) for name, _, count, divisor in COLUMNS]
+            node_id_column = segment.column('node_id')
+            for row in range(first, last):
+                if node_ids is not None and node_id_column[row] not in node_ids:
+                    continue
+                sample = {}
+                for name, column, count, divisor in columns:
+                    if count > 1:
+                        sample[name] = column[row * count:(row + 1) * count].tolist()
+                    else:
+                        sample[name] = column[row] / divisor if divisor != 1 else column[row]
+                yield sample
+
+
+def _parse_time(value: str) -> float:
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo = timezone.utc)
+    return moment.timestamp()
+
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description = "Prints archived battery samples as CSV.")
+    parser.add_argument("path", help = "Archive directory of a CAN channel.")
+    parser.add_argument("--start", type = _parse_time, default = 0.0, help = "ISO 8601 start time, UTC unless given.")
+    parser.add_argument("--end", type = _parse_time, default = float(2 ** 32), help = "ISO 8601 end time, UTC unless given.")
+    parser.add_argument("--node", type = int, action = "append", help = "Node id to print. May be repeated.")
+    args = parser.parse_args(argv)
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow([name if count == 1 else f"{name}_{i + 1}" for name, _, count, _ in COLUMNS for i in range(count)])
+    for sample in read_samples(args.path, args.start, args.end, args.node):
+        writer.writerow([value for name, _, count, _ in COLUMNS
+                         for value in (sample[name] if count > 1 else (sample[name],))])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Checkpoint of the assembled battery data and publish watermarks, for warm restarts.
+
+Without it, a restarted service has no battery data until every node has sent a full cycle of
+10X and 60X messages, and publishes nothing until the next publish interval after that. The
+checkpoint keeps, per node, the latest compiled 10X and 60X data and its timestamp, and the
+timestamp of the data last published, so a restarted service can publish straight away, and
+doesn't publish again data it published before it was stopped.
+
+The checkpoint is a small binary file:
+
+    header  magic, version, the number of nodes and the time it was written
+    node    node id, whether it has data, its timestamp and published timestamp, 77 bytes of 10X and 49 of 60X data
+    crc32   of the header and nodes
+
+It is written to a temporary file, synced and renamed over the previous checkpoint, so a
+checkpoint is never partially written, even if the service or the system stops while it's written.
+"""
+import os
+import time
+import zlib
+from logging import Logger
+from struct import Struct
+from typing import Collection, List, NamedTuple, Tuple
+
+from .decode import MAX_NODE_ID
+from .message_handler import MSG_10X_DATA_LENGTH, MSG_60X_DATA_LENGTH
+
+MAGIC = b'EFXC'
+VERSION = 1
+
+# Magic, version, number of nodes and the time written.
+_HEADER = Struct("<4sHHd")
+# Node id, whether it has data, timestamp, published timestamp (0 if never published), 10X and 60X data.
+_NODE = Struct(f"<B?6xdd{MSG_10X_DATA_LENGTH}s{MSG_60X_DATA_LENGTH}s")
+_CRC = Struct("<I")
+
+
+class NodeState(NamedTuple):
+    node_id: int
+    # None if only the node's published timestamp was kept.
+    data10: bytes | None
+    data60: bytes | None
+    timestamp: float
+    published_timestamp: float | None
+
+
+class Checkpoint():
+    """Saves and loads the battery data and publish watermarks of a channel to and from a checkpoint file."""
+
+    def __init__(self, path: str, logger: Logger):
+        self._path = path
+        self._logger = logger
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def save(self, battery_data: Collection[Tuple[int, bytes, bytes, float]], published_timestamps: dict[int, float]) -> int:
+        """Writes the (node_id, data10, data60, timestamp) battery data of each node, and the published
+        timestamps, replacing the previous checkpoint. Returns the size of the checkpoint in bytes."""
+
+        nodes = [_NODE.pack(node_id, True, timestamp, published_timestamps.get(node_id, 0.0), data10, data60)
+                 for node_id, data10, data60, timestamp in battery_data]
+        with_data = {node_id for node_id, _, _, _ in battery_data}
+        nodes += [_NODE.pack(node_id, False, 0.0, published_timestamp, b'', b'')
+                  for node_id, published_timestamp in published_timestamps.items() if node_id not in with_data]
+
+        data = _HEADER.pack(MAGIC, VERSION, len(nodes), time.time()) + b''.join(nodes)
+        data += _CRC.pack(zlib.crc32(data))
+
+        temporary_path = self._path + '.tmp'
+        with open(temporary_path, 'wb') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, self._path)
+        return len(data)
+
+    def load(self) -> List[NodeState]:
+        """The state of each node in the checkpoint, or none if there is no checkpoint, or it is not
+        a valid version VERSION checkpoint, which is logged."""
+
+        try:
+            with open(self._path, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return []
+
+        try:
+            return self._parse(data)
+        except ValueError as e:
+            self._logger.warning("Checkpoint %s is ignored: %s", self._path, e)
+            return []
+
+    @staticmethod
+    def _parse(data: bytes) -> List[NodeState]:
+        if len(data) < _HEADER.size + _CRC.size:
+            raise ValueError(f"{len(data)} bytes is too short.")
+        magic, version, count, _ = _HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a version {VERSION} checkpoint.")
+        if len(data) != _HEADER.size + count * _NODE.size + _CRC.size:
+            raise ValueError(f"{len(data)} bytes is the wrong size for {count} nodes.")
+        if _CRC.unpack_from(data, len(data) - _CRC.size)[0] != zlib.crc32(data[:-_CRC.size]):
+            raise ValueError("Its crc32 doesn't match.")
+
+        nodes = []
+        for node_id, has_data, timestamp, published_timestamp, data10, data60 in _NODE.iter_unpack(data[_HEADER.size:-_CRC.size]):
+            if node_id > MAX_NODE_ID:
+                raise ValueError(f"Node id {node_id} is out of range.")
+            nodes.append(NodeState(node_id, data10 if has_data else None, data60 if has_data else None,
+                                   timestamp, published_timestamp or None))
+        return nodes
@@ -0,0 +1,106 @@
+"""
+Reads the CAN channel configuration.
+
+A single CAN channel is configured with the [can] section, as before. Several CAN channels,
+such as one per battery bank, are configured with one [can.<name>] section each, and are all
+ingested by the same process:
+
+    [can.bank1]
+    interface=socketcan
+    channel=can0
+
+    [can.bank2]
+    channel=can1
+    # Optional. Defaults to the [mqtt] topic followed by /<name>, here eflexbatteries/bank2.
+    topic=eflexbatteries/garage
+
+The interface defaults to the [can] section interface, or socketcan. Each channel keeps its
+own battery data, and spools to its own file, named after the [spool] path with the channel
+name added before the extension (spool.bank1.db, spool.bank2.db). Its checkpoint file is named
+after the [checkpoint] path the same way.
+
+Only the frames of the 0x10X and 0x60X battery message families are received, filtered by the
+kernel on socketcan, unless filter=no. Other families can be received too, with extra_families,
+such as extra_families=0x300. Both default to those of the [can] section.
+"""
+
+import configparser
+import os
+from typing import List, NamedTuple, Tuple
+from .decode import BATTERY_CAN_FILTERS, can_filters
+
+CAN_SECTION = 'can'
+CAN_CHANNEL_SECTION_PREFIX = 'can.'
+
+
+class CANChannelConfig(NamedTuple):
+    name: str
+    interface: str
+    channel: str
+    topic: str
+    spool_path: str
+    # None to receive all frames.
+    can_filters: Tuple[dict, ...] | None = BATTERY_CAN_FILTERS
+    checkpoint_path: str = ''
+
+
+def _channel_can_filters(section: configparser.SectionProxy, default_section: configparser.SectionProxy | None) -> Tuple[dict, ...] | None:
+    filter_frames = default_section.getboolean('filter', fallback = True) if default_section is not None else True
+    extra_families = default_section.get('extra_families', '') if default_section is not None else ''
+
+    if not section.getboolean('filter', fallback = filter_frames):
+        return None
+    try:
+        families = [int(family, 0) for family in section.get('extra_families', extra_families).replace(',', ' ').split()]
+    except ValueError as e:
+        raise ValueError(f"CAN extra_families of [{section.name}] is not a list of message families: {e}") from e
+    return can_filters(families)
+
+
+def _channel_file_path(path: str, name: str) -> str:
+    if not path:
+        return ''
+    root, extension = os.path.splitext(path)
+    return f"{root}.{name}{extension}"
+
+
+def load_can_channels(config_parser: configparser.ConfigParser, mqtt_topic: str, spool_path: str = '',
+                      checkpoint_path: str = '') -> List[CANChannelConfig]:
+    """Reads the [can.<name>] sections, or the [can] section if there are none. Raises ValueError if
+    no channel is configured, a channel is missing, or the same channel is configured twice."""
+
+    default_interface = config_parser.get(CAN_SECTION, 'interface', fallback = 'socketcan')
+    default_section = config_parser[CAN_SECTION] if config_parser.has_section(CAN_SECTION) else None
+    sections = [section for section in config_parser.sections() if section.startswith(CAN_CHANNEL_SECTION_PREFIX)]
+
+    channels: List[CANChannelConfig] = []
+    if sections:
+        for section in sections:
+            name = section[len(CAN_CHANNEL_SECTION_PREFIX):]
+            channels.append(CANChannelConfig(
+                name = name,
+                interface = config_parser[section].get('interface', default_interface),
+                channel = config_parser[section].get('channel', ''),
+                topic = config_parser[section].get('topic', f"{mqtt_topic}/{name}"),
+                spool_path = _channel_file_path(spool_path, name),
+                can_filters = _channel_can_filters(config_parser[section], default_section),
+                checkpoint_path = _channel_file_path(checkpoint_path, name),
+            ))
+    elif config_parser.has_section(CAN_SECTION):
+        channel_name = config_parser[CAN_SECTION].get('channel', '')
+        channels.append(CANChannelConfig(name = channel_name, interface = default_interface, channel = channel_name,
+                                         topic = mqtt_topic, spool_path = spool_path,
+                                         can_filters = _channel_can_filters(default_section, None),
+                                         checkpoint_path = checkpoint_path))
+    else:
+        raise ValueError("No CAN channel is configured. Add a [can] section, or [can.<name>] sections.")
+
+    seen = set()
+    for channel in channels:
+        if not channel.name or not channel.channel:
+            raise ValueError(f"CAN channel {channel.name or '(unnamed)'} has no channel configured.")
+        if (channel.interface, channel.channel) in seen:
+            raise ValueError(f"CAN channel {channel.interface} {channel.channel} is configured more than once.")
+        seen.add((channel.interface, channel.channel))
+
+    return channels
@@ -3,25 +3,96 @@ Utility methods for the decoding of eFlex battery CAN message data.
 """
 
 import struct
-from typing import List
+from typing import Iterable, List, Tuple
+
+# The node id, or battery number, is the low byte of the arbitration id, and the message family
+# (0x100 or 0x600) the high bits, so each family addresses up to 255 nodes.
+NODE_ID_MASK = 0xFF
+MESSAGE_FAMILY_MASK = 0x700
+MAX_NODE_ID = NODE_ID_MASK
 
 def parse_arbitration_id(arbitration_id: int):
     """Parses the CAN message arbitration id.
     
-    The battery number can be reliably determined by the last character of 
-    hexidecimal arbitration id.
+    The battery number can be reliably determined by the low byte of the
+    arbitration id.
         - For example, message 0x101 is from battery number 1 (or node id 1).
-        0x10D is battery number 13, etc.
+        0x10D is battery number 13, 0x141 battery number 65, etc.
         - The battery number or node id is NOT the serial number, which should be
         used as the battery unique id, in case battery order changes. Changing the 
         order of the batteries in the battery network will cause battery numbers to change.
     """
-    message_id = hex(arbitration_id)[2:5]
-    node_id = str(int(message_id[-1], base=16))
-    message_type = message_id[0:2]
+    message_id = "%03x" % arbitration_id
+    node_id = str(arbitration_id & NODE_ID_MASK)
+    message_type = "%x0" % ((arbitration_id & MESSAGE_FAMILY_MASK) >> 8)
     return (message_id, node_id, message_type)
 
-def parse_serial(serial_bytes: List) -> str:
+# 0x10X and 0x60X messages, sent by each battery, are the only messages of interest.
+BATTERY_MESSAGE_BASE_IDS = (0x100, 0x600)
+
+
+def can_filters(extra_families: Iterable[int] = ()) -> Tuple[dict, ...]:
+    """CAN filters, as accepted by can.Bus, passing only the standard frames of the battery message
+    families, and of the extra families (such as 0x300 for 0x300 to 0x3FF). On socketcan the
+    filters are installed in the kernel, so other frames never reach the process."""
+
+    families = list(BATTERY_MESSAGE_BASE_IDS)
+    for family in extra_families:
+        if family & ~MESSAGE_FAMILY_MASK or not family:
+            raise ValueError(f"CAN message family {family:#x} is not one of 0x100 to 0x700.")
+        if family not in families:
+            families.append(family)
+    return tuple({'can_id': family, 'can_mask': MESSAGE_FAMILY_MASK, 'extended': False} for family in families)
+
+
+BATTERY_CAN_FILTERS = can_filters()
+
+# Maps the arbitration id of every battery message to its (node_id, message_type), with the node id
+# as an int. The tuples are built once, so looking up the arbitration id of a received frame
+# allocates nothing, and any other arbitration id is rejected with a single dict lookup.
+ARBITRATION_ID_DISPATCH: dict[int, Tuple[int, str]] = {
+    arbitration_id: (arbitration_id & NODE_ID_MASK, parse_arbitration_id(arbitration_id)[2])
+    for base_id in BATTERY_MESSAGE_BASE_IDS
+    for arbitration_id in range(base_id + 1, base_id + MAX_NODE_ID + 1)
+}
+
+# Precompiled layouts of the compiled message data.
+#
+# Serial number bytes, see parse_serial.
+_SERIAL = struct.Struct(">BBBBcH")
+
+# The 16 cell voltages at the start of the 60X data. The cell voltage data appears to be
+# little-endian, despite most being big-endien.
+_CELL_VOLTAGES = struct.Struct("<16H")
+
+# All fields decoded from the 10X data, in a single layout. Undecoded bytes are skipped with pad bytes.
+#   - Bytes 0-6: battery number, batteries in system, battery voltage, battery current, battery soc
+#   - Bytes 10-11: average system voltage
+#   - Bytes 31-34: lifetime discharge energy
+#   - Bytes 35-38: pre volt, insulation resistance
+#   - Bytes 46-48: software version, hardware version
+#   - Bytes 49-55: serial number, unpacked as raw bytes
+_DATA10 = struct.Struct(">BBHhB3xH19xIHH7xHc7s")
+
+# Formatted serial numbers, keyed by the raw serial number bytes. A battery's serial number
+# does not change, so it only needs to be formatted once. The cache is cleared if it grows
+# beyond the number of batteries expected, which would only happen with corrupt data.
+_serial_cache: dict[bytes, str] = {}
+_SERIAL_CACHE_SIZE = 256
+
+BytesLike = bytes | bytearray | memoryview
+
+
+def _as_buffer(data: BytesLike | List[int]) -> BytesLike:
+    """Lists of ints are still accepted by the parse functions, but are copied to bytes first."""
+    return bytes(data) if isinstance(data, list) else data
+
+
+def _format_serial(year: int, week: int, day: int, batch: int, model: bytes, number: int) -> str:
+    return "%02x%02x%d%02x%s%04d" % (year, week, day, batch, str(model, "UTF-8"), number)
+
+
+def parse_serial(serial_bytes: BytesLike | List[int]) -> str:
     """Message 101#082211005446270F yields serial number 2211054F9999
     Bytes passed to this function: 2-8. The first byte marks is not to
     be sent to this function.
@@ -34,35 +105,39 @@ def parse_serial(serial_bytes: List) -> str:
         - Bytes 7-8: parsed as two byte unsigned short/integer and zero filled to a 
         length of four (i.e 270F -> 9999, 03E7 -> 0999)
     """
-    parts = struct.unpack(">cH", bytearray(serial_bytes[4:8]))
-    return (hex(serial_bytes[0]).removeprefix('0x').zfill(2) 
-    + hex(serial_bytes[1]).removeprefix('0x').zfill(2)
-    + str(serial_bytes[2])
-    + hex(serial_bytes[3]).removeprefix('0x').zfill(2)
-    + str(parts[0], "UTF-8")
-    + str(parts[1]).zfill(4)
-    )
+    return _format_serial(*_SERIAL.unpack_from(_as_buffer(serial_bytes)))
+
+
+def parse_serial_cached(serial_bytes: bytes) -> str:
+    """Same as parse_serial, for serial number bytes that have been seen before the formatted
+    serial number is returned from a cache."""
+
+    battery_id = _serial_cache.get(serial_bytes)
+    if battery_id is None:
+        if len(_serial_cache) >= _SERIAL_CACHE_SIZE:
+            _serial_cache.clear()
+        battery_id = _serial_cache[serial_bytes] = parse_serial(serial_bytes)
+    return battery_id
 
 
-def parse_cell_voltages(data60) -> List[int]:
+def parse_cell_voltages(data60: BytesLike | List[int]) -> List[int]:
     """Parses cell voltages from combined data60 messages
     The cell voltage data appears to be little-endian, despite
     most being big-endien.
     """
 
-    return list(struct.unpack('<HHHHHHHHHHHHHHHH', bytearray(data60[0:32])))
+    return list(_CELL_VOLTAGES.unpack_from(_as_buffer(data60)))
 
-def parse_battery_data(data10: List[int], data60: List[int]) -> dict:
-    """Processes and formats the battery data from the raw compiled message bytes."""
+def parse_battery_data(data10: BytesLike | List[int], data60: BytesLike | List[int]) -> dict:
+    """Processes and formats the battery data from the raw compiled message bytes.
+    The data is read directly from the bytes, bytearray or memoryview buffers."""
 
-    battery_number, batteries_in_system, battery_voltage, battery_current, battery_soc = struct.unpack('>BBHhB', bytearray(data10[0:7]))
-    average_system_voltage, = struct.unpack(">H", bytearray(data10[10:12]))
-    software_version, hardware_version = struct.unpack('>Hc', bytearray(data10[46:49]))
-    cell_voltages = parse_cell_voltages(data60)
-    pre_volt, insulation_resistance = struct.unpack(">HH", bytearray(data10[35:39]))
+    (battery_number, batteries_in_system, battery_voltage, battery_current, battery_soc,
+     average_system_voltage, lifetime_discharge_energy, pre_volt, insulation_resistance,
+     software_version, hardware_version, serial_bytes) = _DATA10.unpack_from(_as_buffer(data10))
 
     return {
-        'battery_id': parse_serial(data10[49:56]),
+        'battery_id': parse_serial_cached(serial_bytes),
         'battery_number': battery_number, 
         'batteries_in_system': batteries_in_system,
         'battery_soc': battery_soc,
@@ -73,6 +148,6 @@ def parse_battery_data(data10: List[int], data60: List[int]) -> dict:
         'insulation_resistance': insulation_resistance,
         'software_version' : software_version,
         'hardware_version' : str(hardware_version, 'UTF-8'),
-        'lifetime_discharge_energy' : struct.unpack('>I', bytearray(data10[31:35]))[0],
-        'cell_voltages' : cell_voltages
-    }
\ No newline at end of file
+        'lifetime_discharge_energy' : lifetime_discharge_energy,
+        'cell_voltages' : list(_CELL_VOLTAGES.unpack_from(_as_buffer(data60)))
+    }
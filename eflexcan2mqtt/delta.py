@@ -0,0 +1,97 @@
+"""
+Delta encoding of published battery data, to only publish the fields that changed.
+"""
+from typing import Any, List
+
+# Fields included in every published record, identifying the battery and the time of the data.
+IDENTITY_FIELDS = ('battery_id', 'time')
+
+DEFAULT_KEYFRAME_INTERVAL = 3600
+
+
+def parse_deadbands(deadbands: str) -> dict[str, float]:
+    """Parses deadbands configured as comma separated field:deadband pairs,
+    such as cell_voltages:1, battery_current:0.1"""
+
+    parsed: dict[str, float] = {}
+    for deadband in deadbands.split(','):
+        if not deadband.strip():
+            continue
+        try:
+            field, value = deadband.split(':')
+            parsed[field.strip()] = float(value)
+        except ValueError as e:
+            raise ValueError(f"Deadband {deadband.strip()} is not valid, expected field:deadband.") from e
+        if parsed[field.strip()] < 0:
+            raise ValueError(f"Deadband {deadband.strip()} must not be negative.")
+    return parsed
+
+
+class DeltaEncoder():
+    """Keeps the last published data of each battery, keyed by battery id, and reduces newly decoded
+    battery data to the fields that changed since.
+
+    A numeric field, or any value of a list field such as cell_voltages, is only considered changed
+    when it differs from the last published value by more than the field's deadband. Changes within
+    the deadband do not accumulate, as they are always compared to the last published value. A list
+    field is published whole when any of its values changed.
+
+    The full data of a battery is published as a keyframe the first time the battery is seen, and then
+    every keyframe_interval seconds of battery data time, so consumers starting later, or that missed
+    data, catch up.
+    """
+
+    # Last published value of each field, by battery id.
+    _published: dict[Any, dict]
+
+    # Time of the last keyframe, by battery id.
+    _keyframe_times: dict[Any, float]
+
+    def __init__(self, deadbands: dict[str, float] | None = None, keyframe_interval: float = DEFAULT_KEYFRAME_INTERVAL):
+        self._deadbands = deadbands or {}
+        self._keyframe_interval = keyframe_interval
+        self._published = {}
+        self._keyframe_times = {}
+
+    def _changed(self, field: str, value: Any, published: Any) -> bool:
+        deadband = self._deadbands.get(field)
+        if deadband is None:
+            return value != published
+        if isinstance(value, list):
+            return (not isinstance(published, list) or len(value) != len(published)
+                    or any(abs(new - old) > deadband + 1e-9 for new, old in zip(value, published)))
+        if isinstance(value, (int, float)) and isinstance(published, (int, float)):
+            return abs(value - published) > deadband + 1e-9
+        return value != published
+
+    def encode(self, battery_data: dict) -> dict | None:
+        """Returns the battery data reduced to its identity fields and changed fields, or the full battery
+        data for a keyframe. Returns None if no field changed."""
+
+        battery_id = battery_data['battery_id']
+        published = self._published.get(battery_id)
+        time = battery_data.get('time', 0)
+
+        if published is None or time - self._keyframe_times[battery_id] >= self._keyframe_interval:
+            self._published[battery_id] = dict(battery_data)
+            self._keyframe_times[battery_id] = time
+            return battery_data
+
+        delta = {field: value for field, value in battery_data.items()
+                 if field not in IDENTITY_FIELDS and (field not in published or self._changed(field, value, published[field]))}
+        if not delta:
+            return None
+
+        published.update(delta)
+        return {**{field: battery_data[field] for field in IDENTITY_FIELDS if field in battery_data}, **delta}
+
+    def encode_all(self, all_battery_data: List[dict]) -> List[dict]:
+        """Encodes the data of each battery, leaving out the batteries without changes."""
+        encoded = (self.encode(battery_data) for battery_data in all_battery_data)
+        return [battery_data for battery_data in encoded if battery_data is not None]
+
+    def reset(self) -> None:
+        """Forgets the published data, so the next data of every battery is published as a keyframe.
+        Called when published data is lost."""
+        self._published.clear()
+        self._keyframe_times.clear()
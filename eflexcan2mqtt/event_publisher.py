@@ -0,0 +1,84 @@
+"""
+Publishes battery data as soon as it is received, rather than every publish interval.
+"""
+import asyncio
+from logging import Logger
+from typing import Set
+from .message_handler import MessageHandler
+from .mqtt_publisher import MQTTPublisher
+
+PUBLISH_MODE_INTERVAL = 'interval'
+PUBLISH_MODE_EVENT = 'event'
+PUBLISH_MODES = (PUBLISH_MODE_INTERVAL, PUBLISH_MODE_EVENT)
+
+
+class EventPublisher():
+    """Publishes the data of each battery when the MessageHandler completes its set of messages.
+
+    Batteries completing within coalesce_window seconds of the first are published together,
+    in a single publish. A battery is published at most once every min_interval seconds. A battery
+    completing sooner is held back until min_interval has passed, and then published with its
+    latest data.
+
+    Completions are scheduled with the event loop, so the MessageHandler must be called on the
+    event loop, as it is by a can.Notifier created with the loop.
+    """
+
+    # Node ids waiting to be published.
+    _pending: Set[int]
+
+    # Event loop time each node was last published.
+    _published_times: dict[int, float]
+
+    def __init__(self, logger: Logger, message_handler: MessageHandler, mqtt_publisher: MQTTPublisher,
+                 loop: asyncio.AbstractEventLoop, coalesce_window: float = 1.0, min_interval: float = 10.0):
+        self._logger = logger
+        self._mqtt_publisher = mqtt_publisher
+        self._loop = loop
+        self._coalesce_window = coalesce_window
+        self._min_interval = min_interval
+        self._pending = set()
+        self._published_times = {}
+        self._timer: asyncio.TimerHandle | None = None
+
+        message_handler.add_set_completed_callback(self._on_set_completed)
+
+    def _on_set_completed(self, node_id: int, data10: bytes, data60: bytes, timestamp: float) -> None:
+        self._pending.add(node_id)
+        when = self._loop.time() + self._coalesce_window
+        if self._timer is None:
+            self._schedule(when)
+        # A battery that can be published is not held up by the timer of batteries held back.
+        elif when < self._timer.when() and when - self._published_times.get(node_id, float('-inf')) >= self._min_interval:
+            self._timer.cancel()
+            self._schedule(when)
+
+    def _schedule(self, when: float) -> None:
+        self._timer = self._loop.call_at(when, self._publish_pending)
+
+    def _publish_pending(self) -> None:
+        self._timer = None
+        now = self._loop.time()
+
+        ready = {node_id for node_id in self._pending
+                 if now - self._published_times.get(node_id, float('-inf')) >= self._min_interval}
+
+        if ready:
+            self._pending -= ready
+            try:
+                self._mqtt_publisher.publish_data(ready)
+            except Exception as e:
+                self._logger.error("Failed to publish battery data.", exc_info = e)
+            for node_id in ready:
+                self._published_times[node_id] = now
+
+        # Publish the batteries held back once their min_interval has passed.
+        if self._pending:
+            self._schedule(min(self._published_times[node_id] for node_id in self._pending) + self._min_interval)
+
+    def close(self) -> None:
+        """Stops publishing. Batteries waiting to be published are not published."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._pending.clear()
@@ -0,0 +1,246 @@
+"""
+Writes battery data to InfluxDB in line protocol, without going through the MQTT server.
+"""
+import json
+import time
+from logging import Logger
+from typing import TYPE_CHECKING, Iterator, List, Tuple
+from urllib.parse import quote, urlsplit
+from .mqtt_client import MQTTClient, MQTTPublishError
+
+if TYPE_CHECKING:
+    import http.client
+
+DEFAULT_MEASUREMENT = 'battery'
+DEFAULT_BATCH_SIZE = 5000
+DEFAULT_MAX_PENDING = 100000
+
+TAG_FIELDS = ('battery_id',)
+
+_MEASUREMENT_ESCAPES = str.maketrans({',': r'\,', ' ': r'\ '})
+_KEY_ESCAPES = str.maketrans({',': r'\,', '=': r'\=', ' ': r'\ '})
+_STRING_ESCAPES = str.maketrans({'"': r'\"', '\\': r'\\'})
+
+
+def _format_value(value) -> str:
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return f"{value}i"
+    if isinstance(value, float):
+        return repr(value)
+    return '"%s"' % str(value).translate(_STRING_ESCAPES)
+
+
+def _fields(key: str, value) -> Iterator[Tuple[str, object]]:
+    """Flattens list and dict values to one field per item, cell_voltages to cell_voltages_1 to
+    cell_voltages_16, and rollup to rollup_battery_voltage_min and so on."""
+    if isinstance(value, list):
+        for index, item in enumerate(value, 1):
+            yield from _fields(f"{key}_{index}", item)
+    elif isinstance(value, dict):
+        for item_key, item in value.items():
+            yield from _fields(f"{key}_{item_key}", item)
+    elif value is not None:
+        yield key, value
+
+
+def to_line_protocol(battery_data: dict, measurement: str = DEFAULT_MEASUREMENT, tags: dict[str, str] | None = None) -> str:
+    """The line protocol point of the battery data. battery_id is a tag, and every other field a field,
+    with one field per cell voltage. The time, in seconds, is converted to a nanosecond timestamp."""
+
+    tag_set = dict(tags or {})
+    fields = []
+    timestamp = None
+    for key, value in battery_data.items():
+        if key == 'time':
+            # CAN timestamps have a microsecond resolution, which a float of nanoseconds doesn't keep.
+            timestamp = round(value * 1_000_000) * 1000
+        elif key in TAG_FIELDS:
+            tag_set[key] = value
+        else:
+            fields.extend(_fields(key, value))
+
+    line = measurement.translate(_MEASUREMENT_ESCAPES)
+    for key, value in sorted(tag_set.items()):
+        line += f",{key.translate(_KEY_ESCAPES)}={str(value).translate(_KEY_ESCAPES)}"
+    line += ' ' + ','.join(f"{key.translate(_KEY_ESCAPES)}={_format_value(value)}" for key, value in fields)
+    if timestamp is not None:
+        line += f" {timestamp}"
+    return line
+
+
+class InfluxClient(MQTTClient):
+    """Writes the battery data published to it to an InfluxDB server, as line protocol points.
+
+    The url is that of the server, such as http://localhost:8086. With an org, points are written to
+    the bucket with the InfluxDB 2 API, and otherwise to the database named bucket with the 1.x API.
+    A token, if any, is sent in the Authorization header.
+
+    Published points are batched and written in a single request once batch_size points are pending,
+    or once the oldest pending point is flush_interval seconds old, by default on every publish.
+    Request bodies are gzip compressed. A single keep-alive connection is kept open to the server,
+    and reopened when it is closed.
+
+    When a write fails, the points are kept and written with a later publish, so publish only logs
+    the failure. Writes are not retried sooner than retry_delay seconds, doubling with each failure
+    up to max_retry_delay, so an unreachable server doesn't hold up every publish.
+    At most max_pending points are kept, the oldest being dropped first. Points rejected by the
+    server as invalid are dropped.
+
+    Writes block until the server responds, or timeout seconds, so the service publishes to the client
+    from a worker thread rather than the event loop. The client must only be used by one thread at a time.
+    """
+
+    _pending: List[str]
+
+    def __init__(self, url: str, bucket: str, logger: Logger, org: str = '', token: str = '',
+                 measurement: str = DEFAULT_MEASUREMENT, tags: dict[str, str] | None = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE, flush_interval: float = 0.0, compress: bool = True,
+                 timeout: float = 5.0, retry_delay: float = 1.0, max_retry_delay: float = 60.0,
+                 max_pending: int = DEFAULT_MAX_PENDING):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError(f"InfluxDB url {url} is not an http or https url.")
+        if not bucket:
+            raise ValueError("InfluxDB bucket is not set.")
+
+        self._scheme = parts.scheme
+        self._host = parts.hostname
+        self._port = parts.port
+        base_path = parts.path.rstrip('/')
+        if org:
+            self._path = f"{base_path}/api/v2/write?org={quote(org)}&bucket={quote(bucket)}&precision=ns"
+        else:
+            self._path = f"{base_path}/write?db={quote(bucket)}&precision=ns"
+
+        self._headers = {'Content-Type': 'text/plain; charset=utf-8'}
+        if token:
+            self._headers['Authorization'] = f"Token {token}"
+        if compress:
+            self._headers['Content-Encoding'] = 'gzip'
+
+        self._logger = logger
+        self._measurement = measurement
+        self._tags = tags
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._compress = compress
+        self._timeout = timeout
+        self._min_retry_delay = retry_delay
+        self._max_retry_delay = max_retry_delay
+        self._max_pending = max_pending
+
+        self._connection: 'http.client.HTTPConnection | None' = None
+        self._pending = []
+        self._pending_since = 0.0
+        self._retry_delay = 0.0
+        self._retry_at = 0.0
+
+        self.requests = 0
+        self.written = 0
+
+    def disconnect(self) -> None:
+        if self._pending:
+            try:
+                self.flush()
+            except MQTTPublishError as e:
+                self._logger.warning("%s %s points are lost.", e, len(self._pending))
+        self._close_connection()
+
+    def publish(self, payload: List[dict], topic: str | None = None) -> None:
+        """Adds the battery data to the pending points, and writes them if a batch is due."""
+
+        if not self._pending:
+            self._pending_since = time.monotonic()
+        self._pending.extend(to_line_protocol(battery_data, self._measurement, self._tags) for battery_data in payload)
+
+        dropped = len(self._pending) - self._max_pending
+        if dropped > 0:
+            del self._pending[:dropped]
+            self._logger.warning("More than %s points pending. Dropped the %s oldest.", self._max_pending, dropped)
+
+        if len(self._pending) >= self._batch_size or time.monotonic() - self._pending_since >= self._flush_interval:
+            try:
+                self.flush()
+            except MQTTPublishError as e:
+                self._logger.warning("%s %s points pending.", e, len(self._pending))
+
+    def publish_messages(self, messages: List[Tuple[str, str]], retain: bool = False) -> None:
+        """Adds the battery data of the battery topic messages to the pending points, like publish. The
+        field topic messages only repeat the fields of the battery data, so are skipped."""
+
+        values = (json.loads(payload) for _, payload in messages)
+        payload = [value for value in values if isinstance(value, dict) and 'time' in value]
+        if payload:
+            self.publish(payload)
+
+    def flush(self) -> None:
+        """Writes the pending points, in batches of batch_size points. Raises MQTTPublishError if they
+        could not be written, or a retry is not due yet."""
+
+        now = time.monotonic()
+        if now < self._retry_at:
+            raise MQTTPublishError(f"InfluxDB write to {self._host} failed, retrying in {self._retry_at - now:.0f} s.")
+
+        while self._pending:
+            batch = self._pending[:self._batch_size]
+            try:
+                self._write(batch)
+            except MQTTPublishError:
+                self._retry_delay = min(max(self._retry_delay * 2, self._min_retry_delay), self._max_retry_delay)
+                self._retry_at = time.monotonic() + self._retry_delay
+                raise
+            del self._pending[:len(batch)]
+
+        self._retry_delay = 0.0
+
+    def _write(self, lines: List[str]) -> None:
+        # Imported on the first write, as the email package http.client imports is slow to import.
+        import gzip
+        import http.client
+
+        body = '\n'.join(lines).encode('utf-8')
+        if self._compress:
+            body = gzip.compress(body, compresslevel = 6)
+
+        # A keep-alive connection may have been closed by the server while idle, which only shows
+        # when it is used. The request is then sent again once, on a new connection.
+        for attempt in range(2):
+            try:
+                connection = self._connect()
+                connection.request('POST', self._path, body = body, headers = self._headers)
+                response = connection.getresponse()
+                message = response.read()
+                break
+            except (OSError, http.client.HTTPException) as e:
+                self._close_connection()
+                if attempt == 1:
+                    raise MQTTPublishError(f"InfluxDB write to {self._host} failed: {e}") from e
+
+        self.requests += 1
+        if response.will_close:
+            self._close_connection()
+
+        if 200 <= response.status < 300:
+            self.written += len(lines)
+            return
+
+        error = f"InfluxDB write to {self._host} failed: {response.status} {response.reason} {message[:200]!r}"
+        if response.status in (400, 413, 422):
+            # Retrying the points would fail again.
+            self._logger.error("%s Dropped %s points.", error, len(lines))
+            return
+        raise MQTTPublishError(error)
+
+    def _connect(self) -> 'http.client.HTTPConnection':
+        import http.client
+        if self._connection is None:
+            connection_class = http.client.HTTPSConnection if self._scheme == 'https' else http.client.HTTPConnection
+            self._connection = connection_class(self._host, self._port, timeout = self._timeout)
+        return self._connection
+
+    def _close_connection(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
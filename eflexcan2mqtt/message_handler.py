@@ -1,11 +1,12 @@
 """
 Handles CAN messages as they are received from the eFlex batteries
 """
-from typing import List
 from logging import Logger
-from can.listener import Listener
-from can.message import Message
-from .decode import parse_arbitration_id
+from typing import TYPE_CHECKING, Callable, Collection, List, Tuple
+from .decode import ARBITRATION_ID_DISPATCH, MAX_NODE_ID
+
+if TYPE_CHECKING:
+    from can.message import Message
 
 # 0x10X messages are sent by each battery, 11 messages in a row.
 MSG_ID_10X_COUNT = 11
@@ -13,133 +14,369 @@ MSG_ID_10X_COUNT = 11
 # 0x60X messages are sent by each battery, 7 messages in a row.
 MSG_ID_60X_COUNT = 7
 
-# Expected order of first bytes. Only the first six messages of 60X message types are
-# tested due to the typically observed value of the 7th message being 0x11, which
-# is not known.
-MSG_10X_FIRST_BYTE_ORDER = [0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x07, 0x08, 0x09, 0x0A, 0x0B]
-MSG_60X_FIRST_BYTE_ORDER = [0x01, 0x02, 0x03, 0x04, 0x05, 0x06]
+# The first byte of each message is its sequence number (0x01, 0x02 etc), followed by 7 data bytes.
+MSG_DATA_LENGTH = 7
+
+# Length of the compiled data bytes of a complete set of 10X (77 bytes) and 60X (49 bytes) messages.
+MSG_10X_DATA_LENGTH = MSG_ID_10X_COUNT * MSG_DATA_LENGTH
+MSG_60X_DATA_LENGTH = MSG_ID_60X_COUNT * MSG_DATA_LENGTH
+
+# Received messages of a set are tracked with one bit per message, bit 0 for the first message.
+# Only the first six messages of 60X message types are identified by their first byte, due to
+# the typically observed value of the 7th message being 0x11, which is not known. The 7th
+# message is the message following the sixth.
+MSG_10X_COMPLETE_MASK = (1 << MSG_ID_10X_COUNT) - 1
+MSG_60X_COMPLETE_MASK = (1 << MSG_ID_60X_COUNT) - 1
+MSG_60X_LAST_MESSAGE_POSITION = MSG_ID_60X_COUNT - 1
 
 MSG_TYPE_10 = '10'
 MSG_TYPE_60 = '60'
 
-Message.__lt__ = lambda self, other: self.data[0] < other.data[0]
+# Weight of the latest period in the smoothed cycle period of each node.
+CYCLE_PERIOD_SMOOTHING = 0.2
 
 
-def _all_messages_received(message_type: int, aggregated_messages: dict[str, List[Message]]) -> bool:
+def _all_messages_received(message_type: str, received_mask: int) -> bool:
 
-    """Checks the provided aggregated messages to verify they are present.
-    The first byte of all 11 10X messages are checked to confirm each message
-    is present and they are in the expected order.
-    The first six of the 60X messages are checked. The first byte of the 7th
-    60X message is ignored, as it does not follow the convention of the other messages.
+    """Checks the provided received message bitmask to verify all messages of a
+    10X or 60X set are present.
     """
 
-    message_count = len(aggregated_messages)
-
     if (message_type == MSG_TYPE_10):
-        if (message_count != MSG_ID_10X_COUNT):
-            return False
-        
-        for i, msg in enumerate(aggregated_messages):
-            if msg.data[0] != MSG_10X_FIRST_BYTE_ORDER[i]:
-                return False
-        return True
-    
+        return received_mask == MSG_10X_COMPLETE_MASK
     elif (message_type == MSG_TYPE_60):
-        if (message_count != MSG_ID_60X_COUNT):
-            return False
-        
-        for i, msg in enumerate(aggregated_messages):
-            if i < MSG_ID_60X_COUNT - 1:
-                if msg.data[0] != MSG_60X_FIRST_BYTE_ORDER[i]:
-                    return False
-        return True
+        return received_mask == MSG_60X_COMPLETE_MASK
     else:
         raise ValueError("The argument message_type expected to either be %s or %s", MSG_TYPE_10, MSG_TYPE_60)
 
-class MessageHandler(Listener):
-    """The is an implementation of can.listener.Listener. It is registered
-with the can.Notifier class in the implementing code.
+class MessageHandler():
+    """The is an implementation of the can.listener.Listener interface. It is registered
+with the can.Notifier class, or the SocketCANReader, in the implementing code. It doesn't
+subclass can.listener.Listener, so python-can is only imported when a can.Bus is used.
 
 Messages are handled by the on_message_received method, where they are aggregated
 for later decoding and publishing.
+
+Callbacks added with add_set_completed_callback are called with the node id, the compiled
+10X and 60X data and the timestamp each time a node's set of 60X messages is compiled, once
+its 10X data is compiled too.
+
+Messages may be handled on another thread than the battery data is read, as by a can.Notifier
+without an event loop. The battery data of a node is kept as an immutable record, replaced as
+a whole when its next set is compiled, so compiled_battery_data takes a consistent snapshot of
+all nodes, copying one list of records rather than any data, without a lock.
 """
     _logger: Logger
 
-    # Contains the relevant bytes from the most recently aggregated messages.
-    # The keys are the node ids (i.e. 1, 2, 5, 13 etc)
-    _compiled_message10X_data: dict[str, List[int]] = {}
-    _compiled_message60X_data: dict[str, List[int]] = {}
+    # Slot of each node id (i.e. 1, 2, 5, 13, 65 etc) in the per node state lists below, -1 until
+    # the first message of the node is received. Slots are allocated in the order nodes are first
+    # seen, so the per node state is sized to the number of nodes on the bus, whatever their ids.
+    _node_slots: List[int]
+
+    # Node id of each slot.
+    _node_ids: List[int]
+
+    # Per set state is indexed by set: slot * 2 for the node's 10X messages, slot * 2 + 1 for its 60X messages.
+    #
+    # Preallocated buffer of each set. The data bytes of each message are written at the offset given
+    # by the message's position in the set. The message data is compiled when complete.
+    _assembly_buffers: List[bytearray]
+
+    # Bitmask of the messages of each set received so far, or -1 while waiting for the first message of a set.
+    _received_masks: List[int]
+
+    # The relevant bytes from the most recently aggregated messages of each set, None until the first set is complete.
+    _compiled_data: List[bytes | None]
+
+    #Timestamp of last aggregated messages of each slot.
+    _timestamps: List[float]
+
+    # Slots with compiled 10X data, in the order their first 10X set was compiled.
+    _compiled_slots: List[int]
+
+    # The latest (node_id, data10, data60, timestamp) record of each slot, None until both its 10X and
+    # 60X data are compiled. A record is never changed, only replaced by the next one.
+    _records: List[Tuple[int, bytes, bytes, float] | None]
+
+    # Number of complete sets of 60X messages compiled, which is the number of battery data updates.
+    _completed_sets: int
+
+    # Frame and set counters, for metrics. Frames received are counted per message type, 10X at
+    # index 0 and 60X at index 1, as the low bit of the set index. Ignored frames are those of
+    # other arbitration ids, and dropped frames those of a battery that could not be assembled.
+    # A set is reset when a frame is received out of order, and is incomplete when the first
+    # message of the next set is received before it was completed.
+    _frame_counts: List[int]
+    _ignored_frames: int
+    _dropped_frames: int
+    _out_of_order_sets: int
+    _incomplete_sets: int
+
+    # Number of sets completed per slot.
+    _completed_set_counts: List[int]
 
-    # Contains lists for each 0x10X and 0x60X messages. The message data is compiled and saved to
-    # the compiled_message_data map when complete and the aggregation list cleared.
-    _aggregated_messages: dict[str, List[Message]] = {}
+    # Number of sets reset before they were completed, and of frames repeating a message already
+    # received in the set, per slot.
+    _abandoned_set_counts: List[int]
+    _duplicated_frame_counts: List[int]
 
-    #Timestamp of last aggregated messages. Key is the node_id or battery number.
-    _timestamps: dict[str, float] = {}
+    # Smoothed period between the completed 60X sets of each slot, 0 until two sets are completed.
+    _cycle_periods: List[float]
+
+    # Called with the node id when a node has new compiled 10X and 60X data.
+    _set_completed_callbacks: List[Callable[[int, bytes, bytes, float], None]]
 
     def __init__(self, logger: Logger):
         self._logger = logger
+        self._node_slots = [-1] * (MAX_NODE_ID + 1)
+        self._node_ids = []
+        self._assembly_buffers = []
+        self._received_masks = []
+        self._compiled_data = []
+        self._timestamps = []
+        self._compiled_slots = []
+        self._records = []
+        self._completed_sets = 0
+        self._frame_counts = [0, 0]
+        self._ignored_frames = 0
+        self._dropped_frames = 0
+        self._out_of_order_sets = 0
+        self._incomplete_sets = 0
+        self._completed_set_counts = []
+        self._abandoned_set_counts = []
+        self._duplicated_frame_counts = []
+        self._cycle_periods = []
+        self._set_completed_callbacks = []
+
+    def _add_node(self, node_id: int) -> int:
+        """Allocates the slot and buffers of a newly seen node. The node id is added last, so readers
+        on another thread only see the slots of nodes whose state is allocated."""
 
-    def on_message_received(self, msg: Message) -> None:
+        slot = len(self._node_ids)
+        self._assembly_buffers += [bytearray(MSG_10X_DATA_LENGTH), bytearray(MSG_60X_DATA_LENGTH)]
+        self._received_masks += [-1, -1]
+        self._compiled_data += [None, None]
+        self._records.append(None)
+        self._timestamps.append(0.0)
+        self._completed_set_counts.append(0)
+        self._abandoned_set_counts.append(0)
+        self._duplicated_frame_counts.append(0)
+        self._cycle_periods.append(0.0)
+        self._node_ids.append(node_id)
+        self._node_slots[node_id] = slot
+        return slot
+
+    def on_message_received(self, msg: 'Message') -> None:
         """CAN Notifier callback listener. Handles messages, aggregates and compiles
         the data when all are received into a single array of bytes for processing.
         """
 
-        message_id, node_id, message_type = parse_arbitration_id(msg.arbitration_id)
-
         # If this is not a 10X or 60X message, ignore it.
-        if message_type not in (MSG_TYPE_10, MSG_TYPE_60):
+        dispatch = ARBITRATION_ID_DISPATCH.get(msg.arbitration_id)
+        if dispatch is None:
+            self._ignored_frames += 1
             return
 
-        # Initialize a list for this message id if it's the first message.
-        if msg.data[0] == 0x01:
-            self._aggregated_messages[message_id] = []
-            
-        # If this is not the first message, and the aggregated list does not exist,
+        node_id, message_type = dispatch
+        data = msg.data
+
+        slot = self._node_slots[node_id]
+        if slot < 0:
+            slot = self._add_node(node_id)
+        set_index = slot * 2 if message_type == MSG_TYPE_10 else slot * 2 + 1
+        self._frame_counts[set_index & 1] += 1
+
+        # Start a new set if it's the first message.
+        if data[0] == 0x01:
+            if self._received_masks[set_index] > 0:
+                self._incomplete_sets += 1
+                self._abandoned_set_counts[slot] += 1
+            received_mask = 0
+
+        # If this is not the first message, and no set is being aggregated,
         # ignore this message. This can happen on startup of the script. For example,
         # message 101#08 may be the first message to be received. In this case,
         # we want to wait for the message 101#01 before we start aggregating this message.
-        elif message_id not in self._aggregated_messages.keys():
+        else:
+            received_mask = self._received_masks[set_index]
+            if received_mask < 0:
+                self._dropped_frames += 1
+                return
+
+        if message_type == MSG_TYPE_60 and received_mask == MSG_60X_COMPLETE_MASK >> 1:
+            position = MSG_60X_LAST_MESSAGE_POSITION
+        else:
+            position = data[0] - 1
+
+        # Messages are sent in order. A message that is out of order, duplicated or follows a missing
+        # message means the set can't be completed. Drop it, and wait for the first message of the next set.
+        if position < 0 or received_mask != (1 << position) - 1 or len(data) != MSG_DATA_LENGTH + 1:
+            self._received_masks[set_index] = -1
+            self._dropped_frames += 1
+            self._out_of_order_sets += 1
+            self._abandoned_set_counts[slot] += 1
+            if position >= 0 and received_mask >> position & 1:
+                self._duplicated_frame_counts[slot] += 1
             return
-        
-        self._aggregated_messages[message_id].append(msg)
+
+        buffer = self._assembly_buffers[set_index]
+        offset = position * MSG_DATA_LENGTH
+        buffer[offset:offset + MSG_DATA_LENGTH] = data[1:]
+        received_mask |= 1 << position
 
         # If all the messages of this type have been received from this battery/node,
-        # aggregate the data bytes.
-        if _all_messages_received(message_type, self._aggregated_messages[message_id]):
-            compiled_data = []
+        # save the compiled data bytes.
+        if _all_messages_received(message_type, received_mask):
 
-            # Compile data bytes into single list and update compiled message data for the node id.
-            for message in self._aggregated_messages[message_id]:
-                compiled_data += message.data[1:8]
+            if message_type == MSG_TYPE_10 and self._compiled_data[set_index] is None:
+                self._compiled_slots.append(slot)
 
-            if message_type == MSG_TYPE_10:
-                self._compiled_message10X_data[node_id] = compiled_data
+            self._compiled_data[set_index] = bytes(buffer)
 
             if message_type == MSG_TYPE_60:
-                self._compiled_message60X_data[node_id] = compiled_data
                 # Since the 60X messages are the last messages to be received by a node/battery
                 # we will use the last message timestamp to mark the time the data was
                 # collected.
-                self._timestamps[node_id] = msg.timestamp
+                # Data restored from a checkpoint has a timestamp, but no set completed before it.
+                if self._completed_set_counts[slot]:
+                    period = msg.timestamp - self._timestamps[slot]
+                    cycle_period = self._cycle_periods[slot]
+                    self._cycle_periods[slot] = cycle_period + CYCLE_PERIOD_SMOOTHING * (period - cycle_period) if cycle_period else period
+                self._timestamps[slot] = msg.timestamp
+                self._completed_sets += 1
+                self._completed_set_counts[slot] += 1
 
-            # Reset aggregated message list to empty
-            self._aggregated_messages[message_id] = []
+                data10 = self._compiled_data[set_index - 1]
+                if data10 is not None:
+                    data60 = self._compiled_data[set_index]
+                    self._records[slot] = (node_id, data10, data60, msg.timestamp)
+                    for callback in self._set_completed_callbacks:
+                        callback(node_id, data10, data60, msg.timestamp)
+
+            # Wait for the first message of the next set.
+            self._received_masks[set_index] = -1
+        else:
+            self._received_masks[set_index] = received_mask
 
         return
 
+    def restore_battery_data(self, node_id: int, data10: bytes, data60: bytes, timestamp: float) -> None:
+        """Restores the compiled data of a node, such as from a checkpoint, unless it already has newer data.
+        The set completed callbacks are not called, and no set is counted as completed."""
+
+        slot = self._node_slots[node_id]
+        if slot < 0:
+            slot = self._add_node(node_id)
+        record = self._records[slot]
+        if record is not None and record[3] >= timestamp:
+            return
+
+        self._compiled_data[slot * 2] = data10
+        self._compiled_data[slot * 2 + 1] = data60
+        self._timestamps[slot] = timestamp
+        self._records[slot] = (node_id, data10, data60, timestamp)
+        if slot not in self._compiled_slots:
+            self._compiled_slots.append(slot)
+
+    def __call__(self, msg: 'Message') -> None:
+        self.on_message_received(msg)
+
+    def stop(self) -> None:
+        pass
+
+    def add_set_completed_callback(self, callback: Callable[[int, bytes, bytes, float], None]) -> None:
+        self._set_completed_callbacks.append(callback)
+
     def on_error(self, exc: Exception) -> None:
         self._logger.error(msg = "MessageHandler encountered an exception.", exc_info = exc)
 
+    def compiled_battery_data(self, node_ids: Collection[int] | None = None) -> List[Tuple[int, bytes, bytes, float]]:
+        """The (node_id, data10, data60, timestamp) of each node with both compiled 10X and 60X data,
+        in the order the first 10X data of each node was compiled. Only the nodes in node_ids if provided.
+
+        The 60X data of each node is that of its latest compiled set, with the 10X data compiled before
+        it. The records are a snapshot, consistent even while messages are handled on another thread."""
+
+        # Each copy is atomic. The slots are copied first, as the record of a slot exists before the slot is added.
+        slots = self._compiled_slots[:]
+        records = self._records[:]
+
+        return [
+            record for record in map(records.__getitem__, slots)
+            if record is not None and (node_ids is None or record[0] in node_ids)
+        ]
+
+    @property
+    def compiled_message10X_data(self) -> dict[int, bytes]:
+        return {self._node_ids[slot]: self._compiled_data[slot * 2] for slot in self._compiled_slots}
+
     @property
-    def compiled_message10X_data(self):
-        return self._compiled_message10X_data
-    
+    def compiled_message60X_data(self) -> dict[int, bytes]:
+        return {node_id: self._compiled_data[slot * 2 + 1] for slot, node_id in enumerate(self._node_ids)
+                if self._compiled_data[slot * 2 + 1] is not None}
+
+    @property
+    def timestamps(self) -> dict[int, float]:
+        return {node_id: self._timestamps[slot] for slot, node_id in enumerate(self._node_ids)
+                if self._compiled_data[slot * 2 + 1] is not None}
+
+    @property
+    def node_count(self) -> int:
+        """Number of nodes messages have been received from."""
+        return len(self._node_ids)
+
+    @property
+    def completed_sets(self) -> int:
+        return self._completed_sets
+
     @property
-    def compiled_message60X_data(self):
-        return self._compiled_message60X_data
-    
+    def completed_sets_per_node(self) -> dict[int, int]:
+        return {node_id: self._completed_set_counts[slot] for slot, node_id in enumerate(self._node_ids)}
+
+    @property
+    def abandoned_sets_per_node(self) -> dict[int, int]:
+        """Number of sets of each node reset before they were completed, as incomplete or out of order."""
+        return {node_id: self._abandoned_set_counts[slot] for slot, node_id in enumerate(self._node_ids)}
+
+    @property
+    def duplicated_frames_per_node(self) -> dict[int, int]:
+        """Number of frames of each node repeating a message already received in the set."""
+        return {node_id: self._duplicated_frame_counts[slot] for slot, node_id in enumerate(self._node_ids)}
+
+    @property
+    def cycle_periods(self) -> dict[int, float]:
+        """Smoothed period, in seconds, between the completed sets of each node with at least two."""
+        return {node_id: self._cycle_periods[slot] for slot, node_id in enumerate(self._node_ids) if self._cycle_periods[slot]}
+
+    def node_stats(self, node_id: int) -> Tuple[int, int, float]:
+        """The abandoned sets, duplicated frames and cycle period of a node."""
+        slot = self._node_slots[node_id]
+        if slot < 0:
+            return 0, 0, 0.0
+        return self._abandoned_set_counts[slot], self._duplicated_frame_counts[slot], self._cycle_periods[slot]
+
+    @property
+    def frame_counts(self) -> dict[str, int]:
+        """Number of frames received of each message type."""
+        return {MSG_TYPE_10: self._frame_counts[0], MSG_TYPE_60: self._frame_counts[1]}
+
+    @property
+    def ignored_frames(self) -> int:
+        """Number of frames received that are not 10X or 60X battery messages."""
+        return self._ignored_frames
+
+    @property
+    def dropped_frames(self) -> int:
+        """Number of battery frames received that were not assembled into a set, as they were received
+        before the first message of a set, or out of order."""
+        return self._dropped_frames
+
+    @property
+    def out_of_order_sets(self) -> int:
+        """Number of sets reset by a frame received out of order, duplicated or of the wrong length."""
+        return self._out_of_order_sets
+
     @property
-    def timestamps(self):
-        return self._timestamps
+    def incomplete_sets(self) -> int:
+        """Number of sets reset by the first message of the next set before they were completed."""
+        return self._incomplete_sets
@@ -0,0 +1,249 @@
+"""
+Runtime metrics, served in the Prometheus text format on an HTTP endpoint on the event loop.
+
+The counters are kept by the components themselves, as plain ints incremented on the hot path,
+and histograms as a count per bucket. They are only read and formatted when /metrics is requested.
+"""
+import asyncio
+import bisect
+import time
+from logging import Logger
+from typing import TYPE_CHECKING, Callable, Iterable, List, Sequence
+
+from .message_handler import MessageHandler
+
+if TYPE_CHECKING:
+    from .mqtt_publisher import MQTTPublisher
+    from .shared_ring import SetRingReader
+    from .socketcan_reader import SocketCANReader
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+DECODE_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005)
+PUBLISH_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+METRIC_PREFIX = 'eflexcan2mqtt_'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram():
+    """Counts observed values per bucket, as a Prometheus histogram. Observing a value costs a bisect."""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        # One count per bucket, plus values above the highest bucket, not cumulative.
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(labels: dict[str, object]) -> str:
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+                             for key, value in labels.items())
+
+
+class MetricsWriter():
+    """Formats metrics in the Prometheus text format. The HELP and TYPE of a metric are written
+    before its first sample, so the samples of a metric must be written together."""
+
+    def __init__(self):
+        self._lines: List[str] = []
+        self._described: set[str] = set()
+
+    def _describe(self, name: str, metric_type: str, help: str) -> str:
+        name = METRIC_PREFIX + name
+        if name not in self._described:
+            self._described.add(name)
+            self._lines.append(f"# HELP {name} {help}")
+            self._lines.append(f"# TYPE {name} {metric_type}")
+        return name
+
+    def counter(self, name: str, help: str, value: float, **labels) -> None:
+        name = self._describe(name, 'counter', help)
+        self._lines.append(f"{name}{_labels(labels)} {value}")
+
+    def gauge(self, name: str, help: str, value: float, **labels) -> None:
+        name = self._describe(name, 'gauge', help)
+        self._lines.append(f"{name}{_labels(labels)} {value}")
+
+    def histogram(self, name: str, help: str, histogram: Histogram, **labels) -> None:
+        name = self._describe(name, 'histogram', help)
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            self._lines.append(f"{name}_bucket{_labels({**labels, 'le': le})} {cumulative}")
+        self._lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+        self._lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+    def text(self) -> str:
+        return '\n'.join(self._lines) + '\n'
+
+
+class ChannelMetrics():
+    """The metrics of one CAN channel, read from its MessageHandler, MQTTPublisher and SocketCANReader.
+    CAN network down events counted otherwise are added to network_down_events. Socket drops and
+    the receive buffer size are only read from a SocketCANReader. In the split process mode, the sets
+    lost between the processes are read from the SetRingReader of the publisher process."""
+
+    def __init__(self, channel: str, message_handler: MessageHandler, mqtt_publisher: 'MQTTPublisher | None' = None,
+                 bus_reader: 'SocketCANReader | None' = None, ring_reader: 'SetRingReader | None' = None):
+        self.channel = channel
+        self.message_handler = message_handler
+        self.mqtt_publisher = mqtt_publisher
+        self.bus_reader = bus_reader
+        self.ring_reader = ring_reader
+        self.network_down_events = 0
+
+    @property
+    def can_network_down_events(self) -> int:
+        if self.bus_reader is None:
+            return self.network_down_events
+        return self.network_down_events + self.bus_reader.network_down_events
+
+    @property
+    def socket_drops(self) -> int:
+        return self.bus_reader.socket_drops if self.bus_reader is not None else 0
+
+    @property
+    def receive_buffer_size(self) -> int:
+        return self.bus_reader.receive_buffer_size if self.bus_reader is not None else 0
+
+    @property
+    def receive_buffer_increases(self) -> int:
+        return self.bus_reader.receive_buffer_increases if self.bus_reader is not None else 0
+
+    @property
+    def lost_sets(self) -> int:
+        return self.ring_reader.lost_sets if self.ring_reader is not None else 0
+
+
+def write_metrics(writer: MetricsWriter, channels: Iterable[ChannelMetrics], now: float | None = None) -> None:
+    """Writes the metrics of the channels. Each metric is written for all channels before the next."""
+
+    channels = list(channels)
+    now = time.time() if now is None else now
+
+    for metrics in channels:
+        for message_type, count in metrics.message_handler.frame_counts.items():
+            writer.counter('frames_received_total', "Battery frames received, by message type.", count,
+                           channel = metrics.channel, type = f"{message_type[0]}x")
+    for metrics in channels:
+        writer.counter('frames_ignored_total', "Frames received that are not battery messages.",
+                       metrics.message_handler.ignored_frames, channel = metrics.channel)
+    for metrics in channels:
+        writer.counter('frames_dropped_total', "Battery frames received that could not be assembled into a set.",
+                       metrics.message_handler.dropped_frames, channel = metrics.channel)
+    for metrics in channels:
+        writer.counter('set_resets_total', "Message sets discarded before they were completed.",
+                       metrics.message_handler.incomplete_sets, channel = metrics.channel, reason = 'incomplete')
+        writer.counter('set_resets_total', "Message sets discarded before they were completed.",
+                       metrics.message_handler.out_of_order_sets, channel = metrics.channel, reason = 'out_of_order')
+    for metrics in channels:
+        for node_id, count in metrics.message_handler.completed_sets_per_node.items():
+            writer.counter('sets_completed_total', "Complete sets of battery messages, by node.", count,
+                           channel = metrics.channel, node = node_id)
+    for metrics in channels:
+        for node_id, count in metrics.message_handler.abandoned_sets_per_node.items():
+            writer.counter('sets_abandoned_total', "Message sets reset before they were completed, by node.", count,
+                           channel = metrics.channel, node = node_id)
+    for metrics in channels:
+        for node_id, count in metrics.message_handler.duplicated_frames_per_node.items():
+            writer.counter('frames_duplicated_total', "Frames repeating a message already received in the set, by node.", count,
+                           channel = metrics.channel, node = node_id)
+    for metrics in channels:
+        for node_id, period in metrics.message_handler.cycle_periods.items():
+            writer.gauge('cycle_period_seconds', "Smoothed period between complete sets of battery messages, by node.",
+                         round(period, 3), channel = metrics.channel, node = node_id)
+    for metrics in channels:
+        for node_id, timestamp in metrics.message_handler.timestamps.items():
+            writer.gauge('data_age_seconds', "Seconds since the last complete set of battery messages, by node.",
+                         round(now - timestamp, 3), channel = metrics.channel, node = node_id)
+    for metrics in channels:
+        writer.counter('can_network_down_total', "CAN network down events.",
+                       metrics.can_network_down_events, channel = metrics.channel)
+
+    readers = [metrics for metrics in channels if metrics.bus_reader is not None]
+    for metrics in readers:
+        writer.counter('socket_drops_total', "Frames dropped by the kernel as the CAN socket receive queue was full.",
+                       metrics.socket_drops, channel = metrics.channel)
+    for metrics in readers:
+        writer.gauge('receive_buffer_bytes', "Receive buffer size of the CAN socket, as reported by the kernel.",
+                     metrics.receive_buffer_size, channel = metrics.channel)
+    for metrics in readers:
+        writer.counter('receive_buffer_increases_total', "Receive buffer increases after sustained frame loss.",
+                       metrics.receive_buffer_increases, channel = metrics.channel)
+
+    for metrics in channels:
+        if metrics.ring_reader is not None:
+            writer.counter('ring_sets_lost_total', "Sets overwritten in the ring, or torn, before the publisher process read them.",
+                           metrics.lost_sets, channel = metrics.channel)
+
+    publishers = [metrics for metrics in channels if metrics.mqtt_publisher is not None]
+    for metrics in publishers:
+        writer.histogram('decode_seconds', "Time to decode the battery data of a node.",
+                         metrics.mqtt_publisher.decode_seconds, channel = metrics.channel)
+    for metrics in publishers:
+        writer.histogram('publish_seconds', "Time to hand the battery data to the MQTT client.",
+                         metrics.mqtt_publisher.publish_seconds, channel = metrics.channel)
+    for metrics in publishers:
+        writer.counter('publish_failures_total', "Battery data publishes that failed.",
+                       metrics.mqtt_publisher.publish_failures, channel = metrics.channel)
+
+
+class MetricsServer():
+    """Serves the metrics text returned by collect on GET /metrics, with a minimal HTTP/1.0 server
+    on the event loop. Each request is answered on its own connection, which is then closed."""
+
+    def __init__(self, logger: Logger, collect: Callable[[], str], host: str = '127.0.0.1', port: int = 9108):
+        self._logger = logger
+        self._collect = collect
+        self._host = host
+        self._port = port
+        self._server: asyncio.AbstractServer | None = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self._host, self._port)
+        self._logger.info("Serving metrics on http://%s:%s/metrics", self._host, self.port)
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1] if self._server else self._port
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            # The request headers are read, and ignored.
+            while (await asyncio.wait_for(reader.readline(), 5)).strip():
+                pass
+
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, content_type, body = '200 OK', CONTENT_TYPE, self._collect().encode('utf-8')
+            else:
+                status, content_type, body = '404 Not Found', 'text/plain', b'Not found\n'
+
+            writer.write((f"HTTP/1.0 {status}\r\nContent-Type: {content_type}\r\n"
+                          f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n").encode('latin-1') + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            self._logger.debug("Metrics request failed: %s", e)
+        except Exception as e:
+            self._logger.error("Failed to serve metrics.", exc_info = e)
+        finally:
+            writer.close()
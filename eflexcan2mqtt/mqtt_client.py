@@ -1,15 +1,47 @@
-
-from typing import List
+from typing import List, Tuple
 from abc import ABCMeta, abstractmethod
 from typing import Any
+from .serializers import JSONSerializer, Serializer
+
+
+class MQTTPublishError(Exception):
+    """Raised by an MQTTClient when a payload could not be handed off to the MQTT server."""
+
 
 class MQTTClient(metaclass=ABCMeta):
+    """Payloads published with publish are serialized by the client's serializer, to JSON by default.
+    Messages published with publish_messages are already serialized."""
+
+    _serializer: Serializer = JSONSerializer()
 
-    def __init__(self, *args: Any, **kwargs: Any) -> None:
-        pass
+    def __init__(self, *args: Any, serializer: Serializer | None = None, **kwargs: Any) -> None:
+        if serializer is not None:
+            self._serializer = serializer
+
+    @property
+    def serializer(self) -> Serializer:
+        return self._serializer
+
+    def connect(self) -> None:
+        """
+        Open the connection to the MQTT server. Clients that connect per publish
+        do not need to implement this.
+        """
+
+    def disconnect(self) -> None:
+        """
+        Close the connection to the MQTT server.
+        """
+
+    @abstractmethod
+    def publish(self, payload: List[dict], topic: str | None = None) -> None:
+        """
+        Publish payload to an MQTT server, to the topic if provided, or the client's
+        default topic otherwise.
+        """
 
     @abstractmethod
-    def publish(self, payload: List[dict]) -> None:
+    def publish_messages(self, messages: List[Tuple[str, str]], retain: bool = False) -> None:
+        """
+        Publish each (topic, serialized payload) message to an MQTT server, retained if retain is True.
         """
-        Publish payload to an MQTT server
-        """
\ No newline at end of file
@@ -1,64 +1,225 @@
-
 import json
+import time
 from logging import Logger
+from typing import Callable, Collection, List, Tuple
 from .message_handler import MessageHandler
+from .metrics import PUBLISH_BUCKETS, Histogram
 from .decode import parse_battery_data
-from .mqtt_client import MQTTClient
+from .delta import DeltaEncoder
+from .mqtt_client import MQTTClient, MQTTPublishError
+from .payload_cache import CachedBatteryPayload, PayloadCache
+from .rollup import Rollup
+from .spool import DiskSpool
 
 class MQTTPublisher():
     """
     This MQTT Publisher class publishes the latest battery data
     aggregated and compiled by the MessageHandler.
+
+    Battery data is decoded by the decoder, decode.parse_battery_data unless a decoder compiled
+    from a signal database is provided.
+
+    If a spool is provided, battery data that fails to publish is stored in the spool,
+    and published later in batches by drain_spool.
+
+    If a delta encoder is provided, only the battery data fields that changed since they were last
+    published are published, with a periodic keyframe of all fields.
+
+    Battery data is published to the topic if provided, or the MQTT client's topic otherwise. Several
+    publishers, one per CAN channel, can share an MQTT client by each publishing to their own topic.
+
+    With fan_out, the data of each battery is instead published as a retained message to its own
+    <topic>/<battery_id> topic, so consumers only receive the batteries they subscribe to. With
+    field_topics, each field is also published as a retained message to <topic>/<battery_id>/<field>,
+    only when its value changed. All messages of a publish are handed to the connection together.
+
+    Decoded and serialized battery data is cached per node until its compiled message data changes.
+
+    If a rollup is provided, the statistics of each battery since it was last published are added
+    to its battery data as 'rollup'.
+
+    The time of the battery data is rounded to the second, unless round_time is False.
     """
 
     # Timestamp of the last publish time for a given node id. This is used as a sanity check to
     # ensure messages are not needlessly being republished if there's an interruption in the CAN
     # messages.
-    _published_timestamps: dict[str, float] = {}
+    _published_timestamps: dict[int, float]
+
+    # Serialized value of each field last published to a field topic, keyed by field topic.
+    _published_field_json: dict[str, str]
+
+    def __init__(self, logger: Logger, message_handler: MessageHandler, mqtt_client: MQTTClient,
+                 spool: DiskSpool | None = None, drain_batch_size: int = 50,
+                 decoder: Callable[[bytes, bytes], dict] = parse_battery_data, topic: str | None = None,
+                 delta_encoder: DeltaEncoder | None = None, fan_out: bool = False, field_topics: bool = False,
+                 rollup: Rollup | None = None, round_time: bool = True):
+        if (fan_out or field_topics) and not topic:
+            raise ValueError("Publishing to battery topics requires a topic.")
+        if (fan_out or field_topics) and delta_encoder is not None:
+            raise ValueError("Delta encoding is not supported when publishing to battery topics.")
+        if (fan_out or field_topics) and not round_time:
+            raise ValueError("Battery topics are published with the time rounded to the second.")
 
-    def __init__(self, logger: Logger, message_handler: MessageHandler, mqtt_client: MQTTClient):
         self._logger = logger
         self._message_handler = message_handler
         self._mqtt_client = mqtt_client
+        self._spool = spool
+        self._drain_batch_size = drain_batch_size
+        self._decoder = decoder
+        self._topic = topic
+        self._delta_encoder = delta_encoder
+        self._fan_out = fan_out
+        self._field_topics = field_topics
+        self._payload_cache = PayloadCache(decoder)
+        self._rollup = rollup
+        self._round_time = round_time
+        self.publish_seconds = Histogram(PUBLISH_BUCKETS)
+        self.publish_failures = 0
+        self._published_timestamps = {}
+        self._published_field_json = {}
 
 
-    def publish_data(self) -> None:
+    def publish_data(self, node_ids: Collection[int] | None = None) -> None:
         """
-        Publish all battery data where both type 10X and type 60X messages have been aggregated and compiled.
+        Publish all battery data where both type 10X and type 60X messages have been aggregated and compiled,
+        or only the battery data of the nodes in node_ids if provided.
         Timestamp of last 60X message is added to published timestamps. If, for any reason, messages are processed out
         of order, such that an older last 60X message is received after a more recent one has been published, publishing is skipped
         for that node.
         """
-        timestamps = self._message_handler.timestamps
-        compiled_message10X_data = self._message_handler.compiled_message10X_data
-        compiled_message60X_data = self._message_handler.compiled_message60X_data
+        compiled_battery_data = self._message_handler.compiled_battery_data(node_ids)
 
         self._logger.debug("Publish initiated.")
-        self._logger.debug("Current compiled 10X messages is: %s", compiled_message10X_data)
-        self._logger.debug("Current compiled 60X messages is: %s", compiled_message60X_data)
+        self._logger.debug("Current compiled 10X and 60X messages are: %s", compiled_battery_data)
 
         all_battery_data = []
-        new_published_timestamps: dict[str, float] = {}
+        new_published_timestamps: dict[int, float] = {}
+        messages: List[Tuple[str, str]] = []
+        new_field_json: dict[str, str] = {}
 
-        for node_id, data10 in compiled_message10X_data.items():
-            if (node_id in compiled_message60X_data):
-                if not (node_id in self._published_timestamps and self._published_timestamps[node_id] >= timestamps[node_id]):
-                    battery_data = parse_battery_data(data10, compiled_message60X_data[node_id])
-                    battery_data['time'] = round(timestamps[node_id])
+        for node_id, data10, data60, timestamp in compiled_battery_data:
+            published_timestamp = self._published_timestamps.get(node_id)
+            if published_timestamp is None or published_timestamp < timestamp:
+                payload = self._payload_cache.get(node_id, data10, data60)
+                battery_data = dict(payload.battery_data)
+                battery_data['time'] = round(timestamp) if self._round_time else timestamp
+                if self._rollup is not None:
+                    battery_data['rollup'] = self._rollup.summary(node_id)
 
-                    self._logger.debug("Parsed battery data %s", battery_data)
+                self._logger.debug("Parsed battery data %s", battery_data)
+
+                all_battery_data.append(battery_data)
+                new_published_timestamps[node_id] = timestamp
+
+                if self._fan_out or self._field_topics:
+                    self._add_battery_messages(messages, new_field_json, node_id, payload, battery_data)
+            else:
+                self._logger.warning("Most recent data for battery %s was already published at timestamp %s. Won't republish.", node_id, published_timestamp)
+
+        if self._delta_encoder is not None:
+            all_battery_data = self._delta_encoder.encode_all(all_battery_data)
 
-                    all_battery_data.append(battery_data)
-                    new_published_timestamps[node_id] = timestamps[node_id] 
-                else:
-                    self._logger.warning("Most recent data for battery %s was already published at timestamp %s. Won't republish.", node_id, self._published_timestamps[node_id])
-        
         if len(all_battery_data) > 0:
 
             self._logger.debug("Publishing battery data to mqtt: %s", all_battery_data)
 
-            self._mqtt_client.publish(all_battery_data)
+            start = time.perf_counter()
+            try:
+                if self._fan_out or self._field_topics:
+                    self._mqtt_client.publish_messages(messages, retain = True)
+                    self._published_field_json.update(new_field_json)
+                else:
+                    self._mqtt_client.publish(all_battery_data, self._topic)
+                self.publish_seconds.observe(time.perf_counter() - start)
+            except Exception as e:
+                self.publish_failures += 1
+                # Only publishes that didn't reach the MQTT server are spooled. Battery data that can't be
+                # serialized would fail again, and keep the spool from draining.
+                if self._spool is None or not isinstance(e, MQTTPublishError):
+                    self._logger.error("Failed to publish battery data. The data is lost.", exc_info = e)
+                    if self._delta_encoder is not None:
+                        # Publish all fields next time, as consumers missed these changes.
+                        self._delta_encoder.reset()
+                    return
+
+                self._logger.warning("Failed to publish battery data, storing it in the spool: %s", e)
+                self._spool.append(all_battery_data)
 
-            self._published_timestamps.update(new_published_timestamps)
+        self._published_timestamps.update(new_published_timestamps)
+        if self._rollup is not None:
+            self._rollup.reset(list(new_published_timestamps))
         return
 
+    @property
+    def published_timestamps(self) -> dict[int, float]:
+        return dict(self._published_timestamps)
+
+    def restore_published_timestamps(self, published_timestamps: dict[int, float]) -> None:
+        """Restores the timestamps of the data last published, such as from a checkpoint, so data
+        published before a restart is not published again. Newer published timestamps are kept."""
+        for node_id, published_timestamp in published_timestamps.items():
+            if published_timestamp > self._published_timestamps.get(node_id, 0.0):
+                self._published_timestamps[node_id] = published_timestamp
+
+    @property
+    def decode_seconds(self) -> Histogram:
+        return self._payload_cache.decode_seconds
+
+    def _battery_topic(self, battery_data: dict, node_id: int) -> str:
+        return f"{self._topic}/{battery_data.get('battery_id', node_id)}"
+
+    def _add_battery_messages(self, messages: List[Tuple[str, str]], new_field_json: dict[str, str],
+                              node_id: int, payload: CachedBatteryPayload, battery_data: dict) -> None:
+        """Adds the battery topic message, and the field topic messages of the fields that changed."""
+
+        time = battery_data['time']
+        rollup = battery_data.get('rollup')
+        battery_topic = self._battery_topic(payload.battery_data, node_id)
+        if self._fan_out:
+            # The rollup changes every interval, so battery data with a rollup is serialized every time.
+            messages.append((battery_topic, payload.json_with_time(time) if rollup is None else json.dumps(battery_data)))
+
+        if self._field_topics:
+            extra_fields = (('time', str(time)),) if rollup is None else (('time', str(time)), ('rollup', json.dumps(rollup)))
+            for field, field_json in payload.field_json + extra_fields:
+                field_topic = f"{battery_topic}/{field}"
+                if self._published_field_json.get(field_topic) != field_json:
+                    messages.append((field_topic, field_json))
+                    new_field_json[field_topic] = field_json
+
+    def drain_spool(self) -> int:
+        """
+        Publish the oldest spooled battery data. Up to drain_batch_size spooled payloads are combined
+        into a single publish, and only removed from the spool when the publish succeeds.
+        Returns the number of spooled payloads published.
+        """
+        if self._spool is None or len(self._spool) == 0:
+            return 0
+
+        entries = self._spool.peek(self._drain_batch_size)
+        batch = [battery_data for _, payload in entries for battery_data in payload]
+
+        try:
+            if self._fan_out or self._field_topics:
+                # Not retained, as newer battery data may have been published since.
+                self._mqtt_client.publish_messages(
+                    [(self._battery_topic(battery_data, battery_data.get('battery_number', 0)), json.dumps(battery_data))
+                     for battery_data in batch],
+                    retain = False
+                )
+            else:
+                self._mqtt_client.publish(batch, self._topic)
+        except MQTTPublishError as e:
+            self._logger.debug("Spool not drained, publish failed: %s", e)
+            return 0
+        except Exception as e:
+            # Payloads spooled by an earlier version may not be serializable, and would fail every drain.
+            # The oldest payload is removed, one per drain, until the batch can be published.
+            self._logger.error("Spooled battery data can't be published. Removing the oldest spooled payload.", exc_info = e)
+            self._spool.remove(entries[0][0])
+            return 0
+
+        self._spool.remove(entries[-1][0])
+        self._logger.info("Published %s spooled payloads. %s remaining in spool.", len(entries), len(self._spool))
+        return len(entries)
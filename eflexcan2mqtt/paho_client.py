@@ -1,29 +1,93 @@
-import json
-from typing import List
-from .mqtt_client import MQTTClient
-import paho.mqtt.publish as publish
+from logging import Logger
+from typing import Any, List, Tuple
+import paho.mqtt.client as mqtt
+from .mqtt_client import MQTTClient, MQTTPublishError
+from .serializers import Serializer
 
 class PahoClient(MQTTClient):
-    """Paho MQTT Client"""
+    """Paho MQTT Client
+
+    A single connection to the MQTT server is kept open for the life of the client.
+    The paho network loop runs in a background thread, where it also reconnects
+    with an exponential backoff (min_reconnect_delay up to max_reconnect_delay seconds)
+    when the connection is lost. Publishing only queues the message on the connection,
+    so it returns without waiting for the QoS handshake to complete.
+
+    The connection can be shared by several publishers, each publishing to its own topic.
+    """
 
     def __init__(self, topic: str,
-                 hostname: str, port:int, keepalive: int, qos: int, client_id: str):
+                 hostname: str, port:int, keepalive: int, qos: int, client_id: str,
+                 logger: Logger, min_reconnect_delay: int = 1, max_reconnect_delay: int = 120,
+                 serializer: Serializer | None = None):
+        super().__init__(serializer = serializer)
         self._topic = topic
         self._hostname = hostname
         self._port = port
         self._keepalive = keepalive
         self._qos = qos
         self._client_id = client_id
+        self._logger = logger
+
+        self._client = mqtt.Client(
+            callback_api_version = mqtt.CallbackAPIVersion.VERSION2,
+            client_id = client_id or ""
+        )
+        self._client.reconnect_delay_set(min_delay = min_reconnect_delay, max_delay = max_reconnect_delay)
+        self._client.on_connect = self._on_connect
+        self._client.on_disconnect = self._on_disconnect
+
+    def connect(self) -> None:
+        """Starts the network loop thread, which connects to the MQTT server and keeps
+        reconnecting until disconnect is called."""
+        self._client.connect_async(host = self._hostname, port = self._port, keepalive = self._keepalive)
+        self._client.loop_start()
+
+    def disconnect(self) -> None:
+        self._client.disconnect()
+        self._client.loop_stop()
+
+    @property
+    def is_connected(self) -> bool:
+        return self._client.is_connected()
 
-    def publish(self, payload: List[dict]):
+    def publish(self, payload: List[dict], topic: str | None = None):
 
-        publish.single(
-            topic = self._topic,
-            hostname = self._hostname,
-            port = self._port,
-            client_id = self._client_id,
-            qos = self._qos,
-            keepalive = self._keepalive,
-            payload = json.dumps(payload)
+        # Paho would hold on to QoS 1 and 2 messages published while disconnected and
+        # send them after reconnecting. Fail right away instead, so the caller decides
+        # what to do with the data.
+        if not self._client.is_connected():
+            raise MQTTPublishError(f"Not connected to MQTT server {self._hostname}:{self._port}.")
+
+        topic = topic or self._topic
+        info = self._client.publish(
+            topic = topic,
+            payload = self._serializer.serialize(payload),
+            qos = self._qos
         )
-        
\ No newline at end of file
+
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            raise MQTTPublishError(f"Publish to topic {topic} failed: {mqtt.error_string(info.rc)}")
+
+    def publish_messages(self, messages: List[Tuple[str, str]], retain: bool = False) -> None:
+        """Queues all messages on the connection before any is sent, so they are pipelined rather
+        than each waiting for the previous message's QoS handshake."""
+
+        if not self._client.is_connected():
+            raise MQTTPublishError(f"Not connected to MQTT server {self._hostname}:{self._port}.")
+
+        for topic, payload in messages:
+            info = self._client.publish(topic = topic, payload = payload, qos = self._qos, retain = retain)
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                raise MQTTPublishError(f"Publish to topic {topic} failed: {mqtt.error_string(info.rc)}")
+
+    def _on_connect(self, client: mqtt.Client, userdata: Any, flags: mqtt.ConnectFlags,
+                    reason_code: mqtt.ReasonCode, properties: mqtt.Properties | None) -> None:
+        if reason_code.is_failure:
+            self._logger.error("Connection to MQTT server %s:%s refused: %s", self._hostname, self._port, reason_code)
+        else:
+            self._logger.info("Connected to MQTT server %s:%s.", self._hostname, self._port)
+
+    def _on_disconnect(self, client: mqtt.Client, userdata: Any, flags: mqtt.DisconnectFlags,
+                       reason_code: mqtt.ReasonCode, properties: mqtt.Properties | None) -> None:
+        self._logger.warning("Disconnected from MQTT server %s:%s: %s", self._hostname, self._port, reason_code)
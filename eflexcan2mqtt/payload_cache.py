@@ -0,0 +1,61 @@
+"""
+Caches the decoded and serialized battery data of each node until its compiled message data changes.
+"""
+import json
+import time
+from typing import Callable, Tuple
+from .metrics import DECODE_BUCKETS, Histogram
+
+
+class CachedBatteryPayload():
+    """The battery data decoded from a node's compiled 10X and 60X data, and its JSON serialization,
+    without the time. The time changes with every set of messages, so it is added when publishing."""
+
+    __slots__ = ('data10', 'data60', 'battery_data', 'json', '_field_json')
+
+    def __init__(self, data10: bytes, data60: bytes, battery_data: dict):
+        self.data10 = data10
+        self.data60 = data60
+        self.battery_data = battery_data
+        self.json = json.dumps(battery_data)
+        self._field_json: Tuple[Tuple[str, str], ...] | None = None
+
+    def json_with_time(self, time: int) -> str:
+        """The serialized battery data with the time added last, as publish_data adds it."""
+        return '%s, "time": %d}' % (self.json[:-1], time)
+
+    @property
+    def field_json(self) -> Tuple[Tuple[str, str], ...]:
+        """The (field, serialized value) of each battery data field."""
+        if self._field_json is None:
+            self._field_json = tuple((field, json.dumps(value)) for field, value in self.battery_data.items())
+        return self._field_json
+
+
+class PayloadCache():
+    """Keeps the last CachedBatteryPayload of each node. Battery data is only decoded and serialized
+    again when the node's compiled message data differs from the cached data, so unchanged batteries
+    cost two bytes comparisons."""
+
+    _payloads: dict[int, CachedBatteryPayload]
+
+    def __init__(self, decoder: Callable[[bytes, bytes], dict]):
+        self._decoder = decoder
+        self._payloads = {}
+        self.hits = 0
+        self.misses = 0
+        self.decode_seconds = Histogram(DECODE_BUCKETS)
+
+    def get(self, node_id: int, data10: bytes, data60: bytes) -> CachedBatteryPayload:
+        payload = self._payloads.get(node_id)
+        if payload is not None and payload.data10 == data10 and payload.data60 == data60:
+            self.hits += 1
+            return payload
+
+        self.misses += 1
+        start = time.perf_counter()
+        battery_data = self._decoder(data10, data60)
+        self.decode_seconds.observe(time.perf_counter() - start)
+        payload = CachedBatteryPayload(data10, data60, battery_data)
+        self._payloads[node_id] = payload
+        return payload
@@ -0,0 +1,134 @@
+"""
+On demand CPU and memory profiling of a running process, triggered by signals.
+
+    kill -USR1 <pid>    Starts cProfile, or stops it and writes the profile to a .prof file.
+    kill -USR2 <pid>    Starts tracemalloc, or writes the top allocation differences since the
+                        previous snapshot to a .txt file.
+
+Profiles are written to the profiling directory, and can be read with pstats or snakeviz.
+cProfile and tracemalloc are only imported once profiling is started, to keep them off startup.
+"""
+import asyncio
+import os
+import signal
+import time
+from logging import Logger
+from typing import TYPE_CHECKING, Tuple
+
+if TYPE_CHECKING:
+    import cProfile
+    import tracemalloc
+
+DEFAULT_TRACEMALLOC_FRAMES = 1
+DEFAULT_TOP = 25
+
+CPU_PROFILE_SIGNAL = signal.SIGUSR1
+MEMORY_PROFILE_SIGNAL = signal.SIGUSR2
+
+
+def _tracemalloc_filters() -> Tuple['tracemalloc.Filter', ...]:
+    """Leave the allocations of the profilers themselves out of the memory profiles."""
+    import tracemalloc
+    return (
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    )
+
+
+class Profiler():
+    """Profiles the thread it is toggled from, which for signal handlers added to the event loop is
+    the event loop thread, where the CAN notifier callbacks and the publish loop run.
+
+    tracemalloc records tracemalloc_frames frames per allocation. A single frame, the default, is
+    the cheapest, and groups allocations by the line they are made on. With trace_memory, memory
+    is traced from the start, so the first snapshot includes the allocations made on startup.
+    """
+
+    def __init__(self, logger: Logger, output_dir: str, tracemalloc_frames: int = DEFAULT_TRACEMALLOC_FRAMES,
+                 top: int = DEFAULT_TOP, trace_memory: bool = False):
+        self._logger = logger
+        self._output_dir = output_dir
+        self._tracemalloc_frames = tracemalloc_frames
+        self._top = top
+        self._cpu_profile: 'cProfile.Profile | None' = None
+        self._snapshot: 'tracemalloc.Snapshot | None' = None
+        self._files_written = 0
+
+        if trace_memory:
+            self.toggle_memory_profile()
+
+    def add_signal_handlers(self, loop: asyncio.AbstractEventLoop) -> None:
+        loop.add_signal_handler(CPU_PROFILE_SIGNAL, self.toggle_cpu_profile)
+        loop.add_signal_handler(MEMORY_PROFILE_SIGNAL, self.toggle_memory_profile)
+
+    @property
+    def cpu_profiling(self) -> bool:
+        return self._cpu_profile is not None
+
+    def toggle_cpu_profile(self) -> str | None:
+        """Starts CPU profiling, or stops it and writes the profile. Returns the path of the profile written."""
+
+        if self._cpu_profile is None:
+            import cProfile
+            self._cpu_profile = cProfile.Profile()
+            self._cpu_profile.enable()
+            self._logger.info("CPU profiling started.")
+            return None
+
+        self._cpu_profile.disable()
+        path = self._path('cpu', 'prof')
+        self._cpu_profile.dump_stats(path)
+        self._cpu_profile = None
+        self._logger.info("CPU profiling stopped. Profile written to %s", path)
+        return path
+
+    def toggle_memory_profile(self) -> str | None:
+        """Starts tracing memory allocations, or writes the top allocation differences since the previous
+        snapshot. Returns the path of the differences written."""
+
+        import tracemalloc
+        if not tracemalloc.is_tracing() or self._snapshot is None:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self._tracemalloc_frames)
+            self._snapshot = self._take_snapshot()
+            self._logger.info("Memory tracing started, with %s frames per allocation.", tracemalloc.get_traceback_limit())
+            return None
+
+        snapshot = self._take_snapshot()
+        key_type = 'lineno' if tracemalloc.get_traceback_limit() == 1 else 'traceback'
+        differences = snapshot.compare_to(self._snapshot, key_type)
+        self._snapshot = snapshot
+
+        current, peak = tracemalloc.get_traced_memory()
+        path = self._path('memory', 'txt')
+        with open(path, 'w') as file:
+            file.write(f"Traced memory: {current} bytes, peak {peak} bytes, tracemalloc overhead "
+                       f"{tracemalloc.get_tracemalloc_memory()} bytes\n")
+            file.write(f"Top {self._top} allocation differences since the previous snapshot:\n")
+            for difference in differences[:self._top]:
+                file.write(f"{difference}\n")
+                if key_type == 'traceback':
+                    for line in difference.traceback.format():
+                        file.write(f"    {line}\n")
+        self._logger.info("Memory allocation differences written to %s", path)
+        return path
+
+    def close(self) -> None:
+        """Writes the CPU profile if profiling, and stops tracing memory."""
+        if self._cpu_profile is not None:
+            self.toggle_cpu_profile()
+        if self._snapshot is not None:
+            import tracemalloc
+            self._snapshot = None
+            tracemalloc.stop()
+
+    def _take_snapshot(self) -> 'tracemalloc.Snapshot':
+        import tracemalloc
+        return tracemalloc.take_snapshot().filter_traces(_tracemalloc_filters())
+
+    def _path(self, kind: str, extension: str) -> str:
+        self._files_written += 1
+        name = f"eflexcan2mqtt-{kind}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self._files_written}.{extension}"
+        return os.path.join(self._output_dir, name)
@@ -0,0 +1,188 @@
+"""
+Replays candump log files through the MessageHandler and MQTTPublisher, without a CAN
+interface or an MQTT server, and reports the throughput and latencies observed.
+
+Run from the project root:
+
+    python -m eflexcan2mqtt.replay messages.log [--time-scale 0] [--publish-interval 60]
+
+Frames are replayed as fast as possible by default. With a time scale, the gaps between
+frame timestamps are replayed, divided by the time scale (1 replays in real time, 10 ten
+times faster). Battery data is published every publish interval, measured in log time.
+
+Simulated traffic can be replayed instead of log files, here from 14 batteries for 100 cycles:
+
+    python -m eflexcan2mqtt.replay --simulate 14 --cycles 100 [--drop-rate 0.01]
+"""
+
+import argparse
+import logging
+import time
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Tuple
+import can
+from .decode import parse_battery_data
+from .message_handler import MessageHandler
+from .mqtt_client import MQTTClient
+from .mqtt_publisher import MQTTPublisher
+from .signals import compile_signals, load_signals
+from .serializers import Serializer
+from .simulator import BusSimulator
+
+
+class InMemoryMQTTClient(MQTTClient):
+    """Stands in for the MQTT server. Payloads are serialized like PahoClient does, and counted."""
+
+    def __init__(self, serializer: Serializer | None = None):
+        super().__init__(serializer = serializer)
+        self.publishes = 0
+        self.batteries = 0
+        self.payload_bytes = 0
+        self.last_payload: List[dict] | None = None
+
+    def publish(self, payload: List[dict], topic: str | None = None) -> None:
+        self.payload_bytes += len(self._serializer.serialize(payload))
+        self.publishes += 1
+        self.batteries += len(payload)
+        self.last_payload = payload
+
+    def publish_messages(self, messages: List[Tuple[str, str]], retain: bool = False) -> None:
+        self.payload_bytes += sum(len(payload) for _, payload in messages)
+        self.publishes += len(messages)
+
+
+class ReplayReport(NamedTuple):
+    frames: int
+    completed_sets: int
+    elapsed: float
+    publishes: int
+    batteries_published: int
+    decode_latencies: List[float]
+    publish_latencies: List[float]
+
+    @property
+    def frames_per_second(self) -> float:
+        return self.frames / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def completed_sets_per_second(self) -> float:
+        return self.completed_sets / self.elapsed if self.elapsed else 0.0
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """Nearest rank percentile of the values, 0 if there are none."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def read_candump(path: str) -> Iterator[can.Message]:
+    """Streams the frames of a candump -L log file, one line at a time."""
+    return iter(can.io.CanutilsLogReader(path))
+
+
+def run_replay(frames: Iterable[can.Message], logger: logging.Logger,
+               decoder: Callable[[bytes, bytes], dict] = parse_battery_data,
+               publish_interval: float = 60, time_scale: float = 0,
+               mqtt_client: MQTTClient | None = None) -> ReplayReport:
+    """Feeds the frames to a MessageHandler, and publishes with an MQTTPublisher every publish_interval
+    seconds of frame time, and once more after the last frame."""
+
+    decode_latencies: List[float] = []
+    publish_latencies: List[float] = []
+
+    def timed_decoder(data10: bytes, data60: bytes) -> dict:
+        start = time.perf_counter()
+        battery_data = decoder(data10, data60)
+        decode_latencies.append(time.perf_counter() - start)
+        return battery_data
+
+    message_handler = MessageHandler(logger)
+    mqtt_client = mqtt_client or InMemoryMQTTClient()
+    mqtt_publisher = MQTTPublisher(logger = logger, message_handler = message_handler, mqtt_client = mqtt_client,
+                                   decoder = timed_decoder)
+
+    def publish() -> None:
+        start = time.perf_counter()
+        mqtt_publisher.publish_data()
+        publish_latencies.append(time.perf_counter() - start)
+
+    frame_count = 0
+    first_timestamp = None
+    next_publish = None
+    start = time.perf_counter()
+
+    for msg in frames:
+        if first_timestamp is None:
+            first_timestamp = msg.timestamp
+            next_publish = msg.timestamp + publish_interval
+
+        if time_scale:
+            delay = (msg.timestamp - first_timestamp) / time_scale - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+        message_handler.on_message_received(msg)
+        frame_count += 1
+
+        if msg.timestamp >= next_publish:
+            publish()
+            next_publish = msg.timestamp + publish_interval
+
+    publish()
+    elapsed = time.perf_counter() - start
+
+    return ReplayReport(
+        frames = frame_count,
+        completed_sets = message_handler.completed_sets,
+        elapsed = elapsed,
+        publishes = getattr(mqtt_client, 'publishes', len(publish_latencies)),
+        batteries_published = getattr(mqtt_client, 'batteries', 0),
+        decode_latencies = decode_latencies,
+        publish_latencies = publish_latencies,
+    )
+
+
+def print_report(report: ReplayReport) -> None:
+    print(f"Frames:               {report.frames:,} in {report.elapsed:.3f} s, {report.frames_per_second:,.0f} frames/s")
+    print(f"Completed sets:       {report.completed_sets:,}, {report.completed_sets_per_second:,.1f} sets/s")
+    print(f"Publishes:            {report.publishes:,}, {report.batteries_published:,} batteries")
+    for name, latencies in (("Decode latency:", report.decode_latencies), ("Publish latency:", report.publish_latencies)):
+        print(f"{name:<22}p50 {percentile(latencies, 50) * 1e6:10.1f} us   "
+              f"p95 {percentile(latencies, 95) * 1e6:10.1f} us   p99 {percentile(latencies, 99) * 1e6:10.1f} us")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Replay candump log files through the eFlex message handling and publishing.")
+    parser.add_argument("log_files", nargs = "*", help = "candump -L log files, replayed in order")
+    parser.add_argument("--time-scale", type = float, default = 0,
+                        help = "Replay frame timing divided by this factor. 0, the default, replays as fast as possible.")
+    parser.add_argument("--publish-interval", type = float, default = 60, help = "Seconds of log time between publishes")
+    parser.add_argument("--signals", help = "Signal database file, as in the [decode] section of the config file")
+    parser.add_argument("--simulate", type = int, metavar = "BATTERIES", help = "Replay traffic simulated for this number of batteries")
+    parser.add_argument("--cycles", type = int, default = 100, help = "Cycles of simulated traffic")
+    parser.add_argument("--seed", type = int, help = "Seed of the simulated traffic")
+    parser.add_argument("--drop-rate", type = float, default = 0.0, help = "Probability of a simulated frame being dropped")
+    parser.add_argument("--duplicate-rate", type = float, default = 0.0, help = "Probability of a simulated frame being duplicated")
+    parser.add_argument("--reorder-rate", type = float, default = 0.0, help = "Probability of a simulated frame being out of order")
+    parser.add_argument("--log-level", default = "ERROR", help = "Level of the log messages printed, ERROR by default")
+    args = parser.parse_args()
+    if bool(args.log_files) == bool(args.simulate):
+        parser.error("either log files or --simulate is required")
+
+    logging.basicConfig(level = args.log_level)
+
+    logger = logging.getLogger(__name__)
+    if args.simulate:
+        simulator = BusSimulator(args.simulate, seed = args.seed, drop_rate = args.drop_rate,
+                                 duplicate_rate = args.duplicate_rate, reorder_rate = args.reorder_rate)
+        frames = simulator.frames(args.cycles)
+    else:
+        frames = (msg for path in args.log_files for msg in read_candump(path))
+    report = run_replay(frames, logger, decoder = compile_signals(load_signals(args.signals)),
+                        publish_interval = args.publish_interval, time_scale = args.time_scale)
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
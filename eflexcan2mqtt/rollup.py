@@ -0,0 +1,122 @@
+"""
+Statistics of battery data over each publish interval, from every set of messages received.
+"""
+import struct
+import sys
+from array import array
+from typing import List
+
+from .message_handler import MessageHandler
+
+DEFAULT_CAPACITY = 256
+
+CELL_COUNT = 16
+
+# Raw battery voltage (0.1 V), current (0.1 A) and SOC in the compiled 10X data.
+_SAMPLE10 = struct.Struct(">2xHhB")
+
+# The cell voltages are the first 32 bytes of the compiled 60X data, little-endian uint16s. On a
+# little-endian host they are copied into the cell voltage array as they are.
+_CELL_VOLTAGES = struct.Struct("<16H")
+_CELL_VOLTAGES_SIZE = _CELL_VOLTAGES.size
+_COPY_CELL_VOLTAGES = sys.byteorder == 'little'
+
+
+def _stats(values: memoryview, last: int, divisor: int = 1) -> dict:
+    """min, max, mean and last of the raw values, divided by the divisor like the decoded values."""
+    mean = round(sum(values) / len(values) / divisor, 3)
+    if divisor == 1:
+        return {'min': min(values), 'max': max(values), 'mean': mean, 'last': last}
+    return {'min': min(values) / divisor, 'max': max(values) / divisor, 'mean': mean, 'last': last / divisor}
+
+
+class NodeSamples():
+    """Ring buffers of the samples of one node, preallocated for capacity samples. When more samples
+    are received in an interval, the oldest are overwritten."""
+
+    __slots__ = ('capacity', 'count', 'index', 'voltages', 'currents', 'socs', 'cell_voltages', '_cell_bytes')
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.count = 0
+        self.index = 0
+        self.voltages = array('H', bytes(2 * capacity))
+        self.currents = array('h', bytes(2 * capacity))
+        self.socs = array('B', bytes(capacity))
+        self.cell_voltages = array('H', bytes(2 * CELL_COUNT * capacity))
+        self._cell_bytes = memoryview(self.cell_voltages).cast('B')
+
+    def add(self, data10: bytes, data60: bytes) -> None:
+        index = self.index
+        self.voltages[index], self.currents[index], self.socs[index] = _SAMPLE10.unpack_from(data10)
+
+        if _COPY_CELL_VOLTAGES:
+            offset = index * _CELL_VOLTAGES_SIZE
+            self._cell_bytes[offset:offset + _CELL_VOLTAGES_SIZE] = data60[:_CELL_VOLTAGES_SIZE]
+        else:
+            self.cell_voltages[index * CELL_COUNT:(index + 1) * CELL_COUNT] = array('H', _CELL_VOLTAGES.unpack_from(data60))
+
+        self.index = (index + 1) % self.capacity
+        self.count += 1
+
+    def summary(self) -> dict | None:
+        """min, max, mean and last of the samples, or None if there are none."""
+
+        size = min(self.count, self.capacity)
+        if size == 0:
+            return None
+        last = (self.index - 1) % self.capacity
+
+        cells = memoryview(self.cell_voltages)[:size * CELL_COUNT]
+        spreads = array('H', (max(cells[i:i + CELL_COUNT]) - min(cells[i:i + CELL_COUNT])
+                              for i in range(0, size * CELL_COUNT, CELL_COUNT)))
+        last_cells = cells[last * CELL_COUNT:(last + 1) * CELL_COUNT]
+
+        return {
+            'samples': self.count,
+            'battery_voltage': _stats(memoryview(self.voltages)[:size], self.voltages[last], 10),
+            'battery_current': _stats(memoryview(self.currents)[:size], self.currents[last], 10),
+            'battery_soc': _stats(memoryview(self.socs)[:size], self.socs[last]),
+            'cell_voltage': _stats(cells, round(sum(last_cells) / CELL_COUNT)),
+            'cell_spread': _stats(memoryview(spreads), spreads[last]),
+        }
+
+    def reset(self) -> None:
+        self.count = 0
+        self.index = 0
+
+
+class Rollup():
+    """Samples the battery voltage, current, SOC and cell voltages of every set of messages compiled by the
+    MessageHandler, and summarizes them per battery over each publish interval.
+
+    The summary of a battery is the number of samples, and the min, max, mean and last value of the battery
+    voltage, current and SOC, of all cell voltages (the last being the mean of the last sample), and of the
+    cell spread, the difference between the highest and lowest cell voltage of a sample.
+    """
+
+    _nodes: dict[int, NodeSamples]
+
+    def __init__(self, message_handler: MessageHandler, capacity: int = DEFAULT_CAPACITY):
+        if capacity < 1:
+            raise ValueError("Rollup capacity must be at least 1.")
+        self._capacity = capacity
+        self._nodes = {}
+        message_handler.add_set_completed_callback(self._on_set_completed)
+
+    def _on_set_completed(self, node_id: int, data10: bytes, data60: bytes, timestamp: float) -> None:
+        samples = self._nodes.get(node_id)
+        if samples is None:
+            samples = self._nodes[node_id] = NodeSamples(self._capacity)
+        samples.add(data10, data60)
+
+    def summary(self, node_id: int) -> dict | None:
+        samples = self._nodes.get(node_id)
+        return samples.summary() if samples is not None else None
+
+    def reset(self, node_ids: List[int]) -> None:
+        """Starts a new interval for the nodes."""
+        for node_id in node_ids:
+            samples = self._nodes.get(node_id)
+            if samples is not None:
+                samples.reset()
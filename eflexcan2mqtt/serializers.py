@@ -0,0 +1,190 @@
+"""
+Serializers of the battery data payload published to the MQTT server.
+
+    - json: JSON, as published by default.
+    - json_fast: JSON encoded with orjson, without spaces. Requires the orjson package.
+    - msgpack: MessagePack. Requires the msgpack package.
+    - cbor: CBOR. Requires the cbor2 package.
+    - binary: Fixed layout binary records, see BinarySerializer. Only the default signals are
+      serialized, and all of them are required.
+
+The optional packages are imported when their serializer is created.
+"""
+import json
+import struct
+from abc import ABCMeta, abstractmethod
+from typing import Callable, List
+from .message_handler import MSG_10X_DATA_LENGTH, MSG_60X_DATA_LENGTH
+
+SERIALIZER_JSON = 'json'
+SERIALIZER_JSON_FAST = 'json_fast'
+SERIALIZER_MSGPACK = 'msgpack'
+SERIALIZER_CBOR = 'cbor'
+SERIALIZER_BINARY = 'binary'
+
+
+class Serializer(metaclass=ABCMeta):
+
+    @abstractmethod
+    def serialize(self, payload: List[dict]) -> bytes | str:
+        """
+        Serialize the battery data payload.
+        """
+
+
+class JSONSerializer(Serializer):
+
+    def serialize(self, payload: List[dict]) -> str:
+        return json.dumps(payload)
+
+
+class FastJSONSerializer(Serializer):
+
+    def __init__(self):
+        try:
+            import orjson
+        except ImportError:
+            raise ValueError(f"The {SERIALIZER_JSON_FAST} payload format requires the orjson package.") from None
+        self._dumps = orjson.dumps
+
+    def serialize(self, payload: List[dict]) -> bytes:
+        return self._dumps(payload)
+
+
+class MessagePackSerializer(Serializer):
+
+    def __init__(self):
+        try:
+            import msgpack
+        except ImportError:
+            raise ValueError(f"The {SERIALIZER_MSGPACK} payload format requires the msgpack package.") from None
+        self._packer = msgpack.Packer()
+
+    def serialize(self, payload: List[dict]) -> bytes:
+        return self._packer.pack(payload)
+
+
+class CBORSerializer(Serializer):
+
+    def __init__(self):
+        try:
+            import cbor2
+        except ImportError:
+            raise ValueError(f"The {SERIALIZER_CBOR} payload format requires the cbor2 package.") from None
+        self._dumps = cbor2.dumps
+
+    def serialize(self, payload: List[dict]) -> bytes:
+        return self._dumps(payload)
+
+
+class BinarySerializer(Serializer):
+    """Serializes the battery data to fixed layout binary records, all little-endian.
+
+    The payload starts with a header of the layout version (uint8) and the number of records (uint16),
+    followed by one 68 byte record per battery:
+
+        battery_id                  12 ASCII characters
+        battery_number              uint8
+        batteries_in_system         uint8
+        battery_soc                 uint8
+        battery_voltage             uint16, in 0.1 V
+        battery_current             int16, in 0.1 A
+        system_average_voltage      uint16, in 0.1 V
+        pre_volt                    uint16, in 0.1 V
+        insulation_resistance       uint16
+        software_version            uint16
+        hardware_version            1 ASCII character
+        lifetime_discharge_energy   uint32
+        cell_voltages               16 x uint16, in mV
+        time                        uint32, Unix time
+    """
+
+    VERSION = 1
+    HEADER = struct.Struct("<BH")
+    RECORD = struct.Struct("<12sBBBHhHHHHcI16HI")
+
+    def serialize(self, payload: List[dict]) -> bytes:
+        record = self.RECORD
+        data = bytearray(self.HEADER.size + record.size * len(payload))
+        self.HEADER.pack_into(data, 0, self.VERSION, len(payload))
+
+        offset = self.HEADER.size
+        try:
+            for battery_data in payload:
+                record.pack_into(
+                    data, offset,
+                    battery_data['battery_id'].encode('ascii'),
+                    battery_data['battery_number'],
+                    battery_data['batteries_in_system'],
+                    battery_data['battery_soc'],
+                    round(battery_data['battery_voltage'] * 10),
+                    round(battery_data['battery_current'] * 10),
+                    round(battery_data['system_average_voltage'] * 10),
+                    round(battery_data['pre_volt'] * 10),
+                    battery_data['insulation_resistance'],
+                    battery_data['software_version'],
+                    battery_data['hardware_version'].encode('ascii'),
+                    battery_data['lifetime_discharge_energy'],
+                    *battery_data['cell_voltages'],
+                    battery_data['time'],
+                )
+                offset += record.size
+        except (KeyError, struct.error) as e:
+            raise ValueError(f"Battery data does not fit the binary payload layout: {e}") from e
+
+        return bytes(data)
+
+    @classmethod
+    def deserialize(cls, data: bytes) -> List[dict]:
+        version, count = cls.HEADER.unpack_from(data)
+        if version != cls.VERSION:
+            raise ValueError(f"Binary payload layout version {version} is not supported.")
+
+        payload = []
+        for offset in range(cls.HEADER.size, cls.HEADER.size + count * cls.RECORD.size, cls.RECORD.size):
+            values = cls.RECORD.unpack_from(data, offset)
+            payload.append({
+                'battery_id': values[0].decode('ascii'),
+                'battery_number': values[1],
+                'batteries_in_system': values[2],
+                'battery_soc': values[3],
+                'battery_voltage': values[4] / 10,
+                'battery_current': values[5] / 10,
+                'system_average_voltage': values[6] / 10,
+                'pre_volt': values[7] / 10,
+                'insulation_resistance': values[8],
+                'software_version': values[9],
+                'hardware_version': values[10].decode('ascii'),
+                'lifetime_discharge_energy': values[11],
+                'cell_voltages': list(values[12:28]),
+                'time': values[28],
+            })
+        return payload
+
+
+SERIALIZERS = {
+    SERIALIZER_JSON: JSONSerializer,
+    SERIALIZER_JSON_FAST: FastJSONSerializer,
+    SERIALIZER_MSGPACK: MessagePackSerializer,
+    SERIALIZER_CBOR: CBORSerializer,
+    SERIALIZER_BINARY: BinarySerializer,
+}
+
+
+def create_serializer(payload_format: str) -> Serializer:
+    """Creates the serializer of the payload format. Raises ValueError if the format is not known,
+    or the package it requires is not installed."""
+    if payload_format not in SERIALIZERS:
+        raise ValueError(f"Payload format {payload_format} is not one of {', '.join(SERIALIZERS)}.")
+    return SERIALIZERS[payload_format]()
+
+
+def check_decoder(serializer: Serializer, decoder: Callable[[bytes, bytes], dict]) -> None:
+    """Raises ValueError if the battery data decoded by the decoder can't be serialized by the serializer,
+    such as when the signal database lacks a field of the binary layout. Serialization errors can't be
+    retried, so they are found on startup rather than when battery data is published."""
+    battery_data = {**decoder(bytes(MSG_10X_DATA_LENGTH), bytes(MSG_60X_DATA_LENGTH)), 'time': 0}
+    try:
+        serializer.serialize([battery_data])
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Battery data can't be serialized with {type(serializer).__name__} ({e}).") from e
@@ -0,0 +1,322 @@
+"""
+A ring of completed message sets in shared memory, from the ingest process to the publisher process.
+
+In the split process mode, a lean ingest process reads the CAN bus and assembles the messages
+with a MessageHandler. Each set it completes is written to the ring, with its node id, timestamp
+and compiled 10X and 60X data. The publisher process reads the sets from the ring, and does the
+decoding, serialization and publishing, so a slow MQTT server or a large payload never holds up
+frame handling.
+
+The ring is a multiprocessing.shared_memory block, with a header and node table followed by capacity slots:
+
+    header      magic, version and capacity, the number of sets written, and the ingest counters
+    node table  abandoned sets, duplicated frames and cycle period of each node id
+    slot        sequence, crc32 of the set, node id, timestamp, 77 bytes of 10X and 49 of 60X data
+
+Set n is written to slot n % capacity. Each slot is a seqlock: its sequence is 2n + 1 while
+set n is written and 2n + 2 once written, and the number of sets written is only updated after.
+A reader copies the slot and checks that the sequence is the same before and after, and the crc32
+of the copy, so a set overwritten while it was read is never delivered. Sets overwritten before
+they were read are counted as lost.
+"""
+import zlib
+from struct import Struct
+from typing import TYPE_CHECKING, Callable, Collection, List, Tuple
+
+from .decode import MAX_NODE_ID
+from .message_handler import MSG_10X_DATA_LENGTH, MSG_60X_DATA_LENGTH, MSG_TYPE_10, MSG_TYPE_60, MessageHandler
+
+if TYPE_CHECKING:
+    from multiprocessing.shared_memory import SharedMemory
+
+DEFAULT_CAPACITY = 1024
+
+MAGIC = b'EFXR'
+VERSION = 2
+
+# Magic, version, capacity and the number of sets written.
+_HEADER = Struct("<4sII4xQ")
+_WRITTEN_OFFSET = 16
+
+# The MessageHandler and bus reader counters of the ingest process: 10X and 60X frames received,
+# ignored frames, dropped frames, out of order sets, incomplete sets, network down events, socket
+# drops, receive buffer size and receive buffer increases.
+_COUNTERS = Struct("<10Q")
+_COUNTERS_OFFSET = 24
+
+HEADER_SIZE = 128
+
+# A row per node id: whether the node was seen, its abandoned sets, duplicated frames and cycle period.
+_NODE = Struct("<B7xQQd")
+_NODE_TABLE_SIZE = (MAX_NODE_ID + 1) * _NODE.size
+
+SLOTS_OFFSET = HEADER_SIZE + _NODE_TABLE_SIZE
+
+_SEQUENCE = Struct("<Q")
+_CRC = Struct("<I")
+_SET = Struct(f"<B3xd{MSG_10X_DATA_LENGTH}s{MSG_60X_DATA_LENGTH}s")
+_CRC_OFFSET = _SEQUENCE.size
+_SET_OFFSET = _CRC_OFFSET + _CRC.size
+_SET_END = _SET_OFFSET + _SET.size
+
+# Slots are 8 byte aligned, so the sequences are.
+SLOT_SIZE = (_SET_END + 7) // 8 * 8
+
+
+def ring_size(capacity: int) -> int:
+    return SLOTS_OFFSET + capacity * SLOT_SIZE
+
+
+def create_ring(capacity: int = DEFAULT_CAPACITY) -> 'SharedMemory':
+    """Creates the shared memory block of an empty ring. The creator closes and unlinks it."""
+
+    if capacity < 1:
+        raise ValueError(f"Ring capacity {capacity} must be at least 1.")
+    # Only imported in the split process mode.
+    from multiprocessing.shared_memory import SharedMemory
+    shared_memory = SharedMemory(create = True, size = ring_size(capacity))
+    shared_memory.buf[:SLOTS_OFFSET] = bytes(SLOTS_OFFSET)
+    _HEADER.pack_into(shared_memory.buf, 0, MAGIC, VERSION, capacity, 0)
+    return shared_memory
+
+
+def _ring_capacity(buffer: memoryview) -> int:
+    magic, version, capacity, _ = _HEADER.unpack_from(buffer)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Not a version {VERSION} set ring.")
+    if len(buffer) < ring_size(capacity):
+        raise ValueError(f"Set ring of {len(buffer)} bytes is too small for {capacity} sets.")
+    return capacity
+
+
+class SetRingWriter():
+    """Writes the sets completed by the MessageHandler to the ring. There must be a single writer.
+    A writer attached to a ring written before, by an ingest process that was restarted, continues
+    its sequence, so the readers carry on from where they were."""
+
+    def __init__(self, buffer: memoryview, message_handler: MessageHandler, bus_reader = None):
+        self._buffer = buffer
+        self._capacity = _ring_capacity(buffer)
+        self._written = _SEQUENCE.unpack_from(buffer, _WRITTEN_OFFSET)[0]
+        self._message_handler = message_handler
+        self._bus_reader = bus_reader
+
+        message_handler.add_set_completed_callback(self.write)
+
+    def write(self, node_id: int, data10: bytes, data60: bytes, timestamp: float) -> None:
+        buffer = self._buffer
+        sequence = self._written
+        offset = SLOTS_OFFSET + (sequence % self._capacity) * SLOT_SIZE
+
+        _SEQUENCE.pack_into(buffer, offset, 2 * sequence + 1)
+        _SET.pack_into(buffer, offset + _SET_OFFSET, node_id, timestamp, data10, data60)
+        _CRC.pack_into(buffer, offset + _CRC_OFFSET, zlib.crc32(buffer[offset + _SET_OFFSET:offset + _SET_END]))
+        _SEQUENCE.pack_into(buffer, offset, 2 * sequence + 2)
+
+        self._written = sequence + 1
+        _SEQUENCE.pack_into(buffer, _WRITTEN_OFFSET, self._written)
+        self._write_node(node_id)
+        self._write_counters()
+
+    def _write_node(self, node_id: int) -> None:
+        _NODE.pack_into(self._buffer, HEADER_SIZE + node_id * _NODE.size, 1, *self._message_handler.node_stats(node_id))
+
+    def _write_counters(self) -> None:
+        message_handler = self._message_handler
+        bus_reader = self._bus_reader
+        frame_counts = message_handler.frame_counts
+        _COUNTERS.pack_into(self._buffer, _COUNTERS_OFFSET, frame_counts[MSG_TYPE_10], frame_counts[MSG_TYPE_60],
+                            message_handler.ignored_frames, message_handler.dropped_frames,
+                            message_handler.out_of_order_sets, message_handler.incomplete_sets,
+                            *((bus_reader.network_down_events, bus_reader.socket_drops, bus_reader.receive_buffer_size,
+                               bus_reader.receive_buffer_increases) if bus_reader is not None else (0, 0, 0, 0)))
+
+    def write_counters(self) -> None:
+        """Copies the MessageHandler and bus reader counters, and the stats of every node, to the ring.
+        The counters and the stats of the node are copied with every set written. This is called
+        periodically too, so they are current while no sets are completed."""
+
+        self._write_counters()
+        for node_id in self._message_handler.completed_sets_per_node:
+            self._write_node(node_id)
+
+    @property
+    def written(self) -> int:
+        return self._written
+
+
+class SetRingReader():
+    """Reads the sets written to the ring by the ingest process, and keeps the latest data of each node.
+
+    It stands in for the MessageHandler of the publisher process: it has the same methods and
+    properties to read the compiled data and counters, and calls the set completed callbacks with
+    each set read. Sets are read by poll, which is called periodically on the event loop.
+    """
+
+    # Latest (data10, data60, timestamp) of each node, in the order nodes were first read.
+    _latest: dict[int, Tuple[bytes, bytes, float]]
+    _completed_set_counts: dict[int, int]
+    _set_completed_callbacks: List[Callable[[int, bytes, bytes, float], None]]
+
+    def __init__(self, buffer: memoryview):
+        self._buffer = buffer
+        self._capacity = _ring_capacity(buffer)
+        self._position = 0
+        self._latest = {}
+        self._completed_set_counts = {}
+        self._completed_sets = 0
+        self._set_completed_callbacks = []
+
+        # Number of sets overwritten before they could be read.
+        self.lost_sets = 0
+
+    def add_set_completed_callback(self, callback: Callable[[int, bytes, bytes, float], None]) -> None:
+        self._set_completed_callbacks.append(callback)
+
+    def catch_up(self) -> int:
+        """Reads the sets still in the ring without calling the callbacks, so a restarted publisher
+        process has the latest data of each node without handling older sets again. Returns the
+        number of sets read."""
+
+        written = _SEQUENCE.unpack_from(self._buffer, _WRITTEN_OFFSET)[0]
+        self._position = max(self._position, written - self._capacity)
+        return self._read(written, notify = False)
+
+    def poll(self) -> int:
+        """Reads the sets written since the previous poll, and calls the callbacks with each. Returns
+        the number of sets read."""
+        return self._read(_SEQUENCE.unpack_from(self._buffer, _WRITTEN_OFFSET)[0], notify = True)
+
+    def _read(self, written: int, notify: bool) -> int:
+        buffer = self._buffer
+        capacity = self._capacity
+        position = self._position
+        if written - position > capacity:
+            self.lost_sets += written - capacity - position
+            position = written - capacity
+
+        read = 0
+        while position < written:
+            offset = SLOTS_OFFSET + (position % capacity) * SLOT_SIZE
+            expected = 2 * position + 2
+            sequence = _SEQUENCE.unpack_from(buffer, offset)[0]
+            if sequence < expected:
+                # Sets are only counted as written once their slot is, so this set is read by a later poll.
+                break
+
+            raw_set = bytes(buffer[offset + _CRC_OFFSET:offset + _SET_END])
+            position += 1
+            if sequence != expected or _SEQUENCE.unpack_from(buffer, offset)[0] != sequence \
+                    or _CRC.unpack_from(raw_set)[0] != zlib.crc32(raw_set[_CRC.size:]):
+                # Overwritten by a later set, before or while it was read.
+                self.lost_sets += 1
+                continue
+
+            node_id, timestamp, data10, data60 = _SET.unpack_from(raw_set, _CRC.size)
+            self._latest[node_id] = (data10, data60, timestamp)
+            self._completed_set_counts[node_id] = self._completed_set_counts.get(node_id, 0) + 1
+            self._completed_sets += 1
+            read += 1
+            if notify:
+                for callback in self._set_completed_callbacks:
+                    callback(node_id, data10, data60, timestamp)
+
+        self._position = position
+        return read
+
+    def restore_battery_data(self, node_id: int, data10: bytes, data60: bytes, timestamp: float) -> None:
+        """Restores the data of a node, such as from a checkpoint, unless a newer set was read."""
+        latest = self._latest.get(node_id)
+        if latest is None or latest[2] < timestamp:
+            self._latest[node_id] = (data10, data60, timestamp)
+
+    def compiled_battery_data(self, node_ids: Collection[int] | None = None) -> List[Tuple[int, bytes, bytes, float]]:
+        """The (node_id, data10, data60, timestamp) of each node read, in the order nodes were first read.
+        Only the nodes in node_ids if provided."""
+        # The copy is atomic, so the data can be read from another thread than poll, such as the InfluxDB writes.
+        return [(node_id, data10, data60, timestamp) for node_id, (data10, data60, timestamp) in list(self._latest.items())
+                if node_ids is None or node_id in node_ids]
+
+    @property
+    def compiled_message10X_data(self) -> dict[int, bytes]:
+        return {node_id: latest[0] for node_id, latest in self._latest.items()}
+
+    @property
+    def compiled_message60X_data(self) -> dict[int, bytes]:
+        return {node_id: latest[1] for node_id, latest in self._latest.items()}
+
+    @property
+    def timestamps(self) -> dict[int, float]:
+        return {node_id: latest[2] for node_id, latest in self._latest.items()}
+
+    @property
+    def node_count(self) -> int:
+        return len(self._latest)
+
+    @property
+    def completed_sets(self) -> int:
+        return self._completed_sets
+
+    @property
+    def completed_sets_per_node(self) -> dict[int, int]:
+        return dict(self._completed_set_counts)
+
+    def _counters(self) -> Tuple[int, ...]:
+        return _COUNTERS.unpack_from(self._buffer, _COUNTERS_OFFSET)
+
+    @property
+    def frame_counts(self) -> dict[str, int]:
+        counters = self._counters()
+        return {MSG_TYPE_10: counters[0], MSG_TYPE_60: counters[1]}
+
+    @property
+    def ignored_frames(self) -> int:
+        return self._counters()[2]
+
+    @property
+    def dropped_frames(self) -> int:
+        return self._counters()[3]
+
+    @property
+    def out_of_order_sets(self) -> int:
+        return self._counters()[4]
+
+    @property
+    def incomplete_sets(self) -> int:
+        return self._counters()[5]
+
+    @property
+    def network_down_events(self) -> int:
+        return self._counters()[6]
+
+    @property
+    def socket_drops(self) -> int:
+        return self._counters()[7]
+
+    @property
+    def receive_buffer_size(self) -> int:
+        return self._counters()[8]
+
+    @property
+    def receive_buffer_increases(self) -> int:
+        return self._counters()[9]
+
+    def _node_stats(self) -> dict[int, Tuple[int, int, float]]:
+        stats = {}
+        for node_id in range(MAX_NODE_ID + 1):
+            seen, abandoned_sets, duplicated_frames, cycle_period = _NODE.unpack_from(self._buffer, HEADER_SIZE + node_id * _NODE.size)
+            if seen:
+                stats[node_id] = (abandoned_sets, duplicated_frames, cycle_period)
+        return stats
+
+    @property
+    def abandoned_sets_per_node(self) -> dict[int, int]:
+        return {node_id: stats[0] for node_id, stats in self._node_stats().items()}
+
+    @property
+    def duplicated_frames_per_node(self) -> dict[int, int]:
+        return {node_id: stats[1] for node_id, stats in self._node_stats().items()}
+
+    @property
+    def cycle_periods(self) -> dict[int, float]:
+        return {node_id: stats[2] for node_id, stats in self._node_stats().items() if stats[2]}
@@ -0,0 +1,270 @@
+"""
+Declarative signal definitions for eFlex battery data.
+
+Each battery signal is defined in a signal database by where it is found in the compiled
+10X or 60X message data, and how the raw value is interpreted. The signal database is
+compiled once into a decode function, which unpacks all signals of a battery with one
+precompiled struct per message data and byte order.
+
+The signal database is an ini file. Each section defines one signal, named by the section:
+
+    [battery_voltage]
+    # Compiled message data the signal is found in, 10X or 60X.
+    message = 10X
+    # Byte offset of the signal in the compiled message data.
+    offset = 2
+    # Python struct format of the raw value, starting with the byte order, < or >.
+    # A repeated format, such as <16H, decodes to a list of values.
+    format = >H
+    # Optional. The raw value is divided by the divisor.
+    divisor = 10
+    # Optional. number (the default), char for a single character, or serial for
+    # the 7 serial number bytes, which are formatted as the battery id.
+    type = number
+
+Signals are published in the order they are defined. Signals in a signal database file are
+added after the default signals below. A signal with the same name as a default signal
+replaces it.
+"""
+
+import configparser
+import struct
+from typing import Callable, List, NamedTuple
+from .decode import parse_serial_cached
+from .message_handler import MSG_10X_DATA_LENGTH, MSG_60X_DATA_LENGTH
+
+MESSAGE_10X = '10X'
+MESSAGE_60X = '60X'
+
+SIGNAL_TYPE_NUMBER = 'number'
+SIGNAL_TYPE_CHAR = 'char'
+SIGNAL_TYPE_SERIAL = 'serial'
+
+# Names added to the battery data by the publisher, which can't be used for signals.
+RESERVED_SIGNAL_NAMES = ('time',)
+
+DEFAULT_SIGNAL_DATABASE = """
+[battery_id]
+message = 10X
+offset = 49
+format = >7s
+type = serial
+
+[battery_number]
+message = 10X
+offset = 0
+format = >B
+
+[batteries_in_system]
+message = 10X
+offset = 1
+format = >B
+
+[battery_soc]
+message = 10X
+offset = 6
+format = >B
+
+[battery_voltage]
+message = 10X
+offset = 2
+format = >H
+divisor = 10
+
+[battery_current]
+message = 10X
+offset = 4
+format = >h
+divisor = 10
+
+[system_average_voltage]
+message = 10X
+offset = 10
+format = >H
+divisor = 10
+
+[pre_volt]
+message = 10X
+offset = 35
+format = >H
+divisor = 10
+
+[insulation_resistance]
+message = 10X
+offset = 37
+format = >H
+
+[software_version]
+message = 10X
+offset = 46
+format = >H
+
+[hardware_version]
+message = 10X
+offset = 48
+format = >c
+type = char
+
+[lifetime_discharge_energy]
+message = 10X
+offset = 31
+format = >I
+
+[cell_voltages]
+message = 60X
+offset = 0
+format = <16H
+"""
+
+MESSAGE_DATA_LENGTHS = {
+    MESSAGE_10X: MSG_10X_DATA_LENGTH,
+    MESSAGE_60X: MSG_60X_DATA_LENGTH,
+}
+
+
+class Signal(NamedTuple):
+    name: str
+    message: str
+    offset: int
+    format: str
+    divisor: int | float | None = None
+    type: str = SIGNAL_TYPE_NUMBER
+
+    @property
+    def byte_order(self) -> str:
+        return self.format[0]
+
+    @property
+    def size(self) -> int:
+        return struct.calcsize(self.format)
+
+    @property
+    def value_count(self) -> int:
+        return len(struct.unpack(self.format, bytes(self.size)))
+
+
+def _parse_signal(name: str, section: configparser.SectionProxy) -> Signal:
+    try:
+        divisor = section.get('divisor')
+        signal = Signal(
+            name = name,
+            message = section['message'].upper(),
+            offset = int(section['offset']),
+            format = section['format'],
+            divisor = float(divisor) if divisor and '.' in divisor else int(divisor) if divisor else None,
+            type = section.get('type', SIGNAL_TYPE_NUMBER),
+        )
+    except (KeyError, ValueError) as e:
+        raise ValueError(f"Signal {name} is not valid: {e}") from e
+
+    if name in RESERVED_SIGNAL_NAMES:
+        raise ValueError(f"Signal {name} uses a reserved name.")
+    if signal.message not in MESSAGE_DATA_LENGTHS:
+        raise ValueError(f"Signal {name} message must be {MESSAGE_10X} or {MESSAGE_60X}.")
+    if signal.byte_order not in ('<', '>'):
+        raise ValueError(f"Signal {name} format must start with the byte order, < or >.")
+    if signal.type not in (SIGNAL_TYPE_NUMBER, SIGNAL_TYPE_CHAR, SIGNAL_TYPE_SERIAL):
+        raise ValueError(f"Signal {name} type {signal.type} is not known.")
+
+    try:
+        values = struct.unpack(signal.format, bytes(signal.size))
+    except struct.error as e:
+        raise ValueError(f"Signal {name} format {signal.format} is not valid: {e}") from e
+    value_count = len(values)
+
+    # Number signals are published as JSON numbers, and char and serial signals are decoded from bytes.
+    numeric = all(isinstance(value, (int, float)) for value in values)
+    if numeric != (signal.type == SIGNAL_TYPE_NUMBER):
+        raise ValueError(f"Signal {name} format {signal.format} does not decode to "
+                         f"{'numbers' if signal.type == SIGNAL_TYPE_NUMBER else 'bytes'} for type {signal.type}.")
+
+    if signal.offset < 0 or signal.offset + signal.size > MESSAGE_DATA_LENGTHS[signal.message]:
+        raise ValueError(f"Signal {name} does not fit in the {MESSAGE_DATA_LENGTHS[signal.message]} bytes of {signal.message} data.")
+    if signal.type != SIGNAL_TYPE_NUMBER and (value_count != 1 or signal.divisor is not None):
+        raise ValueError(f"Signal {name} of type {signal.type} must be a single value without a divisor.")
+
+    return signal
+
+
+def load_signals(path: str | None = None) -> List[Signal]:
+    """Loads the default signals, and the signals of the signal database file at path if provided."""
+
+    database = configparser.ConfigParser(interpolation = None)
+    database.read_string(DEFAULT_SIGNAL_DATABASE)
+    signals = {name: _parse_signal(name, database[name]) for name in database.sections()}
+
+    if path:
+        database = configparser.ConfigParser(interpolation = None)
+        with open(path, encoding = 'utf-8') as signal_file:
+            database.read_file(signal_file)
+        signals.update({name: _parse_signal(name, database[name]) for name in database.sections()})
+
+    return list(signals.values())
+
+
+def compile_signals(signals: List[Signal]) -> Callable[[bytes, bytes], dict]:
+    """Compiles the signals into a function decoding the compiled 10X and 60X message data of a
+    battery to a dict of signal values, like decode.parse_battery_data.
+
+    Signals found in the same message data with the same byte order are unpacked together by a single
+    precompiled struct, with pad bytes skipping the bytes in between. Signals overlapping others are
+    placed in another struct. The generated function then only unpacks each struct once and builds
+    the dict, so its cost does not depend on how the signals are laid out.
+    """
+
+    # Each layout is (message, byte order, signals), ordered by offset.
+    layouts: List[tuple[str, str, List[Signal]]] = []
+    for signal in sorted(signals, key = lambda signal: (signal.message, signal.byte_order, signal.offset)):
+        for message, byte_order, layout_signals in layouts:
+            last = layout_signals[-1]
+            if (message, byte_order) == (signal.message, signal.byte_order) and last.offset + last.size <= signal.offset:
+                layout_signals.append(signal)
+                break
+        else:
+            layouts.append((signal.message, signal.byte_order, [signal]))
+
+    namespace: dict = {'_parse_serial': parse_serial_cached}
+    lines: List[str] = []
+    value_names: dict[str, List[str]] = {}
+    value_index = 0
+
+    for layout_index, (message, byte_order, layout_signals) in enumerate(layouts):
+        layout_format = byte_order
+        position = 0
+        names: List[str] = []
+        for signal in layout_signals:
+            if signal.offset > position:
+                layout_format += f"{signal.offset - position}x"
+            layout_format += signal.format[1:]
+            position = signal.offset + signal.size
+
+            value_names[signal.name] = [f"v{value_index + i}" for i in range(signal.value_count)]
+            value_index += signal.value_count
+            names += value_names[signal.name]
+
+        namespace[f"_layout{layout_index}"] = struct.Struct(layout_format)
+        data = 'data10' if message == MESSAGE_10X else 'data60'
+        lines.append(f"    ({', '.join(names)},) = _layout{layout_index}.unpack_from({data})")
+
+    items: List[str] = []
+    for signal in signals:
+        names = value_names[signal.name]
+        if signal.divisor is not None:
+            names = [f"{name} / {signal.divisor!r}" for name in names]
+
+        if signal.type == SIGNAL_TYPE_SERIAL:
+            value = f"_parse_serial({names[0]})"
+        elif signal.type == SIGNAL_TYPE_CHAR:
+            value = f"str({names[0]}, 'UTF-8')"
+        elif len(names) > 1:
+            value = f"[{', '.join(names)}]"
+        else:
+            value = names[0]
+        items.append(f"        {signal.name!r}: {value},")
+
+    source = "def decode(data10, data60):\n" + "\n".join(lines) + "\n    return {\n" + "\n".join(items) + "\n    }\n"
+    exec(compile(source, "<signal database>", "exec"), namespace)
+
+    decode = namespace['decode']
+    decode.__doc__ = "Decodes battery data with the compiled signal database.\n\n" + source
+    return decode
@@ -0,0 +1,220 @@
+"""
+Generates synthetic eFlex battery CAN bus traffic for testing and benchmarking.
+
+Each simulated battery sends its set of 11 0x10X messages followed by its set of 7 0x60X
+messages, one battery after the other, with the voltages, currents and state of charge
+varying from cycle to cycle. Bus problems can be simulated with timing jitter, and dropped,
+duplicated or out of order frames.
+
+The frames can be sent to a python-can bus, written to a candump log file, or fed straight
+to a MessageHandler. To write a candump log file from the command line:
+
+    python -m eflexcan2mqtt.simulator --batteries 14 --cycles 100 --output simulated.log
+"""
+
+import argparse
+import random
+import struct
+from typing import Iterator, List
+import can
+from .decode import MAX_NODE_ID
+from .message_handler import MSG_DATA_LENGTH
+
+
+# Compiled 10X and 60X data captured from a real battery, used for the bytes that are not simulated.
+TEMPLATE_10X_DATA = bytes([
+    0x01,0x0E,0x02,0x13,0xFF,0xFD,0x47,
+    0x03,0x00,0x00,0x02,0x12,0x01,0x01,
+    0x01,0xF4,0x02,0x58,0x00,0x01,0x2A,
+    0x0C,0xF7,0x01,0x0C,0xF7,0x01,0x64,
+    0x43,0x3F,0x35,0x00,0x02,0x7B,0xFA,
+    0x02,0x15,0xFF,0xFF,0x00,0x00,0x19,
+    0x00,0x00,0x00,0x00,0x0F,0xA6,0x61,
+    0x22,0x11,0x00,0x75,0x46,0x03,0xBB,
+    0x13,0x95,0xBA,0xEE,0x00,0x00,0x01,
+    0x00,0x00,0x00,0x00,0x00,0x02,0x15,
+    0x00,0x00,0x00,0x00,0x00,0x00,0x01,
+])
+
+TEMPLATE_60X_DATA = bytes([
+    0xF7,0x0C,0xF7,0x0C,0xF7,0x0C,0xF7,
+    0x0C,0xF7,0x0C,0xF7,0x0C,0xF7,0x0C,
+    0xF7,0x0C,0xF7,0x0C,0xF7,0x0C,0xF7,
+    0x0C,0xF7,0x0C,0xF7,0x0C,0xF7,0x0C,
+    0xF7,0x0C,0xF7,0x0C,0x00,0x00,0x00,
+    0x00,0x00,0x00,0x00,0x00,0x00,0x00,
+    0x41,0x40,0x3F,0x40,0x43,0x43,0x00,
+])
+
+# First byte of the 7th 0x60X message, as observed on real batteries.
+MSG_60X_LAST_FIRST_BYTE = 0x11
+
+_BATTERY_STATUS = struct.Struct(">BBHhB")
+_SYSTEM_VOLTAGE = struct.Struct(">H")
+_LIFETIME_DISCHARGE = struct.Struct(">I")
+_PRE_VOLT = struct.Struct(">H")
+_SERIAL = struct.Struct(">BBBBcH")
+_CELL_VOLTAGES = struct.Struct("<16H")
+
+
+class SimulatedBattery():
+    """State of one simulated battery, and its compiled 10X and 60X data."""
+
+    def __init__(self, node_id: int, battery_count: int, rng: random.Random):
+        self.node_id = node_id
+        self.battery_count = battery_count
+        self.soc = rng.randint(20, 95)
+        self.current = 0.0
+        self.cell_voltages = [rng.randint(3300, 3340) for _ in range(16)]
+        self.lifetime_discharge_energy = rng.randint(100000, 200000)
+        self.serial = (0x22, 0x11, 0x00, 0x75, b'F', node_id)
+        self.data10 = TEMPLATE_10X_DATA
+        self.data60 = TEMPLATE_60X_DATA
+
+    @property
+    def voltage(self) -> float:
+        return sum(self.cell_voltages) / 1000
+
+    def update(self, rng: random.Random, system_voltage: float) -> None:
+        """Moves the battery state one cycle on, and compiles the 10X and 60X data for it."""
+
+        self.current = max(-100.0, min(100.0, self.current + rng.uniform(-5, 5)))
+        self.soc = max(0, min(100, self.soc + rng.choice((-1, 0, 0, 0, 1))))
+        self.cell_voltages = [max(2800, min(3650, voltage + rng.randint(-2, 2))) for voltage in self.cell_voltages]
+        if self.current < 0:
+            self.lifetime_discharge_energy += 1
+
+        data10 = bytearray(TEMPLATE_10X_DATA)
+        _BATTERY_STATUS.pack_into(data10, 0, self.node_id, self.battery_count, round(self.voltage * 10),
+                                  round(self.current * 10), self.soc)
+        _SYSTEM_VOLTAGE.pack_into(data10, 10, round(system_voltage * 10))
+        _LIFETIME_DISCHARGE.pack_into(data10, 31, self.lifetime_discharge_energy)
+        _PRE_VOLT.pack_into(data10, 35, round(self.voltage * 10))
+        _SERIAL.pack_into(data10, 49, *self.serial)
+
+        data60 = bytearray(TEMPLATE_60X_DATA)
+        _CELL_VOLTAGES.pack_into(data60, 0, *self.cell_voltages)
+
+        self.data10 = bytes(data10)
+        self.data60 = bytes(data60)
+
+
+def split_frames(data: bytes, last_first_byte: int | None = None) -> List[bytearray]:
+    """Splits compiled data into the data of its messages, each starting with its sequence number."""
+
+    frame_count = len(data) // MSG_DATA_LENGTH
+    frames = []
+    for position in range(frame_count):
+        first_byte = position + 1
+        if last_first_byte is not None and position == frame_count - 1:
+            first_byte = last_first_byte
+        frames.append(bytearray([first_byte]) + data[position * MSG_DATA_LENGTH:(position + 1) * MSG_DATA_LENGTH])
+    return frames
+
+
+class BusSimulator():
+    """Generates the CAN frames sent by battery_count batteries.
+
+    - jitter: Maximum random delay in seconds added to each frame timestamp.
+    - drop_rate: Probability of a frame being dropped.
+    - duplicate_rate: Probability of a frame being sent twice.
+    - reorder_rate: Probability of a frame being swapped with the next frame of its set.
+    """
+
+    def __init__(self, battery_count: int, seed: int | None = None, cycle_interval: float = 1.0,
+                 frame_interval: float = 0.0005, jitter: float = 0.0, drop_rate: float = 0.0,
+                 duplicate_rate: float = 0.0, reorder_rate: float = 0.0, start_time: float = 1715987138.0):
+        if not 1 <= battery_count <= MAX_NODE_ID:
+            raise ValueError(f"battery_count must be between 1 and {MAX_NODE_ID}.")
+
+        self._rng = random.Random(seed)
+        self._cycle_interval = cycle_interval
+        self._frame_interval = frame_interval
+        self._jitter = jitter
+        self._drop_rate = drop_rate
+        self._duplicate_rate = duplicate_rate
+        self._reorder_rate = reorder_rate
+        self._time = start_time
+        self.batteries = [SimulatedBattery(node_id, battery_count, self._rng) for node_id in range(1, battery_count + 1)]
+
+    def frames(self, cycles: int) -> Iterator[can.Message]:
+        """Generates the frames of the given number of cycles, each battery sending its sets once per cycle."""
+
+        rng = self._rng
+        for _ in range(cycles):
+            cycle_start = self._time
+            system_voltage = sum(battery.voltage for battery in self.batteries) / len(self.batteries)
+
+            for battery in self.batteries:
+                battery.update(rng, system_voltage)
+
+                for arbitration_id, frames in (
+                    (0x100 + battery.node_id, split_frames(battery.data10)),
+                    (0x600 + battery.node_id, split_frames(battery.data60, MSG_60X_LAST_FIRST_BYTE)),
+                ):
+                    if self._reorder_rate:
+                        for i in range(len(frames) - 1):
+                            if rng.random() < self._reorder_rate:
+                                frames[i], frames[i + 1] = frames[i + 1], frames[i]
+
+                    for data in frames:
+                        self._time += self._frame_interval
+                        if self._drop_rate and rng.random() < self._drop_rate:
+                            continue
+
+                        timestamp = self._time + (rng.uniform(0, self._jitter) if self._jitter else 0.0)
+                        yield can.Message(arbitration_id = arbitration_id, timestamp = timestamp,
+                                          is_extended_id = False, data = data)
+
+                        if self._duplicate_rate and rng.random() < self._duplicate_rate:
+                            yield can.Message(arbitration_id = arbitration_id, timestamp = timestamp,
+                                              is_extended_id = False, data = data)
+
+            self._time = max(self._time, cycle_start + self._cycle_interval)
+
+    def feed(self, listener: can.Listener, cycles: int) -> int:
+        """Passes the frames straight to the listener, such as a MessageHandler. Returns the number of frames."""
+        count = 0
+        for msg in self.frames(cycles):
+            listener.on_message_received(msg)
+            count += 1
+        return count
+
+    def send(self, bus: can.BusABC, cycles: int) -> int:
+        """Sends the frames on a python-can bus, such as a virtual bus. Returns the number of frames."""
+        count = 0
+        for msg in self.frames(cycles):
+            bus.send(msg)
+            count += 1
+        return count
+
+    def write_candump(self, path: str, cycles: int, channel: str = "can0") -> int:
+        """Writes the frames to a candump -L log file. Returns the number of frames."""
+        count = 0
+        with can.io.CanutilsLogWriter(path, channel = channel) as writer:
+            for msg in self.frames(cycles):
+                writer.on_message_received(msg)
+                count += 1
+        return count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Write simulated eFlex battery CAN traffic to a candump log file.")
+    parser.add_argument("--batteries", type = int, default = 14)
+    parser.add_argument("--cycles", type = int, default = 100)
+    parser.add_argument("--output", required = True, help = "candump log file to write")
+    parser.add_argument("--seed", type = int)
+    parser.add_argument("--jitter", type = float, default = 0.0)
+    parser.add_argument("--drop-rate", type = float, default = 0.0)
+    parser.add_argument("--duplicate-rate", type = float, default = 0.0)
+    parser.add_argument("--reorder-rate", type = float, default = 0.0)
+    args = parser.parse_args()
+
+    simulator = BusSimulator(args.batteries, seed = args.seed, jitter = args.jitter, drop_rate = args.drop_rate,
+                             duplicate_rate = args.duplicate_rate, reorder_rate = args.reorder_rate)
+    count = simulator.write_candump(args.output, args.cycles)
+    print(f"Wrote {count:,} frames to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+"""
+Reads CAN frames from a socketcan interface directly on the asyncio event loop.
+"""
+import asyncio
+import errno
+import socket
+import struct
+import time
+from logging import Logger
+from typing import Callable, Iterable, List, NamedTuple, Tuple
+
+# struct can_frame: the CAN id with the EFF/RTR/ERR flags, the data length, 3 padding and
+# reserved bytes and 8 data bytes, in the host's byte order.
+CAN_FRAME = struct.Struct("=IB3x8s")
+CAN_FRAME_SIZE = CAN_FRAME.size
+
+# struct can_filter: CAN id and mask.
+CAN_FILTER = struct.Struct("=II")
+
+CAN_EFF_FLAG = 0x80000000
+CAN_RTR_FLAG = 0x40000000
+CAN_ERR_FLAG = 0x20000000
+CAN_EFF_MASK = 0x1FFFFFFF
+CAN_SFF_MASK = 0x000007FF
+
+# Frames read per wakeup at most, so a flooded bus doesn't starve the rest of the event loop.
+DEFAULT_BATCH_SIZE = 512
+
+# The errors a socketcan socket raises when its interface goes down, or is removed.
+NETWORK_DOWN_ERRORS = (errno.ENETDOWN, errno.ENODEV)
+
+# With SO_RXQ_OVFL, the kernel attaches the number of frames dropped by the socket so far, as they
+# arrived while its receive queue was full, to each frame received.
+SO_RXQ_OVFL = getattr(socket, 'SO_RXQ_OVFL', 40)
+_DROP_COUNT = struct.Struct("=I")
+
+# With SO_TIMESTAMPNS, the kernel attaches the time each frame was received, as a struct timespec,
+# to the frame. Frames are timestamped when they arrive, not when the event loop gets to read them.
+SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS', 35)
+_TIMESPEC = struct.Struct("@ll")
+_TIMESTAMP_SPACE = socket.CMSG_SPACE(_TIMESPEC.size)
+_TIMESTAMP_AND_DROP_COUNT_SPACE = _TIMESTAMP_SPACE + socket.CMSG_SPACE(_DROP_COUNT.size)
+
+# Frames are dropped in sustained_loss_checks consecutive drop checks before the receive buffer is
+# doubled, up to max_receive_buffer_size.
+DEFAULT_DROP_CHECK_INTERVAL = 10.0
+DEFAULT_SUSTAINED_LOSS_CHECKS = 3
+DEFAULT_MAX_RECEIVE_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+class Frame(NamedTuple):
+    """A received CAN frame, with the attributes of a can.Message read by the listeners."""
+    arbitration_id: int
+    data: bytes
+    timestamp: float
+    is_extended_id: bool = False
+
+
+def pack_can_filters(can_filters: Iterable[dict]) -> bytes:
+    """The CAN_RAW_FILTER socket option value of can.Bus style filters. Filters with extended
+    False only pass standard frames, and with extended True only extended frames."""
+
+    packed = b''
+    for can_filter in can_filters:
+        can_id, can_mask = can_filter['can_id'], can_filter['can_mask']
+        if 'extended' in can_filter:
+            can_mask |= CAN_EFF_FLAG
+            if can_filter['extended']:
+                can_id |= CAN_EFF_FLAG
+        packed += CAN_FILTER.pack(can_id, can_mask)
+    return packed
+
+
+def kernel_timestamp(ancillary_data: List[Tuple[int, int, bytes]]) -> float | None:
+    """The SO_TIMESTAMPNS time, in seconds since the epoch, in the ancillary data of a received frame, if any."""
+    for level, message_type, data in ancillary_data:
+        if level == socket.SOL_SOCKET and message_type == SO_TIMESTAMPNS and len(data) >= _TIMESPEC.size:
+            seconds, nanoseconds = _TIMESPEC.unpack_from(data)
+            return seconds + nanoseconds * 1e-9
+    return None
+
+
+def drop_count(ancillary_data: List[Tuple[int, int, bytes]]) -> int | None:
+    """The SO_RXQ_OVFL drop count in the ancillary data of a received frame, if any."""
+    for level, message_type, data in ancillary_data:
+        if level == socket.SOL_SOCKET and message_type == SO_RXQ_OVFL and len(data) >= _DROP_COUNT.size:
+            return _DROP_COUNT.unpack_from(data)[0]
+    return None
+
+
+def open_socketcan(channel: str, can_filters: Iterable[dict] | None = None) -> socket.socket:
+    """Opens a raw CAN socket bound to the channel, with the filters installed in the kernel."""
+
+    sock = socket.socket(socket.AF_CAN, socket.SOCK_RAW, socket.CAN_RAW)
+    try:
+        if can_filters is not None:
+            sock.setsockopt(socket.SOL_CAN_RAW, socket.CAN_RAW_FILTER, pack_can_filters(can_filters))
+        sock.bind((channel,))
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+class SocketCANReader():
+    """Reads the frames of a socketcan channel on the event loop, and hands them to the listeners'
+    on_message_received.
+
+    The socket is watched with loop.add_reader. Each time it is readable, all pending frames are
+    read, up to batch_size, and parsed with a single precompiled Struct into lightweight Frames,
+    rather than building a can.Message per frame and waking up once per frame as a can.Notifier does.
+    Each frame has the time the kernel received it, from SO_TIMESTAMPNS, or the time of the wakeup
+    if the socket doesn't provide it. Error and remote frames are skipped.
+
+    When the interface goes down, or is removed, the socket is closed and reopened after
+    min_reconnect_delay seconds. While it can't be reopened, such as while the interface is
+    removed, the delay doubles with each attempt up to max_reconnect_delay. A socket reopened on an
+    interface that is down receives frames once the interface is back up. The events are counted
+    in network_down_events.
+
+    With track_drops, the frames dropped by the kernel as the socket's receive queue was full are
+    counted in socket_drops, from the SO_RXQ_OVFL count received with each frame. They are checked
+    every drop_check_interval seconds, and when frames were dropped in sustained_loss_checks
+    consecutive checks, the socket's receive buffer, SO_RCVBUF, is doubled, up to
+    max_receive_buffer_size. The kernel caps it at net.core.rmem_max. receive_buffer_size sets it
+    when the socket is opened, the kernel default if 0.
+
+    open_socket opens the socket, the socketcan channel by default. It can be replaced with any
+    socket reading whole can_frame structs, such as one end of a socketpair in tests.
+    """
+
+    _listeners: List
+
+    def __init__(self, logger: Logger, channel: str, listeners: List, loop: asyncio.AbstractEventLoop,
+                 can_filters: Iterable[dict] | None = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                 min_reconnect_delay: float = 1.0, max_reconnect_delay: float = 60.0,
+                 track_drops: bool = False, receive_buffer_size: int = 0,
+                 max_receive_buffer_size: int = DEFAULT_MAX_RECEIVE_BUFFER_SIZE,
+                 drop_check_interval: float = DEFAULT_DROP_CHECK_INTERVAL,
+                 sustained_loss_checks: int = DEFAULT_SUSTAINED_LOSS_CHECKS,
+                 open_socket: Callable[[], socket.socket] | None = None):
+        self._logger = logger
+        self._channel = channel
+        self._listeners = listeners
+        self._loop = loop
+        self._batch_size = batch_size
+        self._min_reconnect_delay = min_reconnect_delay
+        self._max_reconnect_delay = max_reconnect_delay
+        can_filters = list(can_filters) if can_filters is not None else None
+        self._open_socket = open_socket or (lambda: open_socketcan(channel, can_filters))
+
+        self._track_drops = track_drops
+        self._requested_receive_buffer_size = receive_buffer_size
+        self._max_receive_buffer_size = max_receive_buffer_size
+        self._drop_check_interval = drop_check_interval
+        self._sustained_loss_checks = sustained_loss_checks
+
+        self._socket: socket.socket | None = None
+        self._reconnect_delay = min_reconnect_delay
+        self._reconnect_timer: asyncio.TimerHandle | None = None
+        self._drop_check_timer: asyncio.TimerHandle | None = None
+        self._closed = False
+
+        # Drops of the sockets closed before the current one, whose drop count starts from 0.
+        self._closed_socket_drops = 0
+        self._socket_drops = 0
+        self._checked_drops = 0
+        self._loss_checks = 0
+
+        self.frames_received = 0
+        self.wakeups = 0
+        self.network_down_events = 0
+        self.receive_buffer_size = 0
+        self.receive_buffer_increases = 0
+
+    def start(self) -> None:
+        """Opens the socket and starts reading. Raises OSError if the channel can't be opened."""
+        self._connect()
+        if self._track_drops:
+            self._drop_check_timer = self._loop.call_later(self._drop_check_interval, self._check_drops)
+
+    @property
+    def is_connected(self) -> bool:
+        return self._socket is not None
+
+    @property
+    def socket_drops(self) -> int:
+        """Frames dropped by the kernel as the receive queue was full, counted with track_drops."""
+        return self._closed_socket_drops + self._socket_drops
+
+    def _connect(self) -> None:
+        sock = self._open_socket()
+        try:
+            if self._requested_receive_buffer_size:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self._requested_receive_buffer_size)
+            sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+            if self._track_drops:
+                sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+            self.receive_buffer_size = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        except OSError:
+            sock.close()
+            raise
+        sock.setblocking(False)
+        self._socket = sock
+        self._reconnect_delay = self._min_reconnect_delay
+        self._loop.add_reader(sock.fileno(), self._on_readable_with_drops if self._track_drops else self._on_readable)
+
+    def _on_readable(self) -> None:
+        sock = self._socket
+        if sock is None:
+            return
+
+        self.wakeups += 1
+        recvmsg = sock.recvmsg
+        unpack = CAN_FRAME.unpack
+        unpack_timespec = _TIMESPEC.unpack_from
+        wakeup_time = time.time()
+        frames = []
+        try:
+            for _ in range(self._batch_size):
+                raw_frame, ancillary_data, _, _ = recvmsg(CAN_FRAME_SIZE, _TIMESTAMP_SPACE)
+                if len(raw_frame) != CAN_FRAME_SIZE:
+                    continue
+                # SO_TIMESTAMPNS is the only ancillary data enabled on this path.
+                if ancillary_data and ancillary_data[0][1] == SO_TIMESTAMPNS:
+                    seconds, nanoseconds = unpack_timespec(ancillary_data[0][2])
+                    timestamp = seconds + nanoseconds * 1e-9
+                else:
+                    timestamp = wakeup_time
+                can_id, length, data = unpack(raw_frame)
+                if can_id & (CAN_ERR_FLAG | CAN_RTR_FLAG):
+                    continue
+                if can_id & CAN_EFF_FLAG:
+                    frames.append(Frame(can_id & CAN_EFF_MASK, data[:length], timestamp, True))
+                else:
+                    frames.append(Frame(can_id, data[:length] if length != 8 else data, timestamp))
+        except BlockingIOError:
+            pass
+        except OSError as e:
+            if e.errno not in NETWORK_DOWN_ERRORS:
+                raise
+            self._dispatch(frames)
+            self._on_network_down(e)
+            return
+
+        self._dispatch(frames)
+
+    def _on_readable_with_drops(self) -> None:
+        """_on_readable, receiving each frame with its drop count. The loop is repeated rather than
+        shared, to keep function calls per frame off the default path."""
+
+        sock = self._socket
+        if sock is None:
+            return
+
+        self.wakeups += 1
+        recvmsg = sock.recvmsg
+        unpack = CAN_FRAME.unpack
+        wakeup_time = time.time()
+        frames = []
+        socket_drops = None
+        try:
+            for _ in range(self._batch_size):
+                raw_frame, ancillary_data, _, _ = recvmsg(CAN_FRAME_SIZE, _TIMESTAMP_AND_DROP_COUNT_SPACE)
+                timestamp = None
+                if ancillary_data:
+                    # The kernel only attaches the drop count once frames were dropped.
+                    socket_drops = drop_count(ancillary_data) or socket_drops
+                    timestamp = kernel_timestamp(ancillary_data)
+                if timestamp is None:
+                    timestamp = wakeup_time
+                if len(raw_frame) != CAN_FRAME_SIZE:
+                    continue
+                can_id, length, data = unpack(raw_frame)
+                if can_id & (CAN_ERR_FLAG | CAN_RTR_FLAG):
+                    continue
+                if can_id & CAN_EFF_FLAG:
+                    frames.append(Frame(can_id & CAN_EFF_MASK, data[:length], timestamp, True))
+                else:
+                    frames.append(Frame(can_id, data[:length] if length != 8 else data, timestamp))
+        except BlockingIOError:
+            pass
+        except OSError as e:
+            if e.errno not in NETWORK_DOWN_ERRORS:
+                raise
+            self._dispatch(frames)
+            self._on_network_down(e)
+            return
+        finally:
+            if socket_drops is not None:
+                self._socket_drops = socket_drops
+
+        self._dispatch(frames)
+
+    def _check_drops(self) -> None:
+        """Doubles the receive buffer when frames were dropped in sustained_loss_checks consecutive checks."""
+
+        self._drop_check_timer = self._loop.call_later(self._drop_check_interval, self._check_drops)
+        socket_drops = self.socket_drops
+        if socket_drops == self._checked_drops:
+            self._loss_checks = 0
+            return
+
+        self._logger.warning("CAN network %s: %s frames dropped by the socket in the last %s s.", self._channel,
+                             socket_drops - self._checked_drops, self._drop_check_interval)
+        self._checked_drops = socket_drops
+        self._loss_checks += 1
+        if self._loss_checks < self._sustained_loss_checks or self._socket is None:
+            return
+        self._loss_checks = 0
+
+        # The kernel reports twice the size set, for its bookkeeping overhead.
+        current_size = self.receive_buffer_size // 2
+        size = min(current_size * 2, self._max_receive_buffer_size)
+        if size <= current_size:
+            return
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+        self._requested_receive_buffer_size = size
+        self.receive_buffer_size = self._socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        if self.receive_buffer_size // 2 <= current_size:
+            self._logger.warning("CAN network %s: sustained frame loss, and the receive buffer can't be raised "
+                                 "above net.core.rmem_max.", self._channel)
+            return
+        self.receive_buffer_increases += 1
+        self._logger.warning("CAN network %s: sustained frame loss. Receive buffer raised to %s bytes.",
+                             self._channel, self.receive_buffer_size)
+
+    def _dispatch(self, frames: List[Frame]) -> None:
+        self.frames_received += len(frames)
+        for listener in self._listeners:
+            on_message_received = listener.on_message_received
+            for frame in frames:
+                try:
+                    on_message_received(frame)
+                except Exception as e:
+                    # As a can.Notifier does, the listener handles its own errors, per frame, and
+                    # still receives the rest of the batch.
+                    listener.on_error(e)
+
+    def _on_network_down(self, error: OSError) -> None:
+        self.network_down_events += 1
+        self._logger.error("CAN network %s down: %s. Reconnecting in %s s.", self._channel, error.strerror, self._reconnect_delay)
+        self._disconnect()
+        self._schedule_reconnect()
+
+    def _schedule_reconnect(self) -> None:
+        self._reconnect_timer = self._loop.call_later(self._reconnect_delay, self._reconnect)
+
+    def _reconnect(self) -> None:
+        self._reconnect_timer = None
+        if self._closed:
+            return
+        try:
+            self._connect()
+        except OSError as e:
+            self._reconnect_delay = min(self._reconnect_delay * 2, self._max_reconnect_delay)
+            self._logger.warning("CAN network %s still down: %s. Reconnecting in %s s.", self._channel, e.strerror, self._reconnect_delay)
+            self._schedule_reconnect()
+            return
+        self._logger.info("CAN network %s reopened.", self._channel)
+
+    def _disconnect(self) -> None:
+        self._closed_socket_drops += self._socket_drops
+        self._socket_drops = 0
+        if self._socket is not None:
+            self._loop.remove_reader(self._socket.fileno())
+            self._socket.close()
+            self._socket = None
+
+    def stop(self) -> None:
+        self._closed = True
+        if self._reconnect_timer is not None:
+            self._reconnect_timer.cancel()
+            self._reconnect_timer = None
+        if self._drop_check_timer is not None:
+            self._drop_check_timer.cancel()
+            self._drop_check_timer = None
+        self._disconnect()
@@ -0,0 +1,98 @@
+"""
+Store-and-forward spool for battery data that could not be published.
+"""
+import json
+import os
+from logging import Logger
+from typing import List, Tuple
+
+class DiskSpool():
+    """A bounded, first-in first-out store of payloads, kept in a SQLite database file.
+
+    The total size of the stored payloads is capped at max_bytes. When appending a payload
+    would exceed the cap, the oldest payloads are evicted first, so a long broker outage
+    cannot fill the disk. Freed database pages are returned to the file system as payloads
+    are removed.
+    """
+
+    def __init__(self, path: str, max_bytes: int, logger: Logger):
+        self._path = path
+        self._max_bytes = max_bytes
+        self._logger = logger
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+
+        # Only imported when the spool is enabled.
+        import sqlite3
+        self._connection = sqlite3.connect(path, isolation_level = None)
+        # auto_vacuum only takes effect if set before the table is created.
+        self._connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self._connection.execute("PRAGMA synchronous = NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS spool (id INTEGER PRIMARY KEY AUTOINCREMENT, size INTEGER NOT NULL, payload BLOB NOT NULL)"
+        )
+        self._size, self._count = self._connection.execute("SELECT COALESCE(SUM(size), 0), COUNT(*) FROM spool").fetchone()
+
+        if self._count:
+            self._logger.info("Spool %s contains %s payloads (%s bytes) from a previous run.", path, self._count, self._size)
+
+    def append(self, payload: List[dict]) -> None:
+        """Stores the payload, evicting the oldest payloads if needed to stay under the size cap."""
+
+        data = json.dumps(payload, separators = (',', ':')).encode('utf-8')
+        size = len(data)
+
+        if size > self._max_bytes:
+            self._logger.error("Payload of %s bytes is larger than the spool size cap of %s bytes. Dropping it.", size, self._max_bytes)
+            return
+
+        with self._connection:
+            self._connection.execute("BEGIN")
+            evicted = 0
+            while self._size + size > self._max_bytes:
+                oldest_id, oldest_size = self._connection.execute("SELECT id, size FROM spool ORDER BY id LIMIT 1").fetchone()
+                self._connection.execute("DELETE FROM spool WHERE id = ?", (oldest_id,))
+                self._size -= oldest_size
+                self._count -= 1
+                evicted += 1
+
+            self._connection.execute("INSERT INTO spool (size, payload) VALUES (?, ?)", (size, data))
+            self._size += size
+            self._count += 1
+
+        if evicted:
+            self._logger.warning("Spool size cap of %s bytes reached. Evicted %s oldest payloads.", self._max_bytes, evicted)
+            self._connection.execute("PRAGMA incremental_vacuum")
+
+    def peek(self, limit: int) -> List[Tuple[int, List[dict]]]:
+        """Returns up to limit of the oldest payloads, with their ids, without removing them."""
+
+        rows = self._connection.execute("SELECT id, payload FROM spool ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [(payload_id, json.loads(payload)) for payload_id, payload in rows]
+
+    def remove(self, last_id: int) -> None:
+        """Removes all payloads up to and including the payload with last_id."""
+
+        with self._connection:
+            self._connection.execute("BEGIN")
+            size, count = self._connection.execute(
+                "SELECT COALESCE(SUM(size), 0), COUNT(*) FROM spool WHERE id <= ?", (last_id,)
+            ).fetchone()
+            self._connection.execute("DELETE FROM spool WHERE id <= ?", (last_id,))
+            self._size -= size
+            self._count -= count
+
+        self._connection.execute("PRAGMA incremental_vacuum")
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def size(self) -> int:
+        """Total size in bytes of the stored payloads."""
+        return self._size
@@ -1,3 +1,11 @@
+import time
+
+# Startup time is the time frames are lost while the service restarts. Only what is needed to read
+# the CAN channels is imported before they are opened: python-can, for other interfaces than
+# socketcan, the MQTT client, psutil and the split process mode's multiprocessing are imported
+# once needed.
+started = time.monotonic()
+
 import asyncio
 import configparser
 import signal
@@ -6,14 +14,31 @@ import logging.handlers
 import os
 import sys
 import argparse
-from typing import List
-import psutil
-import can
-from can.notifier import MessageRecipient
-from can.bus import BusABC
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, List
+from eflexcan2mqtt.config import CANChannelConfig, load_can_channels
+from eflexcan2mqtt.checkpoint import Checkpoint
+from eflexcan2mqtt.archive import DEFAULT_FLUSH_ROWS, DEFAULT_RETENTION_DAYS, SampleArchive
+from eflexcan2mqtt.influx_client import DEFAULT_BATCH_SIZE, DEFAULT_MEASUREMENT, InfluxClient
+from eflexcan2mqtt.metrics import ChannelMetrics, MetricsServer, MetricsWriter, write_metrics
+from eflexcan2mqtt.profiling import DEFAULT_TOP, DEFAULT_TRACEMALLOC_FRAMES, Profiler
+from eflexcan2mqtt.rollup import DEFAULT_CAPACITY, Rollup
+from eflexcan2mqtt.delta import DEFAULT_KEYFRAME_INTERVAL, DeltaEncoder, parse_deadbands
+from eflexcan2mqtt.event_publisher import EventPublisher, PUBLISH_MODE_EVENT, PUBLISH_MODE_INTERVAL, PUBLISH_MODES
 from eflexcan2mqtt.message_handler import MessageHandler
-from eflexcan2mqtt.paho_client import PahoClient
 from eflexcan2mqtt.mqtt_publisher import MQTTPublisher
+from eflexcan2mqtt.serializers import SERIALIZER_BINARY, SERIALIZER_JSON, check_decoder, create_serializer
+from eflexcan2mqtt.spool import DiskSpool
+from eflexcan2mqtt.signals import compile_signals, load_signals
+from eflexcan2mqtt.shared_ring import DEFAULT_CAPACITY as DEFAULT_RING_CAPACITY, SetRingReader, SetRingWriter, create_ring
+from eflexcan2mqtt.socketcan_reader import DEFAULT_DROP_CHECK_INTERVAL, DEFAULT_MAX_RECEIVE_BUFFER_SIZE, SocketCANReader
+
+if TYPE_CHECKING:
+    import can
+    import psutil
+    from multiprocessing.shared_memory import SharedMemory
+    from eflexcan2mqtt.paho_client import PahoClient
 
 # Ensure we don't blow up if there's no such thing as stdout on the system.
 if sys.stdout is None:
@@ -22,7 +47,7 @@ if sys.stderr is None:
     sys.stderr = open(os.devnull, "w")
 
 pid = os.getpid()
-process = psutil.Process(pid)
+process: 'psutil.Process | None' = None
 
 parser = argparse.ArgumentParser(description="Fortress eFlex Battery CAN 2 MQTT Service")
 parser.add_argument("--config_path",help="The path to the configuration file", default="./conf/eflexcan2mqtt.ini")
@@ -39,8 +64,10 @@ config = {
     'log_dir': config_parser['logging'].get('log_dir'),
     'log_level': config_parser['logging'].get('log_level', "INFO"),
     'profile': config_parser['logging'].getboolean('profile', 'no'),
-    'can_interface': config_parser['can'].get('interface', 'socketcan'),
-    'can_channel': config_parser['can'].get('channel'),
+    'can_track_drops' : config_parser.getboolean('can', 'track_drops', fallback = False),
+    'can_receive_buffer_size' : config_parser.getint('can', 'receive_buffer_size', fallback = 0),
+    'can_max_receive_buffer_size' : config_parser.getint('can', 'max_receive_buffer_size', fallback = DEFAULT_MAX_RECEIVE_BUFFER_SIZE),
+    'can_drop_check_interval' : config_parser.getfloat('can', 'drop_check_interval', fallback = DEFAULT_DROP_CHECK_INTERVAL),
     'mqtt_hostname' : config_parser['mqtt'].get('hostname'),
     'mqtt_port' : int(config_parser['mqtt'].get('port', '1883')),
     'mqtt_topic' : config_parser['mqtt'].get('topic'),
@@ -48,26 +75,142 @@ config = {
     'mqtt_client_id' : config_parser['mqtt'].get('client_id'),
     'mqtt_publish_interval' : int(config_parser['mqtt'].get('publish_interval', '60')),
     'mqtt_qos' : int(config_parser['mqtt'].get('qos', '2')),
+    'mqtt_publish_mode' : config_parser['mqtt'].get('publish_mode', PUBLISH_MODE_INTERVAL),
+    'mqtt_coalesce_window' : config_parser.getfloat('mqtt', 'coalesce_window', fallback = 1),
+    'mqtt_min_interval' : config_parser.getfloat('mqtt', 'min_interval', fallback = 10),
+    'mqtt_payload_format' : config_parser.get('mqtt', 'payload_format', fallback = SERIALIZER_JSON),
+    'mqtt_fan_out' : config_parser.getboolean('mqtt', 'fan_out', fallback = False),
+    'mqtt_field_topics' : config_parser.getboolean('mqtt', 'field_topics', fallback = False),
+    'mqtt_min_reconnect_delay' : int(config_parser['mqtt'].get('min_reconnect_delay', '1')),
+    'mqtt_max_reconnect_delay' : int(config_parser['mqtt'].get('max_reconnect_delay', '120')),
+    'spool_path' : config_parser.get('spool', 'path', fallback = ''),
+    'spool_max_size' : config_parser.getint('spool', 'max_size', fallback = 52428800),
+    'spool_drain_batch_size' : config_parser.getint('spool', 'drain_batch_size', fallback = 50),
+    'spool_drain_interval' : config_parser.getfloat('spool', 'drain_interval', fallback = 5),
+    'checkpoint_path' : config_parser.get('checkpoint', 'path', fallback = ''),
+    'checkpoint_interval' : config_parser.getfloat('checkpoint', 'interval', fallback = 60),
+    'checkpoint_max_age' : config_parser.getfloat('checkpoint', 'max_age', fallback = 3600),
+    'decode_signals' : config_parser.get('decode', 'signals', fallback = ''),
+    'delta_enabled' : config_parser.getboolean('delta', 'enabled', fallback = False),
+    'delta_keyframe_interval' : config_parser.getfloat('delta', 'keyframe_interval', fallback = DEFAULT_KEYFRAME_INTERVAL),
+    'delta_deadbands' : config_parser.get('delta', 'deadbands', fallback = ''),
+    'rollup_enabled' : config_parser.getboolean('rollup', 'enabled', fallback = False),
+    'rollup_capacity' : config_parser.getint('rollup', 'capacity', fallback = DEFAULT_CAPACITY),
+    'archive_path' : config_parser.get('archive', 'path', fallback = ''),
+    'archive_retention_days' : config_parser.getint('archive', 'retention_days', fallback = DEFAULT_RETENTION_DAYS),
+    'archive_compress' : config_parser.getboolean('archive', 'compress', fallback = True),
+    'archive_flush_rows' : config_parser.getint('archive', 'flush_rows', fallback = DEFAULT_FLUSH_ROWS),
+    'influxdb_url' : config_parser.get('influxdb', 'url', fallback = ''),
+    'influxdb_bucket' : config_parser.get('influxdb', 'bucket', fallback = ''),
+    'influxdb_org' : config_parser.get('influxdb', 'org', fallback = ''),
+    'influxdb_token' : config_parser.get('influxdb', 'token', fallback = ''),
+    'influxdb_measurement' : config_parser.get('influxdb', 'measurement', fallback = DEFAULT_MEASUREMENT),
+    'influxdb_batch_size' : config_parser.getint('influxdb', 'batch_size', fallback = DEFAULT_BATCH_SIZE),
+    'influxdb_flush_interval' : config_parser.getfloat('influxdb', 'flush_interval', fallback = 0),
+    'influxdb_compress' : config_parser.getboolean('influxdb', 'compress', fallback = True),
+    'metrics_host' : config_parser.get('metrics', 'host', fallback = '127.0.0.1'),
+    'metrics_port' : config_parser.getint('metrics', 'port', fallback = 0),
+    'profiling_dir' : config_parser.get('profiling', 'dir', fallback = ''),
+    'profiling_tracemalloc_frames' : config_parser.getint('profiling', 'tracemalloc_frames', fallback = DEFAULT_TRACEMALLOC_FRAMES),
+    'profiling_top' : config_parser.getint('profiling', 'top', fallback = DEFAULT_TOP),
+    'profiling_trace_memory' : config_parser.getboolean('profiling', 'trace_memory', fallback = False),
+    'process_split' : config_parser.getboolean('process', 'split', fallback = False),
+    'process_ring_capacity' : config_parser.getint('process', 'ring_capacity', fallback = DEFAULT_RING_CAPACITY),
+    'process_poll_interval' : config_parser.getfloat('process', 'poll_interval', fallback = 0.1),
+    'process_restart_delay' : config_parser.getfloat('process', 'restart_delay', fallback = 1),
 }
 
 if not os.path.isdir(config['log_dir']):
     print ("Specified log directy %s is not a directory. Shutting down.", config['log_dir'])
     sys.exit(1)
 
-logFilename: str = str(config['log_dir']).rstrip('/') + '/eflexcan2mqtt.out'
+def create_log_handler(name: str) -> logging.Handler:
+    """The rotating handler of the log file name.out in the log directory."""
+    handler = logging.handlers.RotatingFileHandler(str(config['log_dir']).rstrip('/') + f'/{name}.out',
+                                                   maxBytes=524288, backupCount=5)
+    handler.setFormatter(logging.Formatter('%(asctime)s [%(name)-12s] %(levelname)-8s %(message)s'))
+    return handler
 
 logger = logging.getLogger(__name__)
-handler = logging.handlers.RotatingFileHandler(logFilename, maxBytes=524288, backupCount=5)
-
-formatter = logging.Formatter(
-    '%(asctime)s [%(name)-12s] %(levelname)-8s %(message)s')
-handler.setFormatter(formatter)
+handler = create_log_handler('eflexcan2mqtt')
 logger.addHandler(handler)
 logger.setLevel(config['log_level'])
 
 
 logger.info("Running process ID is %s", pid)
-logger.info("Running with config: %s", config)
+logger.info("Running with config: %s", {key: '***' if key == 'influxdb_token' and value else value for key, value in config.items()})
+
+if config['mqtt_publish_mode'] not in PUBLISH_MODES:
+    logger.error("Publish mode %s is not one of %s. Shutting down.", config['mqtt_publish_mode'], PUBLISH_MODES)
+    sys.exit(1)
+
+try:
+    can_channels = load_can_channels(config_parser, config['mqtt_topic'], config['spool_path'], config['checkpoint_path'])
+except ValueError as e:
+    logger.error("CAN channels could not be configured: %s. Shutting down.", e)
+    sys.exit(1)
+
+logger.info("Running with CAN channels: %s", can_channels)
+
+try:
+    decoder = compile_signals(load_signals(config['decode_signals']))
+except (OSError, ValueError) as e:
+    logger.error("Signal database could not be loaded: %s. Shutting down.", e)
+    sys.exit(1)
+
+logger.debug("Compiled signal database: %s", decoder.__doc__)
+
+if config['delta_enabled'] and (config['mqtt_fan_out'] or config['mqtt_field_topics']):
+    logger.error("Delta publishing can't be enabled with fan_out or field_topics. Shutting down.")
+    sys.exit(1)
+
+if config['delta_enabled'] and config['mqtt_payload_format'] == SERIALIZER_BINARY:
+    logger.error("Delta publishing can't be enabled with the binary payload format. Shutting down.")
+    sys.exit(1)
+
+if config['mqtt_payload_format'] == SERIALIZER_BINARY and (config['mqtt_fan_out'] or config['mqtt_field_topics']):
+    logger.error("The binary payload format can't be used with fan_out or field_topics, which are published as JSON. Shutting down.")
+    sys.exit(1)
+
+if config['rollup_enabled'] and config['mqtt_payload_format'] == SERIALIZER_BINARY:
+    logger.error("Rollups can't be enabled with the binary payload format. Shutting down.")
+    sys.exit(1)
+
+if config['rollup_enabled'] and config['rollup_capacity'] < 1:
+    logger.error("Rollup capacity must be at least 1. Shutting down.")
+    sys.exit(1)
+
+if config['process_split'] and config['process_ring_capacity'] < 1:
+    logger.error("Process ring capacity must be at least 1. Shutting down.")
+    sys.exit(1)
+
+if config['can_drop_check_interval'] <= 0:
+    logger.error("CAN drop check interval must be greater than 0. Shutting down.")
+    sys.exit(1)
+
+if config['checkpoint_interval'] <= 0:
+    logger.error("Checkpoint interval must be greater than 0. Shutting down.")
+    sys.exit(1)
+
+if config['influxdb_url']:
+    try:
+        InfluxClient(url = config['influxdb_url'], bucket = config['influxdb_bucket'], logger = logger)
+    except ValueError as e:
+        logger.error("%s Shutting down.", e)
+        sys.exit(1)
+
+try:
+    serializer = create_serializer(config['mqtt_payload_format'])
+    check_decoder(serializer, decoder)
+except ValueError as e:
+    logger.error("%s Shutting down.", e)
+    sys.exit(1)
+
+try:
+    deadbands = parse_deadbands(config['delta_deadbands'])
+except ValueError as e:
+    logger.error("Delta deadbands could not be parsed: %s. Shutting down.", e)
+    sys.exit(1)
 
 
 def add_signal_handlers():
@@ -98,63 +241,336 @@ def add_signal_handlers():
 
 def log_memory_info(msg: str):
     """Logs memory info"""
+    global process
+    if process is None:
+        import psutil
+        process = psutil.Process(pid)
     mem_info = process.memory_info()
     logger.info("%s Current memory usage of process %s: RSS %s, VMS %s", msg, pid, mem_info.rss, mem_info.vms)
 
-def _on_message_available(self, bus: BusABC) -> None:
-    """This is a patch for the standard can.Notifier._on_message_available method,
-    which does not capture CAN network errors. During real-world operation, socketcan
-    network interfaces will sometimes do down. The interface can be configured at the OS level
-    to recover, but if the error is not handled no more CAN bus messages will be processed by
-    the event handler when the network interface is back up. There are two error codes observed
-    when the network goes down:
-        - Error code 100 is "Network is down".
-        - Error code 19 is "No such device".
+def create_bus_reader(channel_config: CANChannelConfig, message_handler: MessageHandler, channel_logger: logging.Logger) -> SocketCANReader | None:
+    """socketcan channels are read by a SocketCANReader, which recovers from the CAN network going down,
+    and with track_drops raises the socket's receive buffer when frames are dropped."""
+    if channel_config.interface != 'socketcan':
+        return None
+    return SocketCANReader(logger = channel_logger, channel = channel_config.channel, listeners = [message_handler],
+                           loop = asyncio.get_running_loop(), can_filters = channel_config.can_filters,
+                           track_drops = config['can_track_drops'], receive_buffer_size = config['can_receive_buffer_size'],
+                           max_receive_buffer_size = config['can_max_receive_buffer_size'],
+                           drop_check_interval = config['can_drop_check_interval'])
+
+
+def start_bus(stack: contextlib.ExitStack, channel_config: CANChannelConfig, message_handler: MessageHandler,
+              bus_reader: SocketCANReader | None) -> 'can.Notifier | None':
+    """Starts reading the channel on the event loop, with its bus reader, or otherwise a can.Bus and
+    can.Notifier, which is returned. Both are stopped when the stack is closed."""
+
+    if bus_reader is not None:
+        stack.callback(bus_reader.stop)
+        bus_reader.start()
+        return None
+    import can
+    bus = stack.enter_context(can.Bus(interface = channel_config.interface, channel = channel_config.channel,
+                                      can_filters = channel_config.can_filters))
+    return can.Notifier(bus, [message_handler], loop = asyncio.get_running_loop())
+
+
+class Channel():
+    """The battery data ingestion of one CAN channel: its bus reader, message handling and publishing.
+
+    In the publisher process of the split process mode, the channel has no bus reader, and its
+    MessageHandler is the reader of the ring written by the ingest process.
+
+    The publishing, archive and InfluxDB writes are added by add_sinks, once the CAN channels are
+    read. As the event loop only handles the frames once main awaits, no set is missed by them.
+
+    With a checkpoint, the battery data saved before the service was restarted is restored before
+    the channel is read, and the published timestamps once the MQTT publisher is added.
+    """
+
+    def __init__(self, channel_config: CANChannelConfig, ring_reader: SetRingReader | None = None):
+        self.config = channel_config
+        self.logger = logger.getChild(channel_config.name)
+        self.ring_reader = ring_reader
+        self.message_handler = ring_reader or MessageHandler(self.logger)
+
+        self.bus_reader = None
+        if ring_reader is None:
+            self.bus_reader = create_bus_reader(channel_config, self.message_handler, self.logger)
+
+        self.checkpoint = None
+        self.restored_nodes = 0
+        self.restored_published_timestamps: dict[int, float] = {}
+        if channel_config.checkpoint_path:
+            self.checkpoint = Checkpoint(path = channel_config.checkpoint_path, logger = self.logger)
+            self.restore_checkpoint()
+
+    def restore_checkpoint(self) -> None:
+        """Restores the battery data of the checkpoint, except that older than max_age seconds, which
+        would be published as current, and keeps its published timestamps for the MQTT publisher."""
+        oldest = time.time() - config['checkpoint_max_age']
+        for node in self.checkpoint.load():
+            if node.published_timestamp is not None:
+                self.restored_published_timestamps[node.node_id] = node.published_timestamp
+            if node.data10 is not None and node.timestamp >= oldest:
+                self.message_handler.restore_battery_data(node.node_id, node.data10, node.data60, node.timestamp)
+                self.restored_nodes += 1
+        if self.restored_nodes:
+            self.logger.info("Restored the battery data of %s nodes from checkpoint %s.", self.restored_nodes, self.checkpoint.path)
+
+    def save_checkpoint(self) -> None:
+        if self.checkpoint is None:
+            return
+        try:
+            self.checkpoint.save(self.message_handler.compiled_battery_data(), self.mqtt_publisher.published_timestamps)
+        except OSError as e:
+            self.logger.error("Failed to save checkpoint %s.", self.checkpoint.path, exc_info = e)
+
+    def unpublished_node_ids(self) -> List[int]:
+        """The nodes with battery data newer than the data last published."""
+        published_timestamps = self.mqtt_publisher.published_timestamps
+        return [node_id for node_id, _, _, timestamp in self.message_handler.compiled_battery_data()
+                if published_timestamps.get(node_id, 0.0) < timestamp]
+
+    def add_sinks(self, mqtt_client: 'PahoClient') -> None:
+        """Adds the spool, rollup, archive and InfluxDB writes, if configured, and the MQTT publisher."""
+        self.spool = None
+        if self.config.spool_path:
+            self.spool = DiskSpool(path = self.config.spool_path, max_bytes = config['spool_max_size'], logger = self.logger)
+
+        delta_encoder = None
+        if config['delta_enabled']:
+            delta_encoder = DeltaEncoder(deadbands = deadbands, keyframe_interval = config['delta_keyframe_interval'])
+
+        self.rollup = None
+        if config['rollup_enabled']:
+            self.rollup = Rollup(self.message_handler, capacity = config['rollup_capacity'])
+
+        # Each channel archives to its own directory, named after the channel, in the archive path.
+        self.archive = None
+        if config['archive_path']:
+            self.archive = SampleArchive(path = os.path.join(config['archive_path'], self.config.name), logger = self.logger,
+                                         message_handler = self.message_handler,
+                                         retention_days = config['archive_retention_days'],
+                                         compress = config['archive_compress'], flush_rows = config['archive_flush_rows'])
+
+        # Battery data is also written to InfluxDB if configured, with sub-second timestamps, every publish interval.
+        # The writes block on the network, so they are done by a worker thread, see write_influx.
+        self.influx_client = None
+        self.influx_publisher = None
+        self.influx_write: 'asyncio.Future[None] | None' = None
+        if config['influxdb_url']:
+            self.influx_client = InfluxClient(url = config['influxdb_url'], bucket = config['influxdb_bucket'], logger = self.logger,
+                                              org = config['influxdb_org'], token = config['influxdb_token'],
+                                              measurement = config['influxdb_measurement'], tags = {'channel': self.config.name},
+                                              batch_size = config['influxdb_batch_size'],
+                                              flush_interval = config['influxdb_flush_interval'],
+                                              compress = config['influxdb_compress'])
+            self.influx_publisher = MQTTPublisher(logger = self.logger, mqtt_client = self.influx_client,
+                                                  message_handler = self.message_handler, decoder = decoder,
+                                                  round_time = False)
+
+        self.mqtt_publisher = MQTTPublisher(logger = self.logger, mqtt_client = mqtt_client, message_handler = self.message_handler,
+                                            spool = self.spool, drain_batch_size = config['spool_drain_batch_size'],
+                                            decoder = decoder, topic = self.config.topic, delta_encoder = delta_encoder,
+                                            fan_out = config['mqtt_fan_out'], field_topics = config['mqtt_field_topics'],
+                                            rollup = self.rollup)
+        self.mqtt_publisher.restore_published_timestamps(self.restored_published_timestamps)
+
+        # The ring reader has the network down events of the ingest process.
+        self.metrics = ChannelMetrics(self.config.name, self.message_handler, self.mqtt_publisher,
+                                      self.bus_reader or self.ring_reader, ring_reader = self.ring_reader)
+        self.logged_losses = (0, 0, 0)
+
+    def log_metrics(self) -> None:
+        self.logger.debug("Channel %s: %s nodes, %s completed sets.", self.config.channel,
+                         self.message_handler.node_count, self.message_handler.completed_sets)
+        # The sets abandoned, the frames dropped by the socket and the sets lost in the ring are logged when
+        # there are new ones.
+        abandoned_sets = {node_id: count for node_id, count in self.message_handler.abandoned_sets_per_node.items() if count}
+        losses = (sum(abandoned_sets.values()), self.metrics.socket_drops, self.metrics.lost_sets)
+        if losses != self.logged_losses:
+            self.logged_losses = losses
+            self.logger.info("Channel %s: sets abandoned per node %s, %s frames dropped by the socket, %s sets lost "
+                             "in the ring, cycle periods %s.", self.config.channel, abandoned_sets,
+                             self.metrics.socket_drops, self.metrics.lost_sets,
+                             {node_id: round(period, 3) for node_id, period in self.message_handler.cycle_periods.items()})
+
+
+async def drain_spool(mqtt_publisher: MQTTPublisher) -> None:
+    """
+    Publishes spooled battery data once the MQTT server is reachable again. At most
+    spool_drain_batch_size payloads are published every spool_drain_interval seconds, so
+    a large backlog does not flood the MQTT server after an outage.
     """
+    while True:
+        await asyncio.sleep(config['spool_drain_interval'])
+        try:
+            mqtt_publisher.drain_spool()
+        except Exception as e:
+            logger.error("Failed to drain spool.", exc_info = e)
+
+
+async def save_checkpoints(channels: List[Channel]) -> None:
+    """Saves the checkpoint of each channel every checkpoint interval seconds, so little is lost
+    should the service be killed rather than stopped."""
+    while True:
+        await asyncio.sleep(config['checkpoint_interval'])
+        for channel in channels:
+            channel.save_checkpoint()
+
+
+async def publish_restored(channels: List[Channel], mqtt_client: 'PahoClient') -> None:
+    """Publishes the restored battery data that wasn't published before the restart as soon as the
+    MQTT client is connected, rather than once the first publish interval has passed."""
+    deadline = time.monotonic() + config['mqtt_publish_interval']
+    while not mqtt_client.is_connected:
+        if time.monotonic() >= deadline:
+            return
+        await asyncio.sleep(0.1)
+    for channel in channels:
+        node_ids = channel.unpublished_node_ids()
+        if node_ids:
+            try:
+                channel.mqtt_publisher.publish_data(node_ids)
+            except Exception as e:
+                channel.logger.error("Failed to publish restored battery data.", exc_info = e)
+
+
+def write_influx(channel: Channel) -> None:
+    """Writes the battery data of the channel to InfluxDB. Called from the InfluxDB worker thread, so a
+    slow or unreachable server never holds up the event loop reading the CAN channels."""
     try:
-        if msg := bus.recv(0):
-            self._on_message_received(msg)
-    except can.CanOperationError as e:
-        if e.error_code in (100, 19):
-            logger.error("CAN network down.")
-        else:
-            raise
-            
-can.Notifier._on_message_available =  _on_message_available
+        channel.influx_publisher.publish_data()
+    except Exception as e:
+        channel.logger.error("Failed to write battery data to InfluxDB.", exc_info = e)
 
 
-async def main() -> None:
-    with can.Bus(
-        interface=config['can_interface'], channel=config['can_channel']
-    ) as bus:
-        
+async def poll_ring(ring_reader: SetRingReader) -> None:
+    """Reads the sets written by the ingest process to the ring every poll_interval seconds."""
+    while True:
+        await asyncio.sleep(config['process_poll_interval'])
+        try:
+            ring_reader.poll()
+        except Exception as e:
+            logger.error("Failed to read the sets of the ingest process.", exc_info = e)
+
+
+async def main(rings: List['SharedMemory'] | None = None) -> None:
+    """Reads the CAN channels and publishes their battery data, or in the publisher process of the
+    split process mode, publishes the battery data read from the rings of the channels."""
+
+    with contextlib.ExitStack() as stack:
+
         add_signal_handlers()
 
-        message_handler = MessageHandler(logger)
+        channels: List[Channel] = []
+        for index, channel_config in enumerate(can_channels):
+            ring_reader = None
+            if rings is not None:
+                # A restarted publisher process starts from the latest data of each node still in the ring.
+                ring_reader = SetRingReader(rings[index].buf)
+                ring_reader.catch_up()
+            channels.append(Channel(channel_config, ring_reader))
+
+        if config['profile']: log_memory_info("Memory Before CAN bus reader initialization.")
+
+        # Each channel has its own bus reader, or notifier, all reading their bus on the event loop. From
+        # here on, frames are queued by the kernel until the event loop handles them.
+        notifiers = []
+        for channel in channels:
+            if channel.ring_reader is None:
+                notifier = start_bus(stack, channel.config, channel.message_handler, channel.bus_reader)
+                if notifier is not None:
+                    notifiers.append(notifier)
+        if rings is None:
+            logger.info("Reading CAN channels %.3f s after startup.", time.monotonic() - started)
+
+        from eflexcan2mqtt.paho_client import PahoClient
+
+        # A single MQTT connection is shared by the publishers of all channels.
         mqtt_client = PahoClient(
             topic = config['mqtt_topic'],
             hostname = config['mqtt_hostname'],
             port = config['mqtt_port'],
             client_id = config['mqtt_client_id'],
             qos = config['mqtt_qos'],
-            keepalive = config['mqtt_keepalive']
+            keepalive = config['mqtt_keepalive'],
+            logger = logger,
+            min_reconnect_delay = config['mqtt_min_reconnect_delay'],
+            max_reconnect_delay = config['mqtt_max_reconnect_delay'],
+            serializer = serializer
         )
-        mqtt_publisher = MQTTPublisher(logger = logger, mqtt_client = mqtt_client, message_handler = message_handler)
-
-        listeners: List[MessageRecipient] = [
-            message_handler
-        ]
+        for channel in channels:
+            channel.add_sinks(mqtt_client)
 
         loop = asyncio.get_running_loop()
 
-        log_memory_info("Memory Before can.Notifier initialization.")
-
-        notifier = can.Notifier(bus, listeners, loop = loop)
+        # A single worker thread writes to InfluxDB, so the writes of a channel never overlap.
+        influx_executor = None
+        if config['influxdb_url']:
+            influx_executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = 'influxdb')
+
+        # SIGUSR1 toggles CPU profiling, and SIGUSR2 memory tracing, of the event loop thread.
+        profiler = Profiler(logger = logger, output_dir = config['profiling_dir'] or config['log_dir'],
+                            tracemalloc_frames = config['profiling_tracemalloc_frames'], top = config['profiling_top'],
+                            trace_memory = config['profiling_trace_memory'])
+        profiler.add_signal_handlers(loop)
+
+        mqtt_client.connect()
+
+        metrics_server = None
+        if config['metrics_port']:
+            def collect_metrics() -> str:
+                writer = MetricsWriter()
+                write_metrics(writer, [channel.metrics for channel in channels])
+                return writer.text()
+
+            metrics_server = MetricsServer(logger = logger, collect = collect_metrics,
+                                           host = config['metrics_host'], port = config['metrics_port'])
+            await metrics_server.start()
+
+        event_publishers: List[EventPublisher] = []
+        if config['mqtt_publish_mode'] == PUBLISH_MODE_EVENT:
+            for channel in channels:
+                event_publishers.append(EventPublisher(
+                    logger = channel.logger, message_handler = channel.message_handler,
+                    mqtt_publisher = channel.mqtt_publisher, loop = loop,
+                    coalesce_window = config['mqtt_coalesce_window'], min_interval = config['mqtt_min_interval']
+                ))
+
+        for channel in channels:
+            if channel.spool is not None:
+                asyncio.create_task(drain_spool(channel.mqtt_publisher))
+            if channel.ring_reader is not None:
+                asyncio.create_task(poll_ring(channel.ring_reader))
+        if any(channel.checkpoint is not None for channel in channels):
+            asyncio.create_task(save_checkpoints(channels))
+        if any(channel.restored_nodes for channel in channels):
+            asyncio.create_task(publish_restored(channels, mqtt_client))
 
         try:
             while True:
                 await asyncio.sleep(config['mqtt_publish_interval'])
-                mqtt_publisher.publish_data()
+                for channel in channels:
+                    # In event publish mode, battery data is published by the event publishers instead.
+                    if config['mqtt_publish_mode'] == PUBLISH_MODE_INTERVAL:
+                        try:
+                            channel.mqtt_publisher.publish_data()
+                        except Exception as e:
+                            channel.logger.error("Failed to publish battery data.", exc_info = e)
+                    # A write still in progress, such as while the server is unreachable, is not queued again.
+                    if channel.influx_publisher is not None and (channel.influx_write is None or channel.influx_write.done()):
+                        channel.influx_write = loop.run_in_executor(influx_executor, write_influx, channel)
+                    if channel.archive is not None:
+                        channel.archive.flush()
+                        # Closed segments are compressed, and expired ones deleted, off the event loop.
+                        if channel.archive.close_segments_due:
+                            try:
+                                await loop.run_in_executor(None, channel.archive.close_segments)
+                            except OSError as e:
+                                channel.logger.error("Failed to close archive segments.", exc_info = e)
+                    channel.log_metrics()
                 if config['profile']: log_memory_info("In main task loop, after mqtt publish.")
 
         except asyncio.CancelledError as e:
@@ -162,13 +578,166 @@ async def main() -> None:
             log_memory_info("Shuting down...")
 
         finally:
-            notifier.stop()
+            profiler.close()
+            if metrics_server is not None:
+                await metrics_server.close()
+            for event_publisher in event_publishers:
+                event_publisher.close()
+            for notifier in notifiers:
+                notifier.stop()
+            mqtt_client.disconnect()
+            for channel in channels:
+                channel.save_checkpoint()
+                if channel.spool is not None:
+                    channel.spool.close()
+                if channel.archive is not None:
+                    channel.archive.close()
+                # Disconnected by the worker thread, once the writes in progress are done.
+                if channel.influx_client is not None:
+                    influx_executor.submit(channel.influx_client.disconnect)
+            if influx_executor is not None:
+                influx_executor.shutdown()
+
+
+async def ingest(rings: List['SharedMemory']) -> None:
+    """The ingest process of the split process mode: reads the CAN channels, and writes the sets of
+    each channel to its ring."""
+
+    with contextlib.ExitStack() as stack:
+
+        add_signal_handlers()
+        loop = asyncio.get_running_loop()
+
+        profiler = Profiler(logger = logger, output_dir = config['profiling_dir'] or config['log_dir'],
+                            tracemalloc_frames = config['profiling_tracemalloc_frames'], top = config['profiling_top'],
+                            trace_memory = config['profiling_trace_memory'])
+        profiler.add_signal_handlers(loop)
+
+        ring_writers: List[SetRingWriter] = []
+        notifiers = []
+        for channel_config, ring in zip(can_channels, rings):
+            channel_logger = logger.getChild(channel_config.name)
+            message_handler = MessageHandler(channel_logger)
+            bus_reader = create_bus_reader(channel_config, message_handler, channel_logger)
+            ring_writers.append(SetRingWriter(ring.buf, message_handler, bus_reader))
+            notifier = start_bus(stack, channel_config, message_handler, bus_reader)
+            if notifier is not None:
+                notifiers.append(notifier)
+        logger.info("Reading CAN channels %.3f s after startup.", time.monotonic() - started)
+
+        try:
+            while True:
+                await asyncio.sleep(1)
+                for ring_writer in ring_writers:
+                    ring_writer.write_counters()
+
+        except asyncio.CancelledError as e:
+            logger.info("Ingest process got shut down signal")
+
+        finally:
+            profiler.close()
+            for notifier in notifiers:
+                notifier.stop()
+
+
+# Processes of the split process mode, and the maximum delay before one is restarted.
+INGEST_PROCESS = 'ingest'
+PUBLISHER_PROCESS = 'publisher'
+MAX_RESTART_DELAY = 60.0
+
+
+def run_process(role: str, rings: List['SharedMemory']) -> None:
+    global pid, process, started, handler
+    pid = os.getpid()
+    process = None
+    started = time.monotonic()
+    # Each process logs to its own file, eflexcan2mqtt.<role>.out. Processes sharing a rotating log
+    # file would each rotate it, and lose or interleave each other's lines.
+    logger.removeHandler(handler)
+    handler.close()
+    handler = create_log_handler(f'eflexcan2mqtt.{role}')
+    logger.addHandler(handler)
+    logger.info("Running %s process ID %s", role, pid)
+    asyncio.run(ingest(rings) if role == INGEST_PROCESS else main(rings))
+
+
+def supervise() -> None:
+    """
+    Runs the split process mode: the ingest process reads the CAN channels and writes the sets
+    completed to a shared memory ring per channel, and the publisher process reads them and
+    publishes the battery data. Either process is restarted on its own when it exits, after
+    restart_delay seconds, doubling while it keeps exiting within a minute, up to a minute.
+    The rings are created, and removed on shut down, by this process.
+    """
+
+    import multiprocessing
+    import multiprocessing.connection
+
+    # The processes are forked, so they share the rings and the parsed config.
+    context = multiprocessing.get_context('fork')
+    rings = [create_ring(config['process_ring_capacity']) for _ in can_channels]
+
+    stopping = False
+    def stop(signum: int, frame) -> None:
+        nonlocal stopping
+        stopping = True
+
+    for sig in [signal.SIGINT, signal.SIGTERM]:
+        signal.signal(sig, stop)
+
+    processes: dict[str, multiprocessing.Process | None] = {}
+    started_times: dict[str, float] = {}
+    restart_times: dict[str, float] = {}
+    restart_delays = {role: config['process_restart_delay'] for role in (INGEST_PROCESS, PUBLISHER_PROCESS)}
+
+    def start(role: str) -> None:
+        process = context.Process(target = run_process, args = (role, rings), name = f"eflexcan2mqtt-{role}")
+        process.start()
+        processes[role] = process
+        started_times[role] = time.monotonic()
+
+    try:
+        for role in (INGEST_PROCESS, PUBLISHER_PROCESS):
+            start(role)
+
+        while not stopping:
+            multiprocessing.connection.wait([process.sentinel for process in processes.values() if process is not None], timeout = 1)
+            now = time.monotonic()
+            for role, process in list(processes.items()):
+                if process is not None and not process.is_alive():
+                    if now - started_times[role] > MAX_RESTART_DELAY:
+                        restart_delays[role] = config['process_restart_delay']
+                    logger.error("The %s process exited with code %s. Restarting it in %s s.", role, process.exitcode, restart_delays[role])
+                    processes[role] = None
+                    restart_times[role] = now + restart_delays[role]
+                    restart_delays[role] = min(restart_delays[role] * 2, MAX_RESTART_DELAY)
+                elif process is None and now >= restart_times[role] and not stopping:
+                    start(role)
+
+        logger.info("Got shut down signal")
+
+    finally:
+        for process in processes.values():
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in processes.values():
+            if process is not None:
+                process.join(10)
+                if process.is_alive():
+                    process.kill()
+        for ring in rings:
+            ring.close()
+            ring.unlink()
 
 
 if __name__ == "__main__":
     try:
-        logger.info("Starting event loop...")
-        asyncio.run(main())
+        if config['process_split']:
+            logger.info("Starting ingest and publisher processes...")
+            supervise()
+        else:
+            logger.info("Starting event loop...")
+            asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Received keyboard interrupt. Shut down complete.")
 
@@ -0,0 +1,82 @@
+"""A minimal InfluxDB write endpoint stand-in. It accepts line protocol writes over HTTP/1.1
+keep-alive connections, gzip compressed or not, and records them. Responses can be set to fail
+to simulate an unavailable server.
+"""
+
+import gzip
+import http.server
+import threading
+from typing import List, NamedTuple
+
+
+class WriteRequest(NamedTuple):
+    path: str
+    headers: dict[str, str]
+    lines: List[str]
+    client_port: int
+
+
+class _InfluxDBHandler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    server: "_InfluxDBServer"
+
+    def do_POST(self) -> None:
+        server = self.server.influxdb
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+
+        status = server.statuses.pop(0) if server.statuses else 204
+        if status == 204:
+            server.record(WriteRequest(self.path, dict(self.headers), body.decode('utf-8').split('\n'), self.client_address[1]))
+
+        message = b'' if status == 204 else b'{"code":"unavailable"}'
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(message)))
+        self.end_headers()
+        self.wfile.write(message)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+class _InfluxDBServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    influxdb: "MockInfluxDB"
+
+
+class MockInfluxDB():
+
+    def __init__(self):
+        # Status of each next response, 204 once empty.
+        self.statuses: List[int] = []
+        self._writes: List[WriteRequest] = []
+        self._lock = threading.Lock()
+        self._server = _InfluxDBServer(('127.0.0.1', 0), _InfluxDBHandler)
+        self._server.influxdb = self
+        self._thread = threading.Thread(target = self._server.serve_forever, daemon = True)
+
+    def start(self) -> "MockInfluxDB":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def record(self, write: WriteRequest) -> None:
+        with self._lock:
+            self._writes.append(write)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    @property
+    def writes(self) -> List[WriteRequest]:
+        return self._writes
+
+    @property
+    def lines(self) -> List[str]:
+        return [line for write in self._writes for line in write.lines]
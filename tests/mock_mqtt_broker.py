@@ -0,0 +1,125 @@
+"""A minimal MQTT 3.1.1 broker stand-in. It accepts connections, acknowledges
+publishes at QoS 0, 1 and 2 and records what was published. It does not route
+messages to subscribers. An optional latency is added before every response
+packet to simulate the round trip to a remote broker.
+"""
+
+import socket
+import socketserver
+import threading
+import time
+from typing import List, Tuple
+
+CONNECT = 1
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+PINGREQ = 12
+DISCONNECT = 14
+
+
+def _read_exactly(sock: socket.socket, count: int) -> bytes:
+    data = b''
+    while len(data) < count:
+        chunk = sock.recv(count - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        data += chunk
+    return data
+
+
+def _read_packet(sock: socket.socket) -> Tuple[int, int, bytes]:
+    header, = _read_exactly(sock, 1)
+    remaining_length = 0
+    multiplier = 1
+    while True:
+        encoded, = _read_exactly(sock, 1)
+        remaining_length += (encoded & 0x7F) * multiplier
+        if not encoded & 0x80:
+            break
+        multiplier *= 128
+    return header >> 4, header & 0x0F, _read_exactly(sock, remaining_length)
+
+
+class _MQTTHandler(socketserver.BaseRequestHandler):
+
+    server: "_MQTTServer"
+
+    def handle(self) -> None:
+        sock = self.request
+        broker = self.server.broker
+        try:
+            while True:
+                packet_type, flags, body = _read_packet(sock)
+                if packet_type == CONNECT:
+                    self._respond(b'\x20\x02\x00\x00')
+                elif packet_type == PUBLISH:
+                    qos = (flags >> 1) & 0x03
+                    topic_length = int.from_bytes(body[0:2], 'big')
+                    topic = body[2:2 + topic_length].decode('utf-8')
+                    position = 2 + topic_length
+                    packet_id = body[position:position + 2]
+                    if qos:
+                        position += 2
+                    broker.record(topic, body[position:], qos, bool(flags & 0x01))
+                    if qos == 1:
+                        self._respond(b'\x40\x02' + packet_id)
+                    elif qos == 2:
+                        self._respond(b'\x50\x02' + packet_id)
+                elif packet_type == PUBREL:
+                    self._respond(b'\x70\x02' + body[0:2])
+                elif packet_type == PINGREQ:
+                    self._respond(b'\xd0\x00')
+                elif packet_type == DISCONNECT:
+                    return
+        except (ConnectionError, OSError):
+            return
+
+    def _respond(self, packet: bytes) -> None:
+        if self.server.broker.latency:
+            time.sleep(self.server.broker.latency)
+        self.request.sendall(packet)
+
+
+class _MQTTServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    broker: "MockMQTTBroker"
+
+
+class MockMQTTBroker():
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._messages: List[Tuple[str, bytes, int, bool]] = []
+        self._condition = threading.Condition()
+        self._server = _MQTTServer(('127.0.0.1', 0), _MQTTHandler)
+        self._server.broker = self
+        self._thread = threading.Thread(target = self._server.serve_forever, daemon = True)
+
+    def start(self) -> "MockMQTTBroker":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def record(self, topic: str, payload: bytes, qos: int, retain: bool) -> None:
+        with self._condition:
+            self._messages.append((topic, payload, qos, retain))
+            self._condition.notify_all()
+
+    def wait_for_messages(self, count: int, timeout: float = 5.0) -> bool:
+        with self._condition:
+            return self._condition.wait_for(lambda: len(self._messages) >= count, timeout)
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    @property
+    def messages(self) -> List[Tuple[str, bytes, int, bool]]:
+        return self._messages
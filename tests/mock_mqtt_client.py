@@ -1,14 +1,31 @@
-from typing import List
-from eflexcan2mqtt.mqtt_client import MQTTClient
+from typing import List, Tuple
+from eflexcan2mqtt.mqtt_client import MQTTClient, MQTTPublishError
 
 class MockMQTTClient(MQTTClient):
 
     _payload: List[dict] | None
-    
-    def publish(self, payload: List[dict]) -> None:
+    _topic: str | None = None
+
+    # When True, publish raises MQTTPublishError as if the MQTT server were unreachable.
+    fail: bool = False
+
+    def publish(self, payload: List[dict], topic: str | None = None) -> None:
+        if self.fail:
+            raise MQTTPublishError("MQTT server unreachable")
         self._payload = payload
+        self._topic = topic
         return
-    
+
+    def publish_messages(self, messages: List[Tuple[str, str]], retain: bool = False) -> None:
+        if self.fail:
+            raise MQTTPublishError("MQTT server unreachable")
+        self.messages = messages
+        self.retain = retain
+
     @property
     def payload(self):
-        return self._payload
\ No newline at end of file
+        return self._payload
+
+    @property
+    def topic(self):
+        return self._topic
@@ -0,0 +1,153 @@
+import errno
+import logging
+import os
+import pytest
+from eflexcan2mqtt.archive import ArchiveSegment, SampleArchive, main, read_samples
+from eflexcan2mqtt.decode import parse_battery_data
+from eflexcan2mqtt.message_handler import MessageHandler
+from eflexcan2mqtt.simulator import BusSimulator
+
+logger = logging.getLogger(__name__)
+
+# 2024-05-18 23:59:50 UTC, 10 seconds before the end of the day.
+END_OF_DAY = 1716076790.0
+
+ARCHIVED_FIELDS = ('battery_voltage', 'battery_current', 'battery_soc', 'system_average_voltage',
+                   'lifetime_discharge_energy', 'pre_volt', 'insulation_resistance', 'cell_voltages')
+
+
+def archive_cycles(path: str, cycles: int, **kwargs) -> list[dict]:
+    """Archives simulated cycles, returning the decoded battery data of each set, with its node id and time."""
+    simulator = BusSimulator(3, seed = 1, start_time = END_OF_DAY)
+    message_handler = MessageHandler(logger)
+    archive = SampleArchive(str(path), logger, message_handler, **kwargs)
+
+    sets = []
+    message_handler.add_set_completed_callback(
+        lambda node_id, data10, data60, timestamp: sets.append({
+            'time': timestamp, 'node_id': node_id, **parse_battery_data(data10, data60)}))
+
+    simulator.feed(message_handler, cycles = cycles)
+    archive.close()
+    archive.close_segments()
+    return sets
+
+
+def test_samples_are_archived_per_day(tmp_path):
+    sets = archive_cycles(tmp_path, cycles = 20, retention_days = 0, flush_rows = 7)
+
+    assert sorted(os.listdir(tmp_path)) == ['2024-05-18', '2024-05-19']
+    # The segment of the previous day is compressed once the next day started.
+    assert 'time.z' in os.listdir(tmp_path / '2024-05-18')
+    assert 'time' in os.listdir(tmp_path / '2024-05-19')
+
+    samples = list(read_samples(str(tmp_path), 0, 2 ** 32))
+    assert len(samples) == len(sets) == 60
+    for sample, battery_data in zip(samples, sets):
+        assert sample['node_id'] == battery_data['node_id']
+        assert sample['time'] == pytest.approx(battery_data['time'], abs = 0.01)
+        for field in ARCHIVED_FIELDS:
+            assert sample[field] == battery_data[field]
+
+
+def test_segments_are_compressed_by_close_segments(tmp_path):
+    simulator = BusSimulator(3, seed = 1, start_time = END_OF_DAY)
+    message_handler = MessageHandler(logger)
+    archive = SampleArchive(str(tmp_path), logger, message_handler, retention_days = 0, flush_rows = 1)
+    archive.close_segments()
+    assert not archive.close_segments_due
+
+    # The segment of the previous day is only closed when adding samples of the next day.
+    simulator.feed(message_handler, cycles = 20)
+    assert archive.close_segments_due
+    assert 'time' in os.listdir(tmp_path / '2024-05-18')
+
+    archive.close_segments()
+    assert not archive.close_segments_due
+    assert sorted(os.listdir(tmp_path / '2024-05-18')) == [name + '.z' for name in sorted(os.listdir(tmp_path / '2024-05-19'))]
+    archive.close()
+
+
+def test_time_range_and_node_reads(tmp_path):
+    sets = archive_cycles(tmp_path, cycles = 20, retention_days = 0)
+
+    start, end = END_OF_DAY + 5, END_OF_DAY + 15
+    samples = list(read_samples(str(tmp_path), start, end, node_ids = {2}))
+    expected = [battery_data for battery_data in sets
+                if start <= battery_data['time'] < end and battery_data['node_id'] == 2]
+    assert [sample['time'] for sample in samples] == [battery_data['time'] for battery_data in expected]
+    assert len(samples) == 10
+
+    with ArchiveSegment(str(tmp_path / '2024-05-19')) as segment:
+        assert segment.rows == 30
+        assert len(segment.column('cell_voltages')) == 30 * 16
+        first, last = segment.row_range(0, END_OF_DAY + 15)
+        assert (first, last) == (0, 15)
+
+
+def test_segment_is_reopened_after_restart(tmp_path):
+    archive_cycles(tmp_path, cycles = 20, retention_days = 0)
+    # A row partially written when the process was killed is dropped.
+    with open(tmp_path / '2024-05-19' / 'time', 'ab') as file:
+        file.write(b'\x00' * 8)
+
+    simulator = BusSimulator(3, seed = 1, start_time = END_OF_DAY + 20)
+    message_handler = MessageHandler(logger)
+    archive = SampleArchive(str(tmp_path), logger, message_handler, retention_days = 0, compress = False)
+    simulator.feed(message_handler, cycles = 5)
+    archive.close()
+
+    with ArchiveSegment(str(tmp_path / '2024-05-19')) as segment:
+        assert segment.rows == 45
+        times = segment.column('time')
+        assert all(times[i] <= times[i + 1] for i in range(segment.rows - 1))
+
+
+def test_rows_that_cant_be_written_are_dropped(tmp_path, monkeypatch):
+    simulator = BusSimulator(3, seed = 1, start_time = END_OF_DAY + 20)
+    message_handler = MessageHandler(logger)
+    archive = SampleArchive(str(tmp_path), logger, message_handler, retention_days = 0, flush_rows = 4)
+    simulator.feed(message_handler, cycles = 2)
+
+    def open_failing(file, mode = 'r', *args, **kwargs):
+        # The columns before battery_soc are appended to, as when the disk fills up during a flush.
+        if os.path.basename(file) == 'battery_soc':
+            raise OSError(errno.ENOSPC, "No space left on device")
+        return open(file, mode, *args, **kwargs)
+
+    monkeypatch.setattr('eflexcan2mqtt.archive.open', open_failing, raising = False)
+    simulator.feed(message_handler, cycles = 2)
+    archive.flush()
+    assert archive.lost_rows == 8
+    monkeypatch.undo()
+
+    simulator.feed(message_handler, cycles = 2)
+    archive.close()
+
+    # Every set was completed, and the rows written before and after the errors are intact.
+    assert message_handler.completed_sets == 18
+    with ArchiveSegment(str(tmp_path / '2024-05-19')) as segment:
+        assert segment.rows == 10
+        assert len(segment.column('cell_voltages')) == 10 * 16
+        times = segment.column('time')
+        assert all(times[i] <= times[i + 1] for i in range(segment.rows - 1))
+
+
+def test_expired_segments_are_deleted(tmp_path):
+    os.makedirs(tmp_path / '2024-04-01')
+    os.makedirs(tmp_path / 'not-a-segment')
+
+    archive_cycles(tmp_path, cycles = 20, retention_days = 30)
+
+    assert sorted(os.listdir(tmp_path)) == ['2024-05-18', '2024-05-19', 'not-a-segment']
+
+
+def test_cli_prints_csv(tmp_path, capsys):
+    archive_cycles(tmp_path, cycles = 2, retention_days = 0)
+
+    main([str(tmp_path), '--start', '2024-05-18T23:59:50', '--node', '1'])
+
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].startswith('time,node_id,battery_voltage,')
+    assert lines[0].endswith(',cell_voltages_16')
+    assert len(lines) == 3
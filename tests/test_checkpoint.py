@@ -0,0 +1,112 @@
+import logging
+import pytest
+from eflexcan2mqtt.checkpoint import Checkpoint, NodeState
+from eflexcan2mqtt.message_handler import MessageHandler
+from eflexcan2mqtt.mqtt_publisher import MQTTPublisher
+from eflexcan2mqtt.simulator import BusSimulator
+from .mock_mqtt_client import MockMQTTClient
+
+logger = logging.getLogger(__name__)
+
+
+def restore(checkpoint: Checkpoint, message_handler: MessageHandler, mqtt_publisher: MQTTPublisher) -> None:
+    for node in checkpoint.load():
+        if node.data10 is not None:
+            message_handler.restore_battery_data(node.node_id, node.data10, node.data60, node.timestamp)
+        if node.published_timestamp is not None:
+            mqtt_publisher.restore_published_timestamps({node.node_id: node.published_timestamp})
+
+
+def test_checkpoint_round_trip(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "state" / "state.bin"), logger = logger)
+    message_handler = MessageHandler(logger)
+    BusSimulator(3, seed = 1).feed(message_handler, cycles = 2)
+    battery_data = message_handler.compiled_battery_data()
+
+    size = checkpoint.save(battery_data, {1: battery_data[0][3], 9: 1715987000.5})
+
+    assert size == (tmp_path / "state" / "state.bin").stat().st_size
+    assert not (tmp_path / "state" / "state.bin.tmp").exists()
+    assert checkpoint.load() == [
+        NodeState(node_id, data10, data60, timestamp, battery_data[0][3] if node_id == 1 else None)
+        for node_id, data10, data60, timestamp in battery_data
+    ] + [NodeState(9, None, None, 0.0, 1715987000.5)]
+
+
+def test_missing_checkpoint_is_empty(tmp_path):
+    assert Checkpoint(str(tmp_path / "state.bin"), logger = logger).load() == []
+
+
+@pytest.mark.parametrize("corrupt", [
+    lambda data: data[:10],
+    lambda data: data[:-1],
+    lambda data: b'EFXR' + data[4:],
+    lambda data: data[:40] + bytes([data[40] ^ 0xFF]) + data[41:],
+])
+def test_invalid_checkpoint_is_ignored(tmp_path, corrupt):
+    path = tmp_path / "state.bin"
+    message_handler = MessageHandler(logger)
+    BusSimulator(2, seed = 1).feed(message_handler, cycles = 1)
+    Checkpoint(str(path), logger = logger).save(message_handler.compiled_battery_data(), {})
+    path.write_bytes(corrupt(path.read_bytes()))
+
+    assert Checkpoint(str(path), logger = logger).load() == []
+
+
+def test_restored_data_is_published_once_across_restarts(tmp_path):
+    path = str(tmp_path / "state.bin")
+    simulator = BusSimulator(3, seed = 1)
+
+    # Data of the first cycle is published, and the second cycle is received before the service stops.
+    message_handler = MessageHandler(logger)
+    mqtt_client = MockMQTTClient()
+    mqtt_publisher = MQTTPublisher(logger = logger, message_handler = message_handler, mqtt_client = mqtt_client)
+    simulator.feed(message_handler, cycles = 1)
+    mqtt_publisher.publish_data()
+    published = mqtt_client.payload
+    simulator.feed(message_handler, cycles = 1)
+    Checkpoint(path, logger = logger).save(message_handler.compiled_battery_data(), mqtt_publisher.published_timestamps)
+    unpublished = message_handler.compiled_battery_data()
+
+    # The restarted service has the data of the second cycle before any frame is received, and publishes it.
+    restarted_handler = MessageHandler(logger)
+    restarted_client = MockMQTTClient()
+    restarted_publisher = MQTTPublisher(logger = logger, message_handler = restarted_handler, mqtt_client = restarted_client)
+    restore(Checkpoint(path, logger = logger), restarted_handler, restarted_publisher)
+
+    assert restarted_handler.compiled_battery_data() == unpublished
+    assert restarted_handler.completed_sets == 0
+    restarted_publisher.publish_data()
+    assert [battery_data['time'] for battery_data in restarted_client.payload] == \
+        [round(timestamp) for _, _, _, timestamp in unpublished]
+    assert restarted_client.payload != published
+
+    # Data published before the restart isn't published again.
+    Checkpoint(path, logger = logger).save(restarted_handler.compiled_battery_data(), restarted_publisher.published_timestamps)
+    restarted_handler = MessageHandler(logger)
+    restarted_client = MockMQTTClient()
+    restarted_client._payload = None
+    restarted_publisher = MQTTPublisher(logger = logger, message_handler = restarted_handler, mqtt_client = restarted_client)
+    restore(Checkpoint(path, logger = logger), restarted_handler, restarted_publisher)
+    restarted_publisher.publish_data()
+    assert restarted_client.payload is None
+
+
+def test_restored_data_is_replaced_by_newer_sets():
+    simulator = BusSimulator(2, seed = 1)
+    original = MessageHandler(logger)
+    simulator.feed(original, cycles = 1)
+    node_id, data10, data60, timestamp = original.compiled_battery_data()[0]
+
+    message_handler = MessageHandler(logger)
+    message_handler.restore_battery_data(node_id, data10, data60, timestamp - 100)
+    simulator.feed(message_handler, cycles = 1)
+
+    assert message_handler.compiled_battery_data([node_id])[0][3] > timestamp - 100
+    # No cycle period is measured from the restored data.
+    assert node_id not in message_handler.cycle_periods
+
+    # Older data doesn't replace newer data.
+    newest = message_handler.compiled_battery_data([node_id])
+    message_handler.restore_battery_data(node_id, data10, data60, timestamp - 200)
+    assert message_handler.compiled_battery_data([node_id]) == newest
@@ -0,0 +1,99 @@
+import configparser
+import pytest
+from eflexcan2mqtt.config import CANChannelConfig, load_can_channels
+
+
+def parse(config: str) -> configparser.ConfigParser:
+    config_parser = configparser.ConfigParser()
+    config_parser.read_string(config)
+    return config_parser
+
+
+def test_single_can_section():
+    channels = load_can_channels(parse("""
+[can]
+interface=socketcan
+channel=can0
+"""), "eflexbatteries", "/var/lib/eflexcan2mqtt/spool.db")
+
+    assert channels == [CANChannelConfig(name = "can0", interface = "socketcan", channel = "can0",
+                                         topic = "eflexbatteries", spool_path = "/var/lib/eflexcan2mqtt/spool.db")]
+
+
+def test_multiple_can_channel_sections():
+    channels = load_can_channels(parse("""
+[can]
+interface=virtual
+
+[can.bank1]
+channel=can0
+
+[can.bank2]
+interface=socketcan
+channel=can1
+topic=eflexbatteries/garage
+"""), "eflexbatteries", "/var/lib/eflexcan2mqtt/spool.db")
+
+    assert channels == [
+        CANChannelConfig(name = "bank1", interface = "virtual", channel = "can0",
+                         topic = "eflexbatteries/bank1", spool_path = "/var/lib/eflexcan2mqtt/spool.bank1.db"),
+        CANChannelConfig(name = "bank2", interface = "socketcan", channel = "can1",
+                         topic = "eflexbatteries/garage", spool_path = "/var/lib/eflexcan2mqtt/spool.bank2.db"),
+    ]
+
+
+def test_spool_disabled():
+    channels = load_can_channels(parse("[can.bank1]\nchannel=can0\n"), "eflexbatteries", "")
+
+    assert channels[0].spool_path == ""
+
+
+def test_checkpoint_paths():
+    single = load_can_channels(parse("[can]\nchannel=can0\n"), "eflexbatteries",
+                               checkpoint_path = "/var/lib/eflexcan2mqtt/state.bin")
+    channels = load_can_channels(parse("[can.bank1]\nchannel=can0\n[can.bank2]\nchannel=can1\n"), "eflexbatteries",
+                                 checkpoint_path = "/var/lib/eflexcan2mqtt/state.bin")
+
+    assert single[0].checkpoint_path == "/var/lib/eflexcan2mqtt/state.bin"
+    assert [channel.checkpoint_path for channel in channels] == ["/var/lib/eflexcan2mqtt/state.bank1.bin",
+                                                                 "/var/lib/eflexcan2mqtt/state.bank2.bin"]
+    assert load_can_channels(parse("[can]\nchannel=can0\n"), "eflexbatteries")[0].checkpoint_path == ""
+
+
+@pytest.mark.parametrize("config", [
+    "[mqtt]\ntopic=eflexbatteries\n",
+    "[can]\ninterface=socketcan\n",
+    "[can.bank1]\ninterface=socketcan\n",
+    "[can.bank1]\nchannel=can0\n[can.bank2]\nchannel=can0\n",
+])
+def test_invalid_can_channels_are_rejected(config: str):
+    with pytest.raises(ValueError):
+        load_can_channels(parse(config), "eflexbatteries")
+
+
+def test_can_filters():
+    channels = load_can_channels(parse("""
+[can]
+extra_families=0x300
+
+[can.bank1]
+channel=can0
+
+[can.bank2]
+channel=can1
+extra_families=0x300, 0x500
+
+[can.bank3]
+channel=can2
+filter=no
+"""), "eflexbatteries")
+
+    assert [[can_filter['can_id'] for can_filter in channel.can_filters or ()] for channel in channels] == [
+        [0x100, 0x600, 0x300], [0x100, 0x600, 0x300, 0x500], []]
+    assert channels[2].can_filters is None
+    assert channels[0].can_filters[0] == {'can_id': 0x100, 'can_mask': 0x700, 'extended': False}
+
+    with pytest.raises(ValueError):
+        load_can_channels(parse("[can]\nchannel=can0\nextra_families=0x350\n"), "eflexbatteries")
+    with pytest.raises(ValueError):
+        load_can_channels(parse("[can]\nchannel=can0\nextra_families=inverter\n"), "eflexbatteries")
@@ -10,6 +10,8 @@ def test_parse_arbitration_id():
     assert ("10d", "13", "10") == decode.parse_arbitration_id(0x10D)
     assert ("601", "1", "60") == decode.parse_arbitration_id(0x601)
     assert ("604", "4", "60") == decode.parse_arbitration_id(0x604)
+    assert ("110", "16", "10") == decode.parse_arbitration_id(0x110)
+    assert ("641", "65", "60") == decode.parse_arbitration_id(0x641)
 
 
 def test_parse_serial():
@@ -58,3 +60,29 @@ def test_parse_battery_data(data10: List[int], data60: List[int]):
     }
 
     assert battery_data == expected
+
+
+def test_arbitration_id_dispatch():
+    """Battery message arbitration ids map to their node id and message type, all others are absent."""
+
+    assert decode.ARBITRATION_ID_DISPATCH[0x101] == (1, "10")
+    assert decode.ARBITRATION_ID_DISPATCH[0x10D] == (13, "10")
+    assert decode.ARBITRATION_ID_DISPATCH[0x110] == (16, "10")
+    assert decode.ARBITRATION_ID_DISPATCH[0x1FF] == (255, "10")
+    assert decode.ARBITRATION_ID_DISPATCH[0x604] == (4, "60")
+    assert decode.ARBITRATION_ID_DISPATCH[0x641] == (65, "60")
+    assert decode.ARBITRATION_ID_DISPATCH[0x601] is decode.ARBITRATION_ID_DISPATCH[0x601]
+
+    for arbitration_id in (0x351, 0x35E, 0x100, 0x600, 0x200, 0x18FF50E5, 0x1001):
+        assert arbitration_id not in decode.ARBITRATION_ID_DISPATCH
+
+
+def test_parse_battery_data_from_buffers(data10: List[int], data60: List[int]):
+    """Bytes and memoryviews of the compiled data decode to the same battery data as lists."""
+
+    expected = decode.parse_battery_data(data10, data60)
+
+    assert decode.parse_battery_data(bytes(data10), bytes(data60)) == expected
+    assert decode.parse_battery_data(memoryview(bytearray(data10)), memoryview(bytearray(data60))) == expected
+    assert decode.parse_serial(bytes(data10[49:56])) == expected['battery_id']
+    assert decode.parse_cell_voltages(bytes(data60)) == expected['cell_voltages']
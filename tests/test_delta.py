@@ -0,0 +1,86 @@
+import logging
+import pytest
+from eflexcan2mqtt.delta import DeltaEncoder, parse_deadbands
+from eflexcan2mqtt.message_handler import MessageHandler
+from eflexcan2mqtt.mqtt_publisher import MQTTPublisher
+from eflexcan2mqtt.simulator import BusSimulator
+from .mock_mqtt_client import MockMQTTClient
+
+logger = logging.getLogger(__name__)
+
+
+def battery(time: int, current: float = -0.3, cells: list[int] | None = None, soc: int = 71) -> dict:
+    return {
+        'battery_id': "2211075F0955",
+        'battery_soc': soc,
+        'battery_current': current,
+        'software_version': 4006,
+        'cell_voltages': cells or [3322] * 16,
+        'time': time,
+    }
+
+
+def test_only_changed_fields_are_encoded():
+    encoder = DeltaEncoder(deadbands = {'cell_voltages': 1, 'battery_current': 0.1}, keyframe_interval = 3600)
+
+    assert encoder.encode(battery(0)) == battery(0)
+    assert encoder.encode(battery(60, current = -0.2)) is None
+    assert encoder.encode(battery(120, soc = 70)) == {'battery_id': "2211075F0955", 'time': 120, 'battery_soc': 70}
+    assert encoder.encode(battery(180, current = -0.5, soc = 70)) == {'battery_id': "2211075F0955", 'time': 180, 'battery_current': -0.5}
+
+    cells = [3322] * 16
+    cells[3] = 3323
+    assert encoder.encode(battery(240, current = -0.5, soc = 70, cells = cells)) is None
+    cells[3] = 3324
+    assert encoder.encode(battery(300, current = -0.5, soc = 70, cells = cells)) == {
+        'battery_id': "2211075F0955", 'time': 300, 'cell_voltages': cells}
+
+
+def test_changes_within_deadband_do_not_accumulate():
+    encoder = DeltaEncoder(deadbands = {'battery_current': 0.1})
+
+    encoder.encode(battery(0, current = 1.0))
+    assert encoder.encode(battery(60, current = 1.1)) is None
+    assert encoder.encode(battery(120, current = 1.2))['battery_current'] == 1.2
+    assert encoder.encode(battery(180, current = 1.3)) is None
+
+
+def test_keyframe_is_encoded_every_keyframe_interval():
+    encoder = DeltaEncoder(keyframe_interval = 600)
+
+    assert encoder.encode(battery(0)) == battery(0)
+    assert encoder.encode(battery(300)) is None
+    assert encoder.encode(battery(600)) == battery(600)
+    assert encoder.encode(battery(900)) is None
+
+    encoder.reset()
+    assert encoder.encode(battery(960)) == battery(960)
+
+
+def test_parse_deadbands():
+    assert parse_deadbands("cell_voltages:1, battery_current:0.1") == {'cell_voltages': 1.0, 'battery_current': 0.1}
+    assert parse_deadbands("") == {}
+    with pytest.raises(ValueError):
+        parse_deadbands("cell_voltages")
+    with pytest.raises(ValueError):
+        parse_deadbands("cell_voltages:-1")
+
+
+def test_publisher_publishes_changes_only():
+    message_handler = MessageHandler(logger)
+    mqtt_client = MockMQTTClient()
+    publisher = MQTTPublisher(logger = logger, message_handler = message_handler, mqtt_client = mqtt_client,
+                              delta_encoder = DeltaEncoder(deadbands = {'cell_voltages': 1}))
+    simulator = BusSimulator(2, seed = 7)
+
+    simulator.feed(message_handler, cycles = 1)
+    publisher.publish_data()
+    assert [len(battery_data) for battery_data in mqtt_client.payload] == [14, 14]
+
+    simulator.feed(message_handler, cycles = 1)
+    publisher.publish_data()
+    assert len(mqtt_client.payload) == 2
+    for battery_data in mqtt_client.payload:
+        assert 'software_version' not in battery_data
+        assert 'battery_current' in battery_data
+        assert battery_data['battery_id'].startswith("2211075F")
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import logging
+from typing import List, Tuple
+import can
+from eflexcan2mqtt.event_publisher import EventPublisher
+from eflexcan2mqtt.message_handler import MessageHandler
+from eflexcan2mqtt.mqtt_client import MQTTClient
+from eflexcan2mqtt.mqtt_publisher import MQTTPublisher
+from eflexcan2mqtt.simulator import BusSimulator
+
+logger = logging.getLogger(__name__)
+
+
+class RecordingMQTTClient(MQTTClient):
+
+    def __init__(self):
+        self.payloads: List[List[dict]] = []
+
+    def publish(self, payload: List[dict], topic: str | None = None) -> None:
+        self.payloads.append(payload)
+
+    def publish_messages(self, messages: List[Tuple[str, str]], retain: bool = False) -> None:
+        self.payloads.append([json.loads(payload) for _, payload in messages])
+
+
+def create_event_publisher(coalesce_window: float, min_interval: float) -> tuple[MessageHandler, RecordingMQTTClient, EventPublisher]:
+    message_handler = MessageHandler(logger)
+    mqtt_client = RecordingMQTTClient()
+    mqtt_publisher = MQTTPublisher(logger = logger, message_handler = message_handler, mqtt_client = mqtt_client)
+    event_publisher = EventPublisher(logger, message_handler, mqtt_publisher, asyncio.get_running_loop(),
+                                     coalesce_window = coalesce_window, min_interval = min_interval)
+    return message_handler, mqtt_client, event_publisher
+
+
+def test_batteries_completing_in_window_are_published_together(can_messages: List[can.Message]):
+
+    async def run() -> List[List[dict]]:
+        message_handler, mqtt_client, event_publisher = create_event_publisher(coalesce_window = 0.05, min_interval = 10)
+        for msg in can_messages:
+            message_handler.on_message_received(msg)
+
+        assert mqtt_client.payloads == []
+        await asyncio.sleep(0.1)
+        event_publisher.close()
+        return mqtt_client.payloads
+
+    payloads = asyncio.run(run())
+
+    assert len(payloads) == 1
+    assert sorted(battery['battery_number'] for battery in payloads[0]) == [1, 2, 3]
+
+
+def test_battery_is_held_back_for_min_interval():
+
+    async def run() -> List[List[dict]]:
+        message_handler, mqtt_client, event_publisher = create_event_publisher(coalesce_window = 0.01, min_interval = 0.2)
+        simulator = BusSimulator(1, seed = 1)
+
+        simulator.feed(message_handler, cycles = 1)
+        await asyncio.sleep(0.05)
+        assert len(mqtt_client.payloads) == 1
+
+        # Completions within min_interval are held back, and published once with the latest data.
+        simulator.feed(message_handler, cycles = 1)
+        await asyncio.sleep(0.05)
+        simulator.feed(message_handler, cycles = 1)
+        await asyncio.sleep(0.05)
+        assert len(mqtt_client.payloads) == 1
+
+        await asyncio.sleep(0.2)
+        event_publisher.close()
+        latest_voltage = round(simulator.batteries[0].voltage * 10) / 10
+        assert len(mqtt_client.payloads) == 2
+        assert mqtt_client.payloads[1][0]['battery_voltage'] == latest_voltage
+        return mqtt_client.payloads
+
+    asyncio.run(run())
+
+
+def test_battery_is_not_delayed_by_a_battery_held_back():
+
+    async def run() -> List[List[dict]]:
+        message_handler, mqtt_client, event_publisher = create_event_publisher(coalesce_window = 0.02, min_interval = 0.5)
+        simulator = BusSimulator(2, seed = 1)
+
+        def feed(node_id: int) -> None:
+            for msg in simulator.frames(cycles = 1):
+                if msg.arbitration_id & 0xF == node_id:
+                    message_handler.on_message_received(msg)
+
+        feed(1)
+        await asyncio.sleep(0.05)
+        assert len(mqtt_client.payloads) == 1
+
+        # Battery 1 is held back until its min_interval has passed, but battery 2 is published within the window.
+        feed(1)
+        await asyncio.sleep(0.05)
+        feed(2)
+        await asyncio.sleep(0.05)
+        event_publisher.close()
+        return mqtt_client.payloads
+
+    payloads = asyncio.run(run())
+
+    assert len(payloads) == 2
+    assert [battery['battery_number'] for battery in payloads[1]] == [2]
@@ -0,0 +1,153 @@
+import json
+import logging
+import pytest
+from eflexcan2mqtt.influx_client import InfluxClient, to_line_protocol
+from eflexcan2mqtt.message_handler import MessageHandler
+from eflexcan2mqtt.mqtt_client import MQTTPublishError
+from eflexcan2mqtt.mqtt_publisher import MQTTPublisher
+from eflexcan2mqtt.simulator import BusSimulator
+from .mock_influxdb import MockInfluxDB
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def influxdb():
+    influxdb = MockInfluxDB().start()
+    yield influxdb
+    influxdb.stop()
+
+
+def battery(battery_id: str = "2211075F0955", time: float = 1715987138.25) -> dict:
+    return {
+        'battery_id': battery_id,
+        'battery_soc': 71,
+        'battery_current': -0.3,
+        'hardware_version': 'A',
+        'cell_voltages': [3322, 3323],
+        'time': time,
+    }
+
+
+def test_line_protocol():
+    assert to_line_protocol(battery(), tags = {'channel': 'bank 1'}) == (
+        'battery,battery_id=2211075F0955,channel=bank\\ 1 '
+        'battery_soc=71i,battery_current=-0.3,hardware_version="A",cell_voltages_1=3322i,cell_voltages_2=3323i '
+        '1715987138250000000')
+
+    assert to_line_protocol({'battery_id': "x", 'rollup': {'battery_soc': {'min': 70, 'mean': 70.5}}, 'time': 1}) == (
+        'battery,battery_id=x rollup_battery_soc_min=70i,rollup_battery_soc_mean=70.5 1000000000')
+
+
+def test_publish_writes_gzipped_batch_over_one_connection(influxdb: MockInfluxDB):
+    client = InfluxClient(url = influxdb.url, bucket = "eflex", org = "home", token = "secret", logger = logger)
+
+    client.publish([battery(), battery("2205075E0604")])
+    client.publish([battery(time = 1715987198.5)])
+    client.disconnect()
+
+    assert len(influxdb.writes) == 2
+    write = influxdb.writes[0]
+    assert write.path == "/api/v2/write?org=home&bucket=eflex&precision=ns"
+    assert write.headers['Content-Encoding'] == 'gzip'
+    assert write.headers['Authorization'] == 'Token secret'
+    assert [line.split(' ')[0] for line in write.lines] == ['battery,battery_id=2211075F0955', 'battery,battery_id=2205075E0604']
+    # The keep-alive connection is reused.
+    assert influxdb.writes[1].client_port == write.client_port
+
+
+def test_battery_topic_messages_are_written(influxdb: MockInfluxDB):
+    client = InfluxClient(url = influxdb.url, bucket = "eflex", logger = logger)
+
+    client.publish_messages([("eflexbatteries/2211075F0955", json.dumps(battery())),
+                             ("eflexbatteries/2211075F0955/battery_soc", "71"),
+                             ("eflexbatteries/2211075F0955/rollup", json.dumps({'samples': 2})),
+                             ("eflexbatteries/2205075E0604", json.dumps(battery("2205075E0604")))])
+    client.disconnect()
+
+    assert [line.split(' ')[0] for line in influxdb.lines] == ['battery,battery_id=2211075F0955', 'battery,battery_id=2205075E0604']
+
+
+def test_points_are_batched(influxdb: MockInfluxDB):
+    client = InfluxClient(url = influxdb.url, bucket = "eflex", logger = logger, batch_size = 3,
+                          flush_interval = 3600, compress = False)
+
+    client.publish([battery()])
+    client.publish([battery()])
+    assert influxdb.writes == []
+
+    # All pending points are written once a batch is due, batch_size points per request.
+    client.publish([battery(), battery()])
+    assert [len(write.lines) for write in influxdb.writes] == [3, 1]
+    assert influxdb.writes[0].path == "/write?db=eflex&precision=ns"
+    assert 'Content-Encoding' not in influxdb.writes[0].headers
+
+    client.publish([battery()])
+    client.disconnect()
+    assert [len(write.lines) for write in influxdb.writes] == [3, 1, 1]
+
+
+def test_failed_writes_are_retried(influxdb: MockInfluxDB):
+    client = InfluxClient(url = influxdb.url, bucket = "eflex", logger = logger, retry_delay = 0)
+    influxdb.statuses = [503]
+
+    client.publish([battery()])
+    assert influxdb.lines == []
+
+    client.publish([battery(time = 1715987198)])
+    assert len(influxdb.lines) == 2
+    assert client.written == 2
+
+
+def test_retry_is_delayed(influxdb: MockInfluxDB):
+    client = InfluxClient(url = influxdb.url, bucket = "eflex", logger = logger, retry_delay = 60)
+    influxdb.statuses = [503]
+
+    client.publish([battery()])
+    client.publish([battery()])
+    assert client.requests == 1
+    with pytest.raises(MQTTPublishError, match = "retrying"):
+        client.flush()
+
+
+def test_invalid_points_are_dropped(influxdb: MockInfluxDB):
+    client = InfluxClient(url = influxdb.url, bucket = "eflex", logger = logger)
+    influxdb.statuses = [400]
+
+    client.publish([battery()])
+    client.publish([battery()])
+    assert len(influxdb.lines) == 1
+
+
+def test_unreachable_server_keeps_points(influxdb: MockInfluxDB):
+    url = influxdb.url
+    influxdb.stop()
+    client = InfluxClient(url = url, bucket = "eflex", logger = logger, retry_delay = 0, max_pending = 2, timeout = 1)
+
+    for _ in range(3):
+        client.publish([battery()])
+    with pytest.raises(MQTTPublishError):
+        client.flush()
+
+    assert client.requests == 0
+    assert len(client._pending) == 2
+
+    with pytest.raises(ValueError):
+        InfluxClient(url = "localhost:8086", bucket = "eflex", logger = logger)
+    with pytest.raises(ValueError):
+        InfluxClient(url = "http://localhost:8086", bucket = "", logger = logger)
+
+
+def test_published_battery_data_has_sub_second_time(influxdb: MockInfluxDB):
+    simulator = BusSimulator(2, seed = 1, start_time = 1715987138.125)
+    message_handler = MessageHandler(logger)
+    client = InfluxClient(url = influxdb.url, bucket = "eflex", logger = logger)
+    publisher = MQTTPublisher(logger = logger, message_handler = message_handler, mqtt_client = client, round_time = False)
+
+    simulator.feed(message_handler, cycles = 1)
+    publisher.publish_data()
+
+    timestamps = [int(line.rsplit(' ', 1)[1]) for line in influxdb.lines]
+    expected = sorted(message_handler.timestamps.values())
+    assert timestamps == [round(timestamp * 1_000_000) * 1000 for timestamp in expected]
+    assert all(timestamp % 1_000_000_000 for timestamp in timestamps)
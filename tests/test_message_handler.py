@@ -1,15 +1,40 @@
 """Test cases for MessageHandler"""
 
 import logging
+import struct
+import sys
+import threading
 from typing import List
 from eflexcan2mqtt.message_handler import MessageHandler, _all_messages_received, MSG_TYPE_10, MSG_TYPE_60
+from eflexcan2mqtt.mqtt_publisher import MQTTPublisher
+from eflexcan2mqtt.simulator import MSG_60X_LAST_FIRST_BYTE, TEMPLATE_10X_DATA, TEMPLATE_60X_DATA, split_frames
 from can import Message
+from .mock_mqtt_client import MockMQTTClient
 
 logger = logging.getLogger(__name__)
 
+def messages_compiled(message_type: str, messages: List[Message]) -> bool:
+    """Feeds the messages to a new MessageHandler and checks whether they were compiled
+    into a complete set of 10X or 60X data."""
+
+    msg_handler = MessageHandler(logger)
+    for msg in messages:
+        msg_handler.on_message_received(msg)
+
+    if message_type == MSG_TYPE_10:
+        return len(msg_handler.compiled_message10X_data) > 0
+    return len(msg_handler.compiled_message60X_data) > 0
+
+def test_all_messages_received_checks_received_mask():
+
+    assert _all_messages_received(MSG_TYPE_10, 0b11111111111) is True
+    assert _all_messages_received(MSG_TYPE_10, 0b01111111111) is False
+    assert _all_messages_received(MSG_TYPE_60, 0b1111111) is True
+    assert _all_messages_received(MSG_TYPE_60, 0b0111111) is False
+
 def test_all_messages_received_returns_false_if_10X_messages_are_out_of_order():
 
-    assert _all_messages_received(MSG_TYPE_10, [
+    assert messages_compiled(MSG_TYPE_10, [
         Message(arbitration_id = 0x101, timestamp = 1715987138.038647, data = [0x08,0x22,0x11,0x00,0x75,0x46,0x03,0xBB]),
         Message(arbitration_id = 0x101, timestamp = 1715987138.039210, data = [0x09,0x13,0x95,0xBA,0xEE,0x00,0x00,0x01]),
         Message(arbitration_id = 0x101, timestamp = 1715987138.039687, data = [0x0A,0x00,0x00,0x00,0x00,0x00,0x02,0x15]),
@@ -25,7 +50,7 @@ def test_all_messages_received_returns_false_if_10X_messages_are_out_of_order():
 
 def test_all_messages_received_returns_false_if_10X_messages_are_missing():
 
-    assert _all_messages_received(MSG_TYPE_10, [
+    assert messages_compiled(MSG_TYPE_10, [
         Message(arbitration_id = 0x101, timestamp = 1715987139.048187, data = [0x01,0x01,0x0E,0x02,0x13,0xFF,0xFD,0x47]),
         Message(arbitration_id = 0x101, timestamp = 1715987139.048532, data = [0x02,0x03,0x00,0x00,0x02,0x12,0x01,0x01]),
         Message(arbitration_id = 0x101, timestamp = 1715987139.049075, data = [0x03,0x01,0xF4,0x02,0x58,0x00,0x01,0x2A]),
@@ -38,7 +63,7 @@ def test_all_messages_received_returns_false_if_10X_messages_are_missing():
 def test_all_messages_received_returns_false_if_10X_messages_are_duplicated():
     """This scenario can happen if the network goes down and messages stop being handled for some time,
     only to start being handled again. This is an edge case"""
-    assert _all_messages_received(MSG_TYPE_10, [
+    assert messages_compiled(MSG_TYPE_10, [
         Message(arbitration_id = 0x102, timestamp = 1715987138.048410, data = [0x01,0x02,0x0E,0x02,0x13,0xFF,0xFD,0x45]),
         Message(arbitration_id = 0x102, timestamp = 1715987138.048683, data = [0x02,0x03,0x00,0x00,0x02,0x12,0x01,0x01]),
         Message(arbitration_id = 0x102, timestamp = 1715987138.049224, data = [0x03,0x01,0xF4,0x02,0x58,0x00,0x01,0x2A]),
@@ -54,7 +79,7 @@ def test_all_messages_received_returns_false_if_10X_messages_are_duplicated():
 
 def test_all_messages_received_returns_true_if_10X_messages_are_found():
 
-    assert _all_messages_received(MSG_TYPE_10, [
+    assert messages_compiled(MSG_TYPE_10, [
         Message(arbitration_id = 0x103, timestamp = 1715987139.081321, data = [0x01,0x03,0x0E,0x02,0x13,0xFF,0xFD,0x53]),
         Message(arbitration_id = 0x103, timestamp = 1715987139.081522, data = [0x02,0x03,0x00,0x00,0x02,0x12,0x01,0x01]),
         Message(arbitration_id = 0x103, timestamp = 1715987139.082070, data = [0x03,0x01,0xF4,0x02,0x58,0x00,0x01,0x2A]),
@@ -70,7 +95,7 @@ def test_all_messages_received_returns_true_if_10X_messages_are_found():
 
 def test_all_messages_received_returns_false_if_60X_messages_are_out_of_order():
 
-    assert _all_messages_received(MSG_TYPE_60, [
+    assert messages_compiled(MSG_TYPE_60, [
         Message(arbitration_id = 0x603, timestamp = 1715987138.075991, data = [0x06,0x00,0x00,0x00,0x00,0x00,0x00,0x00]),
         Message(arbitration_id = 0x603, timestamp = 1715987138.076465, data = [0x11,0x47,0x45,0x45,0x45,0x46,0x49,0x00]),
         Message(arbitration_id = 0x603, timestamp = 1715987139.086371, data = [0x01,0xF8,0x0C,0xF7,0x0C,0xF7,0x0C,0xF7]),
@@ -82,7 +107,7 @@ def test_all_messages_received_returns_false_if_60X_messages_are_out_of_order():
 
 def test_all_messages_received_returns_false_if_60X_messages_are_missing():
 
-    assert _all_messages_received(MSG_TYPE_60, [
+    assert messages_compiled(MSG_TYPE_60, [
         Message(arbitration_id = 0x603, timestamp = 1715987138.073540, data = [0x01,0xF8,0x0C,0xF7,0x0C,0xF7,0x0C,0xF7]),
         Message(arbitration_id = 0x603, timestamp = 1715987138.074023, data = [0x02,0x0C,0xF8,0x0C,0xF8,0x0C,0xF7,0x0C]),
         Message(arbitration_id = 0x603, timestamp = 1715987138.074476, data = [0x03,0xF7,0x0C,0xF7,0x0C,0xF7,0x0C,0xF7]),
@@ -94,7 +119,7 @@ def test_all_messages_received_returns_false_if_60X_messages_are_missing():
 def test_all_messages_received_returns_false_if_60X_messages_are_duplicated():
     """This scenario can happen if the network goes down and messages stop being handled for some time,
     only to start being handled again. This is an edge case"""
-    assert _all_messages_received(MSG_TYPE_60, [
+    assert messages_compiled(MSG_TYPE_60, [
         Message(arbitration_id = 0x601, timestamp = 1715987138.043252, data = [0x01,0xF7,0x0C,0xF7,0x0C,0xF7,0x0C,0xF7]),
         Message(arbitration_id = 0x601, timestamp = 1715987138.043804, data = [0x02,0x0C,0xF7,0x0C,0xF7,0x0C,0xF7,0x0C]),
         Message(arbitration_id = 0x601, timestamp = 1715987138.044287, data = [0x03,0xF7,0x0C,0xF7,0x0C,0xF7,0x0C,0xF7]),
@@ -106,7 +131,7 @@ def test_all_messages_received_returns_false_if_60X_messages_are_duplicated():
 
 def test_all_messages_received_returns_true_if_60X_messages_are_found():
 
-    assert _all_messages_received(MSG_TYPE_60, [
+    assert messages_compiled(MSG_TYPE_60, [
         Message(arbitration_id = 0x603, timestamp = 1715987139.086371, data = [0x01,0xF8,0x0C,0xF7,0x0C,0xF7,0x0C,0xF7]),
         Message(arbitration_id = 0x603, timestamp = 1715987139.086858, data = [0x02,0x0C,0xF8,0x0C,0xF8,0x0C,0xF7,0x0C]),
         Message(arbitration_id = 0x603, timestamp = 1715987139.087389, data = [0x03,0xF7,0x0C,0xF7,0x0C,0xF7,0x0C,0xF7]),
@@ -156,8 +181,8 @@ def test_message_data_aggregation_following_network_down_event():
 
     msg10_ids = msg_handler.compiled_message10X_data.keys()
 
-    assert "2" in msg10_ids
-    assert msg_handler.compiled_message10X_data["2"] == EXPECTED_102_DATA
+    assert 2 in msg10_ids
+    assert msg_handler.compiled_message10X_data[2] == bytes(EXPECTED_102_DATA)
     
     
 
@@ -171,19 +196,72 @@ def test_message_data_is_aggregated(can_messages):
     msg10_ids = msg_handler.compiled_message10X_data.keys()
     msg60_ids = msg_handler.compiled_message60X_data.keys()
 
-    assert "1" in msg10_ids
-    assert "2" in msg10_ids
-    assert "3" in msg10_ids
-    assert "1" in msg60_ids
-    assert "2" in msg60_ids
-    assert "3" in msg60_ids
-
-    assert msg_handler.compiled_message10X_data["1"] == EXPECTED_101_DATA
-    assert msg_handler.compiled_message10X_data["2"] == EXPECTED_102_DATA
-    assert msg_handler.compiled_message10X_data["3"] == EXPECTED_103_DATA
-    assert msg_handler.compiled_message60X_data["1"] == EXPECTED_601_DATA
-    assert msg_handler.compiled_message60X_data["2"] == EXPECTED_602_DATA
-    assert msg_handler.compiled_message60X_data["3"] == EXPECTED_603_DATA
+    assert 1 in msg10_ids
+    assert 2 in msg10_ids
+    assert 3 in msg10_ids
+    assert 1 in msg60_ids
+    assert 2 in msg60_ids
+    assert 3 in msg60_ids
+
+    assert msg_handler.compiled_message10X_data[1] == bytes(EXPECTED_101_DATA)
+    assert msg_handler.compiled_message10X_data[2] == bytes(EXPECTED_102_DATA)
+    assert msg_handler.compiled_message10X_data[3] == bytes(EXPECTED_103_DATA)
+    assert msg_handler.compiled_message60X_data[1] == bytes(EXPECTED_601_DATA)
+    assert msg_handler.compiled_message60X_data[2] == bytes(EXPECTED_602_DATA)
+    assert msg_handler.compiled_message60X_data[3] == bytes(EXPECTED_603_DATA)
+
+
+def numbered_cycle_frames(node_count: int, cycles: int) -> List[Message]:
+    """The frames of each node for each cycle, with the cycle number in both its 10X and 60X data."""
+    frames = []
+    for cycle in range(cycles):
+        number = struct.pack('>I', cycle)
+        for node_id in range(1, node_count + 1):
+            for data in split_frames(number + TEMPLATE_10X_DATA[4:]):
+                frames.append(Message(arbitration_id = 0x100 + node_id, timestamp = 1715987138.0 + cycle, data = data))
+            for data in split_frames(number + TEMPLATE_60X_DATA[4:], MSG_60X_LAST_FIRST_BYTE):
+                frames.append(Message(arbitration_id = 0x600 + node_id, timestamp = 1715987138.0 + cycle, data = data))
+    return frames
+
+
+def test_battery_data_is_consistent_while_messages_are_handled_on_another_thread():
+
+    msg_handler = MessageHandler(logger)
+    mqtt_client = MockMQTTClient()
+    mqtt_publisher = MQTTPublisher(logger = logger, message_handler = msg_handler, mqtt_client = mqtt_client)
+    frames = numbered_cycle_frames(node_count = 16, cycles = 300)
+    errors = []
+
+    def ingest() -> None:
+        try:
+            for msg in frames:
+                msg_handler.on_message_received(msg)
+        except Exception as e:
+            errors.append(e)
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        ingest_thread = threading.Thread(target = ingest)
+        ingest_thread.start()
+        snapshots = 0
+        while ingest_thread.is_alive():
+            mqtt_publisher.publish_data()
+            # The 10X and 60X data of each node are of the same cycle, the cycle of the timestamp.
+            for node_id, data10, data60, timestamp in msg_handler.compiled_battery_data():
+                cycle = struct.unpack_from('>I', data10)[0]
+                assert struct.unpack_from('>I', data60)[0] == cycle
+                assert timestamp == 1715987138.0 + cycle
+            snapshots += 1
+        ingest_thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    assert errors == []
+    assert snapshots > 1
+    assert mqtt_client.payload
+    assert [(node_id, timestamp) for node_id, _, _, timestamp in msg_handler.compiled_battery_data()] == \
+        [(node_id, 1715987138.0 + 299) for node_id in range(1, 17)]
 
 
 EXPECTED_101_DATA = [
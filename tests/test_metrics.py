@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import can
+import pytest
+from eflexcan2mqtt.message_handler import MessageHandler
+from eflexcan2mqtt.metrics import ChannelMetrics, Histogram, MetricsServer, MetricsWriter, write_metrics
+from eflexcan2mqtt.mqtt_publisher import MQTTPublisher
+from eflexcan2mqtt.shared_ring import SetRingReader, SetRingWriter, create_ring
+from eflexcan2mqtt.simulator import BusSimulator
+from .mock_mqtt_client import MockMQTTClient
+
+logger = logging.getLogger(__name__)
+
+
+def test_frame_and_set_counters():
+    message_handler = MessageHandler(logger)
+    frames = list(BusSimulator(2, seed = 1).frames(cycles = 2))
+
+    message_handler.on_message_received(can.Message(arbitration_id = 0x351, data = [0] * 8))
+    # Waiting for the first message of a set.
+    message_handler.on_message_received(frames[1])
+    for msg in frames:
+        message_handler.on_message_received(msg)
+    # A set started, then restarted before it was completed, then a frame out of order.
+    message_handler.on_message_received(frames[0])
+    message_handler.on_message_received(frames[0])
+    message_handler.on_message_received(frames[2])
+    message_handler.on_message_received(frames[1])
+
+    assert message_handler.frame_counts == {'10': 2 * 2 * 11 + 5, '60': 2 * 2 * 7}
+    assert message_handler.ignored_frames == 1
+    assert message_handler.dropped_frames == 3
+    assert message_handler.incomplete_sets == 1
+    assert message_handler.out_of_order_sets == 1
+    assert message_handler.completed_sets_per_node == {1: 2, 2: 2}
+    assert message_handler.abandoned_sets_per_node == {1: 2, 2: 0}
+
+
+def test_cycle_periods_and_duplicated_frames():
+    message_handler = MessageHandler(logger)
+    simulator = BusSimulator(2, seed = 1, cycle_interval = 2.0)
+    frames = list(simulator.frames(cycles = 3))
+    for msg in frames:
+        message_handler.on_message_received(msg)
+
+    assert message_handler.cycle_periods == {1: 2.0, 2: 2.0}
+
+    # A frame repeated within its set abandons the set.
+    message_handler.on_message_received(frames[0])
+    message_handler.on_message_received(frames[1])
+    message_handler.on_message_received(frames[1])
+
+    assert message_handler.duplicated_frames_per_node == {1: 1, 2: 0}
+    assert message_handler.abandoned_sets_per_node == {1: 1, 2: 0}
+    assert message_handler.node_stats(1) == (1, 1, 2.0)
+    assert message_handler.node_stats(3) == (0, 0, 0.0)
+
+    # The period is smoothed, a late set moving it by a fifth of the difference.
+    previous_timestamp = message_handler.timestamps[1]
+    BusSimulator(1, seed = 1, start_time = previous_timestamp + 3.0).feed(message_handler, cycles = 1)
+    period = message_handler.timestamps[1] - previous_timestamp
+    assert message_handler.cycle_periods[1] == pytest.approx(2.0 + (period - 2.0) / 5)
+
+
+def test_histogram():
+    histogram = Histogram((0.001, 0.01))
+    for value in (0.0005, 0.001, 0.005, 0.5):
+        histogram.observe(value)
+
+    writer = MetricsWriter()
+    writer.histogram('publish_seconds', "Publish time.", histogram, channel = "can0")
+
+    assert writer.text().splitlines() == [
+        '# HELP eflexcan2mqtt_publish_seconds Publish time.',
+        '# TYPE eflexcan2mqtt_publish_seconds histogram',
+        'eflexcan2mqtt_publish_seconds_bucket{channel="can0",le="0.001"} 2',
+        'eflexcan2mqtt_publish_seconds_bucket{channel="can0",le="0.01"} 3',
+        'eflexcan2mqtt_publish_seconds_bucket{channel="can0",le="+Inf"} 4',
+        'eflexcan2mqtt_publish_seconds_sum{channel="can0"} 0.5065',
+        'eflexcan2mqtt_publish_seconds_count{channel="can0"} 4',
+    ]
+
+
+def channel_metrics(name: str, mqtt_client: MockMQTTClient) -> ChannelMetrics:
+    message_handler = MessageHandler(logger)
+    BusSimulator(2, seed = 1).feed(message_handler, cycles = 3)
+    mqtt_publisher = MQTTPublisher(logger = logger, message_handler = message_handler, mqtt_client = mqtt_client)
+    return ChannelMetrics(name, message_handler, mqtt_publisher)
+
+
+def test_metrics_of_each_channel():
+    mqtt_client = MockMQTTClient()
+    bank1 = channel_metrics("bank1", mqtt_client)
+    bank2 = channel_metrics("bank2", mqtt_client)
+    bank1.mqtt_publisher.publish_data()
+    mqtt_client.fail = True
+    bank2.mqtt_publisher.publish_data()
+    bank2.network_down_events = 1
+    bank2.message_handler.on_message_received(can.Message(arbitration_id = 0x101, data = [0x01] + [0] * 7))
+    bank2.message_handler.on_message_received(can.Message(arbitration_id = 0x101, data = [0x01] + [0] * 7))
+
+    writer = MetricsWriter()
+    write_metrics(writer, [bank1, bank2], now = bank1.message_handler.timestamps[1] + 2.5)
+    lines = writer.text().splitlines()
+
+    assert 'eflexcan2mqtt_frames_received_total{channel="bank1",type="1x"} 66' in lines
+    assert 'eflexcan2mqtt_frames_received_total{channel="bank2",type="6x"} 42' in lines
+    assert 'eflexcan2mqtt_sets_completed_total{channel="bank2",node="2"} 3' in lines
+    assert 'eflexcan2mqtt_data_age_seconds{channel="bank1",node="1"} 2.5' in lines
+    assert 'eflexcan2mqtt_can_network_down_total{channel="bank2"} 1' in lines
+    assert 'eflexcan2mqtt_sets_abandoned_total{channel="bank1",node="1"} 0' in lines
+    assert 'eflexcan2mqtt_sets_abandoned_total{channel="bank2",node="1"} 1' in lines
+    assert 'eflexcan2mqtt_frames_duplicated_total{channel="bank2",node="2"} 0' in lines
+    assert 'eflexcan2mqtt_cycle_period_seconds{channel="bank1",node="2"} 1.0' in lines
+    # The socket metrics are only written for channels read by a SocketCANReader.
+    assert not any(line.startswith('eflexcan2mqtt_socket_drops_total') for line in lines)
+    assert 'eflexcan2mqtt_publish_failures_total{channel="bank1"} 0' in lines
+    assert 'eflexcan2mqtt_publish_failures_total{channel="bank2"} 1' in lines
+    assert 'eflexcan2mqtt_publish_seconds_count{channel="bank1"} 1' in lines
+    assert 'eflexcan2mqtt_decode_seconds_count{channel="bank2"} 2' in lines
+    # Each metric is described once, before its samples.
+    assert lines.count('# TYPE eflexcan2mqtt_frames_received_total counter') == 1
+    # The ring metrics are only written for channels read from a SetRingReader.
+    assert not any(line.startswith('eflexcan2mqtt_ring_sets_lost_total') for line in lines)
+
+
+def test_sets_lost_in_the_ring():
+    ring = create_ring(capacity = 16)
+    try:
+        message_handler = MessageHandler(logger)
+        writer = SetRingWriter(ring.buf, message_handler)
+        reader = SetRingReader(ring.buf)
+        # 20 sets are written before the reader polls, and the 4 oldest are overwritten.
+        BusSimulator(2, seed = 1).feed(message_handler, cycles = 10)
+        reader.poll()
+
+        metrics_writer = MetricsWriter()
+        write_metrics(metrics_writer, [ChannelMetrics("bank1", reader, bus_reader = reader, ring_reader = reader)])
+        del writer, reader
+    finally:
+        ring.close()
+        ring.unlink()
+
+    assert 'eflexcan2mqtt_ring_sets_lost_total{channel="bank1"} 4' in metrics_writer.text().splitlines()
+
+
+def test_metrics_server():
+    async def request(port: int, path: str) -> bytes:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+        response = await reader.read()
+        writer.close()
+        return response
+
+    async def run():
+        server = MetricsServer(logger = logger, collect = lambda: "eflexcan2mqtt_up 1\n", port = 0)
+        await server.start()
+        try:
+            return await request(server.port, '/metrics'), await request(server.port, '/')
+        finally:
+            await server.close()
+
+    metrics, not_found = asyncio.run(run())
+
+    assert metrics.startswith(b'HTTP/1.0 200 OK\r\n')
+    assert b'Content-Type: text/plain; version=0.0.4' in metrics
+    assert metrics.endswith(b'\r\n\r\neflexcan2mqtt_up 1\n')
+    assert not_found.startswith(b'HTTP/1.0 404')
@@ -1,7 +1,13 @@
+import json
 import logging
 from .mock_mqtt_client import MockMQTTClient
 from eflexcan2mqtt.mqtt_publisher import MQTTPublisher
 from eflexcan2mqtt.message_handler import MessageHandler
+from eflexcan2mqtt.spool import DiskSpool
+from eflexcan2mqtt.decode import parse_battery_data
+from eflexcan2mqtt.replay import InMemoryMQTTClient
+from eflexcan2mqtt.serializers import BinarySerializer
+from eflexcan2mqtt.simulator import BusSimulator
 
 logger = logging.getLogger(__name__)
 
@@ -64,3 +70,117 @@ EXPECTED_PAYLOAD = [
         "time": 1715987139
     }
 ]
+
+
+def test_failed_publish_is_spooled_and_drained(message_handler: MessageHandler, tmp_path):
+    mqtt_client = MockMQTTClient()
+    mqtt_client.fail = True
+    spool = DiskSpool(str(tmp_path / "spool.db"), max_bytes = 1048576, logger = logger)
+
+    publisher = MQTTPublisher(logger = logger, message_handler = message_handler, mqtt_client = mqtt_client,
+                              spool = spool, drain_batch_size = 10)
+    publisher.publish_data()
+
+    assert len(spool) == 1
+    assert publisher.drain_spool() == 0
+    assert len(spool) == 1
+
+    mqtt_client.fail = False
+
+    assert publisher.drain_spool() == 1
+    assert len(spool) == 0
+    assert EXPECTED_PAYLOAD == mqtt_client.payload
+
+
+def test_battery_data_that_cant_be_serialized_is_not_spooled(message_handler: MessageHandler, tmp_path):
+    spool = DiskSpool(str(tmp_path / "spool.db"), max_bytes = 1048576, logger = logger)
+    mqtt_client = InMemoryMQTTClient(serializer = BinarySerializer())
+
+    # A signal database without the cell voltages of the binary layout.
+    def decoder(data10: bytes, data60: bytes) -> dict:
+        battery_data = parse_battery_data(data10, data60)
+        del battery_data['cell_voltages']
+        return battery_data
+
+    publisher = MQTTPublisher(logger = logger, message_handler = message_handler, mqtt_client = mqtt_client,
+                              spool = spool, decoder = decoder)
+    publisher.publish_data()
+
+    assert publisher.publish_failures == 1
+    assert len(spool) == 0
+
+
+def test_spooled_battery_data_that_cant_be_serialized_is_removed(tmp_path):
+    spool = DiskSpool(str(tmp_path / "spool.db"), max_bytes = 1048576, logger = logger)
+    spool.append([{'battery_id': "2205075E0604"}])
+    spool.append(EXPECTED_PAYLOAD)
+    mqtt_client = InMemoryMQTTClient(serializer = BinarySerializer())
+    publisher = MQTTPublisher(logger = logger, message_handler = MessageHandler(logger), mqtt_client = mqtt_client,
+                              spool = spool)
+
+    assert publisher.drain_spool() == 0
+    assert len(spool) == 1
+    assert publisher.drain_spool() == 1
+    assert mqtt_client.last_payload == EXPECTED_PAYLOAD
+
+
+def test_publishers_share_mqtt_client_with_own_topics(message_handler: MessageHandler):
+    mqtt_client = MockMQTTClient()
+    bank1 = MQTTPublisher(logger = logger, message_handler = message_handler, mqtt_client = mqtt_client,
+                          topic = "eflexbatteries/bank1")
+    bank2 = MQTTPublisher(logger = logger, message_handler = MessageHandler(logger), mqtt_client = mqtt_client,
+                          topic = "eflexbatteries/bank2")
+
+    bank2.publish_data()
+    assert mqtt_client.topic is None
+
+    bank1.publish_data()
+    assert mqtt_client.topic == "eflexbatteries/bank1"
+    assert EXPECTED_PAYLOAD == mqtt_client.payload
+
+
+def test_fan_out_to_retained_battery_and_field_topics():
+    message_handler = MessageHandler(logger)
+    mqtt_client = MockMQTTClient()
+    publisher = MQTTPublisher(logger = logger, message_handler = message_handler, mqtt_client = mqtt_client,
+                              topic = "eflexbatteries", fan_out = True, field_topics = True)
+    simulator = BusSimulator(2, seed = 8)
+
+    simulator.feed(message_handler, cycles = 1)
+    publisher.publish_data()
+
+    assert mqtt_client.retain is True
+    topics = [topic for topic, _ in mqtt_client.messages]
+    assert topics[0] == "eflexbatteries/2211075F0001"
+    assert "eflexbatteries/2211075F0001/software_version" in topics
+    assert "eflexbatteries/2211075F0002/time" in topics
+    assert len(topics) == 2 * (1 + 14)
+
+    battery_data = json.loads(mqtt_client.messages[0][1])
+    assert battery_data == {**parse_battery_data(simulator.batteries[0].data10, simulator.batteries[0].data60),
+                            'time': battery_data['time']}
+
+    # Only the field topics of values that changed are published again.
+    simulator.feed(message_handler, cycles = 1)
+    publisher.publish_data()
+
+    topics = [topic for topic, _ in mqtt_client.messages]
+    assert "eflexbatteries/2211075F0001" in topics
+    assert "eflexbatteries/2211075F0001/time" in topics
+    assert "eflexbatteries/2211075F0001/software_version" not in topics
+
+
+def test_decoded_battery_data_is_cached_until_data_changes(message_handler: MessageHandler):
+    decoded = []
+
+    def decoder(data10: bytes, data60: bytes) -> dict:
+        decoded.append(data10)
+        return parse_battery_data(data10, data60)
+
+    publisher = MQTTPublisher(logger = logger, message_handler = message_handler, mqtt_client = MockMQTTClient(),
+                              decoder = decoder)
+    publisher.publish_data()
+    publisher._published_timestamps.clear()
+    publisher.publish_data()
+
+    assert len(decoded) == 3
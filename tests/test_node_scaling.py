@@ -0,0 +1,50 @@
+"""Assembly and publish work per node stays the same as the number of nodes grows. The timing is
+measured by benchmarks/bench_node_scaling.py."""
+
+import logging
+from typing import List
+import can
+from eflexcan2mqtt.message_handler import MessageHandler
+from eflexcan2mqtt.mqtt_publisher import MQTTPublisher
+from eflexcan2mqtt.simulator import BusSimulator
+from .mock_mqtt_client import MockMQTTClient
+
+logger = logging.getLogger(__name__)
+
+CYCLES = 5
+
+
+def assemble_and_publish(frames: List[can.Message]) -> tuple[MessageHandler, MockMQTTClient]:
+    message_handler = MessageHandler(logger)
+    for msg in frames:
+        message_handler.on_message_received(msg)
+
+    mqtt_client = MockMQTTClient()
+    MQTTPublisher(logger = logger, message_handler = message_handler, mqtt_client = mqtt_client).publish_data()
+    return message_handler, mqtt_client
+
+
+def test_all_nodes_are_addressed():
+    frames = list(BusSimulator(200, seed = 5).frames(1))
+
+    message_handler, mqtt_client = assemble_and_publish(frames)
+
+    assert message_handler.node_count == 200
+    assert sorted(message_handler.compiled_message10X_data) == list(range(1, 201))
+    assert [battery['battery_number'] for battery in mqtt_client.payload] == list(range(1, 201))
+
+
+def test_work_per_node_is_constant():
+    for node_count in (8, 128):
+        frames = list(BusSimulator(node_count, seed = 6).frames(CYCLES))
+
+        message_handler, mqtt_client = assemble_and_publish(frames)
+
+        # Each node has its own slot, in the order it was first seen, with the state of one node.
+        node_ids = [battery['battery_number'] for battery in mqtt_client.payload]
+        assert [message_handler._node_slots[node_id] for node_id in node_ids] == list(range(node_count))
+        assert len(message_handler._assembly_buffers) == len(message_handler._compiled_data) == node_count * 2
+        # Every frame of a node is handled once, completing one set per cycle.
+        assert message_handler.completed_sets_per_node == {node_id: CYCLES for node_id in node_ids}
+        assert sum(message_handler.frame_counts.values()) == len(frames)
+        assert message_handler.dropped_frames == 0 and message_handler.ignored_frames == 0
@@ -0,0 +1,90 @@
+import json
+import logging
+import time
+import pytest
+from eflexcan2mqtt.mqtt_client import MQTTPublishError
+from eflexcan2mqtt.paho_client import PahoClient
+from .mock_mqtt_broker import MockMQTTBroker
+
+logger = logging.getLogger(__name__)
+
+
+def wait_until(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@pytest.fixture
+def broker():
+    broker = MockMQTTBroker().start()
+    yield broker
+    broker.stop()
+
+
+def create_client(port: int, qos: int = 2) -> PahoClient:
+    return PahoClient(topic = "eflexbatteries", hostname = "127.0.0.1", port = port,
+                      keepalive = 60, qos = qos, client_id = "test", logger = logger)
+
+
+def test_publish_reuses_connection(broker: MockMQTTBroker):
+    client = create_client(broker.port)
+    client.connect()
+    try:
+        assert wait_until(lambda: client.is_connected)
+
+        client.publish([{"battery_id": "2211075F0955"}])
+        client.publish([{"battery_id": "2205075E0604"}])
+
+        assert broker.wait_for_messages(2)
+        assert [json.loads(payload) for _, payload, _, _ in broker.messages] == [
+            [{"battery_id": "2211075F0955"}],
+            [{"battery_id": "2205075E0604"}],
+        ]
+        assert all(topic == "eflexbatteries" and qos == 2 for topic, _, qos, _ in broker.messages)
+    finally:
+        client.disconnect()
+
+
+def test_publish_raises_when_not_connected(broker: MockMQTTBroker):
+    client = create_client(broker.port)
+
+    with pytest.raises(MQTTPublishError):
+        client.publish([{"battery_id": "2211075F0955"}])
+
+
+def test_publish_to_topic(broker: MockMQTTBroker):
+    client = create_client(broker.port)
+    client.connect()
+    try:
+        assert wait_until(lambda: client.is_connected)
+
+        client.publish([{"battery_id": "2211075F0955"}], "eflexbatteries/bank2")
+
+        assert broker.wait_for_messages(1)
+        assert broker.messages[0][0] == "eflexbatteries/bank2"
+    finally:
+        client.disconnect()
+
+
+def test_publish_messages_retained(broker: MockMQTTBroker):
+    client = create_client(broker.port, qos = 1)
+    client.connect()
+    try:
+        assert wait_until(lambda: client.is_connected)
+
+        client.publish_messages([
+            ("eflexbatteries/2211075F0955", '{"battery_soc": 71}'),
+            ("eflexbatteries/2211075F0955/battery_soc", '71'),
+        ], retain = True)
+
+        assert broker.wait_for_messages(2)
+        assert [(topic, payload, retain) for topic, payload, _, retain in broker.messages] == [
+            ("eflexbatteries/2211075F0955", b'{"battery_soc": 71}', True),
+            ("eflexbatteries/2211075F0955/battery_soc", b'71', True),
+        ]
+    finally:
+        client.disconnect()
@@ -0,0 +1,68 @@
+import asyncio
+import logging
+import os
+import pstats
+import signal
+import tracemalloc
+from eflexcan2mqtt.message_handler import MessageHandler
+from eflexcan2mqtt.profiling import Profiler
+from eflexcan2mqtt.simulator import BusSimulator
+
+logger = logging.getLogger(__name__)
+
+
+def test_cpu_profile(tmp_path):
+    profiler = Profiler(logger, str(tmp_path))
+
+    assert profiler.toggle_cpu_profile() is None
+    assert profiler.cpu_profiling
+    BusSimulator(2, seed = 1).feed(MessageHandler(logger), cycles = 2)
+    path = profiler.toggle_cpu_profile()
+
+    assert not profiler.cpu_profiling
+    functions = {function for _, _, function in pstats.Stats(path).stats}
+    assert 'on_message_received' in functions
+
+
+def test_memory_profile(tmp_path):
+    profiler = Profiler(logger, str(tmp_path), top = 5)
+    try:
+        assert profiler.toggle_memory_profile() is None
+        assert tracemalloc.is_tracing()
+
+        retained = [bytearray(1000) for _ in range(100)]
+        path = profiler.toggle_memory_profile()
+
+        with open(path) as file:
+            lines = file.read().splitlines()
+        assert lines[0].startswith("Traced memory:")
+        assert 2 < len(lines) <= 2 + 5
+        assert 'test_profiling.py' in lines[2]
+        assert profiler.toggle_memory_profile() != path
+    finally:
+        profiler.close()
+
+    assert not tracemalloc.is_tracing()
+    del retained
+
+
+def test_signals_toggle_profiling(tmp_path):
+    profiler = Profiler(logger, str(tmp_path))
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        profiler.add_signal_handlers(loop)
+        try:
+            os.kill(os.getpid(), signal.SIGUSR1)
+            await asyncio.sleep(0.05)
+            assert profiler.cpu_profiling
+            os.kill(os.getpid(), signal.SIGUSR1)
+            await asyncio.sleep(0.05)
+        finally:
+            loop.remove_signal_handler(signal.SIGUSR1)
+            loop.remove_signal_handler(signal.SIGUSR2)
+
+    asyncio.run(run())
+
+    assert not profiler.cpu_profiling
+    assert [name.endswith('.prof') for name in os.listdir(tmp_path)] == [True]
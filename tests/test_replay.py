@@ -0,0 +1,29 @@
+import logging
+from typing import List
+import can
+from eflexcan2mqtt.replay import InMemoryMQTTClient, percentile, read_candump, run_replay
+
+logger = logging.getLogger(__name__)
+
+
+def test_replay_candump_log(can_messages: List[can.Message], tmp_path):
+    log_path = str(tmp_path / "messages.log")
+    with can.io.CanutilsLogWriter(log_path, channel = "can0") as writer:
+        for msg in can_messages:
+            writer.on_message_received(msg)
+
+    mqtt_client = InMemoryMQTTClient()
+    report = run_replay(read_candump(log_path), logger, publish_interval = 60, mqtt_client = mqtt_client)
+
+    assert report.frames == len(can_messages)
+    assert report.completed_sets == 6
+    assert report.publishes == 1
+    assert report.batteries_published == 3
+    assert len(report.decode_latencies) == 3
+    assert [battery['battery_number'] for battery in mqtt_client.last_payload] == [2, 3, 1]
+
+
+def test_percentile():
+    assert percentile([], 50) == 0.0
+    assert percentile([3.0, 1.0, 2.0, 4.0], 50) == 3.0
+    assert percentile([3.0, 1.0, 2.0, 4.0], 99) == 4.0
@@ -0,0 +1,101 @@
+import json
+import logging
+import pytest
+from eflexcan2mqtt.decode import parse_battery_data
+from eflexcan2mqtt.message_handler import MessageHandler
+from eflexcan2mqtt.mqtt_publisher import MQTTPublisher
+from eflexcan2mqtt.rollup import Rollup
+from eflexcan2mqtt.simulator import BusSimulator
+from .mock_mqtt_client import MockMQTTClient
+
+logger = logging.getLogger(__name__)
+
+
+def feed(simulator: BusSimulator, message_handler: MessageHandler, cycles: int) -> dict[int, list[dict]]:
+    """Feeds the cycles one at a time, returning the battery data of each cycle per node."""
+    samples = {battery.node_id: [] for battery in simulator.batteries}
+    for _ in range(cycles):
+        simulator.feed(message_handler, cycles = 1)
+        for battery in simulator.batteries:
+            samples[battery.node_id].append(parse_battery_data(battery.data10, battery.data60))
+    return samples
+
+
+def expected_stats(values: list) -> dict:
+    return {'min': min(values), 'max': max(values), 'mean': round(sum(values) / len(values), 3), 'last': values[-1]}
+
+
+def test_summary_of_each_signal():
+    simulator = BusSimulator(3, seed = 1)
+    message_handler = MessageHandler(logger)
+    rollup = Rollup(message_handler)
+
+    samples = feed(simulator, message_handler, cycles = 20)
+
+    for node_id, battery_samples in samples.items():
+        summary = rollup.summary(node_id)
+        assert summary['samples'] == 20
+        for field in ('battery_voltage', 'battery_current', 'battery_soc'):
+            values = [battery_data[field] for battery_data in battery_samples]
+            assert summary[field]['min'] == min(values)
+            assert summary[field]['max'] == max(values)
+            assert summary[field]['mean'] == pytest.approx(sum(values) / len(values), abs = 0.001)
+            assert summary[field]['last'] == values[-1]
+
+        cells = [cell for battery_data in battery_samples for cell in battery_data['cell_voltages']]
+        spreads = [max(battery_data['cell_voltages']) - min(battery_data['cell_voltages']) for battery_data in battery_samples]
+        assert summary['cell_voltage'] == {**expected_stats(cells), 'last': round(sum(battery_samples[-1]['cell_voltages']) / 16)}
+        assert summary['cell_spread'] == expected_stats(spreads)
+
+
+def test_oldest_samples_are_overwritten():
+    simulator = BusSimulator(1, seed = 2)
+    message_handler = MessageHandler(logger)
+    rollup = Rollup(message_handler, capacity = 4)
+
+    samples = feed(simulator, message_handler, cycles = 10)[1]
+
+    summary = rollup.summary(1)
+    assert summary['samples'] == 10
+    assert summary['battery_soc'] == expected_stats([battery_data['battery_soc'] for battery_data in samples[-4:]])
+    assert summary['battery_voltage']['last'] == samples[-1]['battery_voltage']
+
+
+def test_reset_starts_a_new_interval():
+    simulator = BusSimulator(2, seed = 3)
+    message_handler = MessageHandler(logger)
+    rollup = Rollup(message_handler)
+
+    feed(simulator, message_handler, cycles = 5)
+    rollup.reset([1])
+
+    assert rollup.summary(1) is None
+    assert rollup.summary(2)['samples'] == 5
+    assert rollup.summary(3) is None
+
+    samples = feed(simulator, message_handler, cycles = 2)[1]
+    assert rollup.summary(1)['samples'] == 2
+    assert rollup.summary(1)['battery_soc'] == expected_stats([battery_data['battery_soc'] for battery_data in samples])
+
+    with pytest.raises(ValueError):
+        Rollup(message_handler, capacity = 0)
+
+
+def test_published_battery_data_includes_rollup():
+    simulator = BusSimulator(2, seed = 4)
+    message_handler = MessageHandler(logger)
+    rollup = Rollup(message_handler)
+    mqtt_client = MockMQTTClient()
+    publisher = MQTTPublisher(logger = logger, message_handler = message_handler, mqtt_client = mqtt_client,
+                              topic = "batteries", fan_out = True, rollup = rollup)
+
+    feed(simulator, message_handler, cycles = 3)
+    publisher.publish_data()
+
+    battery_data = [json.loads(payload) for _, payload in mqtt_client.messages]
+    assert [data['rollup']['samples'] for data in battery_data] == [3, 3]
+    assert rollup.summary(1) is None
+
+    feed(simulator, message_handler, cycles = 1)
+    publisher.publish_data()
+    assert json.loads(mqtt_client.messages[-1][1])['rollup']['samples'] == 1
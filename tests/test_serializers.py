@@ -0,0 +1,61 @@
+import json
+import pytest
+from eflexcan2mqtt.decode import parse_battery_data
+from eflexcan2mqtt.serializers import BinarySerializer, JSONSerializer, check_decoder, create_serializer, SERIALIZERS
+from eflexcan2mqtt.simulator import BusSimulator
+
+
+@pytest.fixture
+def payload() -> list[dict]:
+    simulator = BusSimulator(3, seed = 9)
+    list(simulator.frames(1))
+    return [{**parse_battery_data(battery.data10, battery.data60), 'time': 1715987139} for battery in simulator.batteries]
+
+
+def test_json(payload: list[dict]):
+    assert json.loads(create_serializer('json').serialize(payload)) == payload
+
+
+def test_json_fast(payload: list[dict]):
+    pytest.importorskip("orjson")
+    assert json.loads(create_serializer('json_fast').serialize(payload)) == payload
+
+
+def test_msgpack(payload: list[dict]):
+    msgpack = pytest.importorskip("msgpack")
+    assert msgpack.unpackb(create_serializer('msgpack').serialize(payload)) == payload
+
+
+def test_cbor(payload: list[dict]):
+    cbor2 = pytest.importorskip("cbor2")
+    assert cbor2.loads(create_serializer('cbor').serialize(payload)) == payload
+
+
+def test_binary_round_trip(payload: list[dict]):
+    data = create_serializer('binary').serialize(payload)
+
+    assert len(data) == BinarySerializer.HEADER.size + 3 * BinarySerializer.RECORD.size
+    assert BinarySerializer.deserialize(data) == payload
+
+
+def test_binary_requires_default_signals(payload: list[dict]):
+    del payload[0]['cell_voltages']
+
+    with pytest.raises(ValueError):
+        create_serializer('binary').serialize(payload)
+
+
+def test_decoder_is_checked_against_the_serializer():
+    check_decoder(BinarySerializer(), parse_battery_data)
+    check_decoder(JSONSerializer(), lambda data10, data60: {'battery_soc': data10[6]})
+
+    with pytest.raises(ValueError):
+        check_decoder(BinarySerializer(), lambda data10, data60: {'battery_soc': data10[6]})
+    with pytest.raises(ValueError):
+        check_decoder(JSONSerializer(), lambda data10, data60: {'battery_id': data10[49:56]})
+
+
+def test_unknown_payload_format():
+    with pytest.raises(ValueError):
+        create_serializer('xml')
+    assert 'json' in SERIALIZERS
@@ -0,0 +1,157 @@
+import logging
+import multiprocessing
+import struct
+from typing import Iterator
+import pytest
+from multiprocessing.shared_memory import SharedMemory
+from eflexcan2mqtt.message_handler import MessageHandler
+from eflexcan2mqtt.mqtt_publisher import MQTTPublisher
+from eflexcan2mqtt.shared_ring import HEADER_SIZE, SLOT_SIZE, SLOTS_OFFSET, SetRingReader, SetRingWriter, create_ring
+from eflexcan2mqtt.simulator import BusSimulator
+from .mock_mqtt_client import MockMQTTClient
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def ring() -> Iterator[SharedMemory]:
+    shared_memory = create_ring(capacity = 16)
+    yield shared_memory
+    shared_memory.close()
+    shared_memory.unlink()
+
+
+def numbered_set(number: int) -> tuple[int, bytes, bytes, float]:
+    """A set whose every field is derived from its number, so a torn copy can be told apart."""
+    return (number % 255 + 1, struct.pack('>I', number) * 19 + b'\x01', struct.pack('>I', number) * 12 + b'\x06',
+            1715987138.0 + number)
+
+
+def test_reader_has_the_data_of_the_message_handler(ring: SharedMemory):
+    message_handler = MessageHandler(logger)
+    writer = SetRingWriter(ring.buf, message_handler)
+    reader = SetRingReader(ring.buf)
+    received = []
+    reader.add_set_completed_callback(lambda node_id, data10, data60, timestamp: received.append(node_id))
+
+    BusSimulator(3, seed = 1).feed(message_handler, cycles = 2)
+
+    assert reader.poll() == 6
+    assert received == [1, 2, 3, 1, 2, 3]
+    assert reader.compiled_battery_data() == message_handler.compiled_battery_data()
+    assert reader.compiled_battery_data([2]) == message_handler.compiled_battery_data([2])
+    assert reader.timestamps == message_handler.timestamps
+    assert reader.completed_sets_per_node == message_handler.completed_sets_per_node
+    assert reader.frame_counts == message_handler.frame_counts
+    assert reader.cycle_periods == message_handler.cycle_periods
+    assert reader.abandoned_sets_per_node == {1: 0, 2: 0, 3: 0}
+    assert reader.node_count == 3
+    assert writer.written == 6
+    assert reader.poll() == 0
+
+    # The publisher publishes the same battery data from the ring as from the MessageHandler.
+    direct, from_ring = MockMQTTClient(), MockMQTTClient()
+    MQTTPublisher(logger = logger, message_handler = message_handler, mqtt_client = direct).publish_data()
+    MQTTPublisher(logger = logger, message_handler = reader, mqtt_client = from_ring).publish_data()
+    assert from_ring.payload == direct.payload
+    del writer, reader
+
+
+def test_sets_overwritten_before_they_are_read_are_lost(ring: SharedMemory):
+    writer = SetRingWriter(ring.buf, MessageHandler(logger))
+    reader = SetRingReader(ring.buf)
+    for number in range(40):
+        writer.write(*numbered_set(number))
+
+    received = []
+    reader.add_set_completed_callback(lambda *completed_set: received.append(completed_set))
+
+    assert reader.poll() == 16
+    assert reader.lost_sets == 24
+    assert received == [numbered_set(number) for number in range(24, 40)]
+    del writer, reader
+
+
+def test_corrupted_sets_are_not_delivered(ring: SharedMemory):
+    writer = SetRingWriter(ring.buf, MessageHandler(logger))
+    reader = SetRingReader(ring.buf)
+    for number in range(3):
+        writer.write(*numbered_set(number))
+
+    # A byte of the second set's 10X data changes, as if the set was overwritten while it was read.
+    ring.buf[SLOTS_OFFSET + SLOT_SIZE + 30] ^= 0xFF
+
+    received = []
+    reader.add_set_completed_callback(lambda *completed_set: received.append(completed_set))
+
+    assert reader.poll() == 2
+    assert reader.lost_sets == 1
+    assert received == [numbered_set(0), numbered_set(2)]
+    del writer, reader
+
+
+def test_restarted_processes_carry_on(ring: SharedMemory):
+    writer = SetRingWriter(ring.buf, MessageHandler(logger))
+    for number in range(20):
+        writer.write(*numbered_set(number))
+
+    # A restarted publisher process catches up with the sets still in the ring, without handling them again.
+    reader = SetRingReader(ring.buf)
+    received = []
+    reader.add_set_completed_callback(lambda *completed_set: received.append(completed_set))
+    assert reader.catch_up() == 16
+    assert received == []
+    assert reader.lost_sets == 0
+    assert reader.compiled_battery_data([20]) == [numbered_set(19)]
+
+    # A restarted ingest process continues the sequence.
+    writer = SetRingWriter(ring.buf, MessageHandler(logger))
+    writer.write(*numbered_set(20))
+    assert writer.written == 21
+    assert reader.poll() == 1
+    assert received == [numbered_set(20)]
+    del writer, reader
+
+
+def test_ring_is_validated():
+    with pytest.raises(ValueError):
+        create_ring(capacity = 0)
+    with pytest.raises(ValueError):
+        SetRingReader(memoryview(bytearray(HEADER_SIZE)))
+
+
+def write_sets(name: str, count: int) -> None:
+    ring = SharedMemory(name = name)
+    writer = SetRingWriter(ring.buf, MessageHandler(logger))
+    for number in range(count):
+        writer.write(*numbered_set(number))
+    del writer
+    ring.close()
+
+
+def test_sets_read_while_written_by_another_process_are_consistent():
+    ring = create_ring(capacity = 8)
+    try:
+        count = 20000
+        writer = multiprocessing.get_context('fork').Process(target = write_sets, args = (ring.name, count))
+        reader = SetRingReader(ring.buf)
+        received = []
+        reader.add_set_completed_callback(lambda *completed_set: received.append(completed_set))
+
+        writer.start()
+        while writer.is_alive():
+            reader.poll()
+        writer.join()
+        reader.poll()
+
+        assert writer.exitcode == 0
+        # Each set read is whole, none is read twice, and the rest are counted as lost.
+        numbers = [struct.unpack_from('>I', data10)[0] for _, data10, _, _ in received]
+        assert all(completed_set == numbered_set(number) for completed_set, number in zip(received, numbers))
+        assert numbers == sorted(set(numbers))
+        assert numbers[-1] == count - 1
+        assert len(received) + reader.lost_sets == count
+        del reader
+    finally:
+        ring.close()
+        ring.unlink()
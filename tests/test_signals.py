@@ -0,0 +1,66 @@
+"""Test the signal database and the decoder compiled from it"""
+
+from typing import List
+import pytest
+from eflexcan2mqtt import decode
+from eflexcan2mqtt.signals import compile_signals, load_signals
+
+
+def test_default_signals_decode_like_parse_battery_data(data10: List[int], data60: List[int]):
+
+    decoder = compile_signals(load_signals())
+    battery_data = decoder(bytes(data10), bytes(data60))
+
+    assert battery_data == decode.parse_battery_data(data10, data60)
+    assert list(battery_data) == list(decode.parse_battery_data(data10, data60))
+
+
+def test_signal_database_file_adds_and_overrides_signals(data10: List[int], data60: List[int], tmp_path):
+
+    signal_file = tmp_path / "signals.ini"
+    signal_file.write_text("""
+[battery_voltage]
+message = 10X
+offset = 2
+format = >H
+
+[probe_temperatures]
+message = 60X
+offset = 42
+format = >6B
+
+[cell_voltage_1]
+message = 60X
+offset = 0
+format = <H
+divisor = 1000.0
+""")
+
+    decoder = compile_signals(load_signals(str(signal_file)))
+    battery_data = decoder(bytes(data10), bytes(data60))
+
+    assert battery_data['battery_voltage'] == 531
+    assert battery_data['probe_temperatures'] == [0x46, 0x45, 0x44, 0x45, 0x46, 0x48]
+    assert battery_data['cell_voltage_1'] == 3.322
+    assert battery_data['cell_voltages'][0] == 3322
+    assert list(battery_data)[-2:] == ['probe_temperatures', 'cell_voltage_1']
+
+
+@pytest.mark.parametrize("definition", [
+    "message = 20X\noffset = 0\nformat = >B",
+    "message = 10X\noffset = 76\nformat = >H",
+    "message = 10X\noffset = 0\nformat = H",
+    "message = 10X\noffset = 0\nformat = >Q7",
+    "message = 10X\noffset = 0\nformat = >2B\ntype = char",
+    "message = 10X\nformat = >B",
+    "message = 10X\noffset = 49\nformat = >7s",
+    "message = 10X\noffset = 48\nformat = >c\ntype = number",
+    "message = 10X\noffset = 0\nformat = >B\ntype = char",
+])
+def test_invalid_signals_are_rejected(definition: str, tmp_path):
+
+    signal_file = tmp_path / "signals.ini"
+    signal_file.write_text("[invalid]\n" + definition)
+
+    with pytest.raises(ValueError):
+        load_signals(str(signal_file))
@@ -0,0 +1,77 @@
+import logging
+import can
+import pytest
+from eflexcan2mqtt.decode import parse_battery_data
+from eflexcan2mqtt.message_handler import MessageHandler
+from eflexcan2mqtt.replay import read_candump
+from eflexcan2mqtt.simulator import BusSimulator
+
+logger = logging.getLogger(__name__)
+
+
+def test_simulated_sets_are_compiled_and_decoded():
+    simulator = BusSimulator(14, seed = 1)
+    message_handler = MessageHandler(logger)
+
+    frames = simulator.feed(message_handler, cycles = 3)
+
+    assert frames == 3 * 14 * (11 + 7)
+    assert message_handler.completed_sets == 3 * 14
+    for battery in simulator.batteries:
+        node_id = battery.node_id
+        assert message_handler.compiled_message10X_data[node_id] == battery.data10
+        assert message_handler.compiled_message60X_data[node_id] == battery.data60
+
+        battery_data = parse_battery_data(battery.data10, battery.data60)
+        assert battery_data['battery_number'] == battery.node_id
+        assert battery_data['batteries_in_system'] == 14
+        assert battery_data['battery_voltage'] == round(battery.voltage * 10) / 10
+        assert battery_data['battery_current'] == round(battery.current * 10) / 10
+        assert battery_data['battery_soc'] == battery.soc
+        assert battery_data['cell_voltages'] == battery.cell_voltages
+        assert battery_data['battery_id'] == "2211075F%04d" % battery.node_id
+
+
+def test_faulty_traffic_only_compiles_sent_sets():
+    simulator = BusSimulator(8, seed = 2, jitter = 0.0002, drop_rate = 0.02, duplicate_rate = 0.02, reorder_rate = 0.02)
+    message_handler = MessageHandler(logger)
+    sent_data10 = {battery.node_id: set() for battery in simulator.batteries}
+    sent_data60 = {battery.node_id: set() for battery in simulator.batteries}
+
+    for msg in simulator.frames(cycles = 50):
+        message_handler.on_message_received(msg)
+        for battery in simulator.batteries:
+            sent_data10[battery.node_id].add(battery.data10)
+            sent_data60[battery.node_id].add(battery.data60)
+
+    assert 0 < message_handler.completed_sets < 50 * 8
+    for node_id, data10 in message_handler.compiled_message10X_data.items():
+        assert data10 in sent_data10[node_id]
+    for node_id, data60 in message_handler.compiled_message60X_data.items():
+        assert data60 in sent_data60[node_id]
+
+
+def test_simulated_traffic_is_repeatable():
+    first = [(msg.arbitration_id, bytes(msg.data)) for msg in BusSimulator(3, seed = 3, drop_rate = 0.1).frames(5)]
+    second = [(msg.arbitration_id, bytes(msg.data)) for msg in BusSimulator(3, seed = 3, drop_rate = 0.1).frames(5)]
+
+    assert first == second
+
+
+def test_write_candump_and_send_to_virtual_bus(tmp_path):
+    log_path = str(tmp_path / "simulated.log")
+
+    assert BusSimulator(2, seed = 4).write_candump(log_path, cycles = 2) == 2 * 2 * 18
+    assert len(list(read_candump(log_path))) == 2 * 2 * 18
+
+    with can.Bus(interface = "virtual", channel = "simulator") as sender, \
+         can.Bus(interface = "virtual", channel = "simulator") as receiver:
+        assert BusSimulator(1, seed = 4).send(sender, cycles = 1) == 18
+        assert receiver.recv(timeout = 1).arbitration_id == 0x101
+
+
+def test_battery_count_is_validated():
+    with pytest.raises(ValueError):
+        BusSimulator(0)
+    with pytest.raises(ValueError):
+        BusSimulator(256)
@@ -0,0 +1,335 @@
+import asyncio
+import errno
+import logging
+import socket
+import struct
+import time
+from typing import List
+import can
+from eflexcan2mqtt.decode import BATTERY_CAN_FILTERS
+from eflexcan2mqtt.message_handler import MessageHandler
+from eflexcan2mqtt.socketcan_reader import (CAN_EFF_FLAG, CAN_ERR_FLAG, CAN_FILTER, CAN_FRAME, CAN_RTR_FLAG, SO_RXQ_OVFL,
+                                            SO_TIMESTAMPNS, Frame, SocketCANReader, drop_count, kernel_timestamp,
+                                            pack_can_filters)
+
+logger = logging.getLogger(__name__)
+
+
+def raw_frame(can_id: int, data: bytes) -> bytes:
+    return CAN_FRAME.pack(can_id, len(data), data)
+
+
+class RecordingListener():
+
+    def __init__(self):
+        self.frames: List[Frame] = []
+
+    def on_message_received(self, msg: Frame) -> None:
+        self.frames.append(msg)
+
+    def on_error(self, exc: Exception) -> None:
+        raise exc
+
+
+class DroppingSocket():
+    """One end of a socket pair, which fails like a CAN socket whose interface went down."""
+
+    def __init__(self, sock: socket.socket):
+        self._sock = sock
+        self.down = False
+        self.closed = False
+
+    def fileno(self) -> int:
+        return self._sock.fileno()
+
+    def setblocking(self, flag: bool) -> None:
+        self._sock.setblocking(flag)
+
+    def setsockopt(self, *args) -> None:
+        self._sock.setsockopt(*args)
+
+    def getsockopt(self, *args) -> int:
+        return self._sock.getsockopt(*args)
+
+    def recvmsg(self, size: int, ancillary_size: int) -> tuple[bytes, list, int, None]:
+        if self.down:
+            raise OSError(errno.ENETDOWN, "Network is down")
+        return self._sock.recvmsg(size, ancillary_size)
+
+    def close(self) -> None:
+        self.closed = True
+        self._sock.close()
+
+
+class OverflowingSocket(DroppingSocket):
+    """A socket pair end receiving each frame with the SO_RXQ_OVFL drop count of a CAN socket."""
+
+    def __init__(self, sock: socket.socket):
+        super().__init__(sock)
+        self.drops = 0
+
+    def recvmsg(self, size: int, ancillary_size: int) -> tuple[bytes, list, int, None]:
+        raw_frame, ancillary_data, flags, address = self._sock.recvmsg(size, ancillary_size)
+        return raw_frame, ancillary_data + [(socket.SOL_SOCKET, SO_RXQ_OVFL, struct.pack("=I", self.drops))], flags, address
+
+
+def test_frames_are_parsed_and_drained_per_wakeup():
+
+    async def run() -> tuple[SocketCANReader, RecordingListener]:
+        receiver, sender = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        listener = RecordingListener()
+        reader = SocketCANReader(logger, "test", [listener], asyncio.get_running_loop(), open_socket = lambda: receiver)
+        reader.start()
+
+        sender.send(raw_frame(0x101, bytes([0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x07, 0x08])))
+        # Blocks the event loop, so all the frames are read in one wakeup.
+        time.sleep(0.01)
+        sender.send(raw_frame(0x18FF50E5 | CAN_EFF_FLAG, bytes([0xAA, 0xBB])))
+        sender.send(raw_frame(0x601 | CAN_RTR_FLAG, b''))
+        sender.send(raw_frame(0x004 | CAN_ERR_FLAG, bytes(8)))
+        sender.send(raw_frame(0x305, bytes([0x11, 0x22, 0x33])))
+        await asyncio.sleep(0.05)
+
+        reader.stop()
+        sender.close()
+        return reader, listener
+
+    reader, listener = asyncio.run(run())
+
+    assert [(frame.arbitration_id, frame.data, frame.is_extended_id) for frame in listener.frames] == [
+        (0x101, bytes([0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x07, 0x08]), False),
+        (0x18FF50E5, bytes([0xAA, 0xBB]), True),
+        (0x305, bytes([0x11, 0x22, 0x33]), False),
+    ]
+    # Each frame has the time the kernel received it, rather than the time of the wakeup.
+    timestamps = [frame.timestamp for frame in listener.frames]
+    assert timestamps[1] - timestamps[0] >= 0.01
+    assert abs(timestamps[0] - time.time()) < 5
+    assert reader.frames_received == 3
+    assert reader.wakeups == 1
+    assert not reader.is_connected
+
+
+class FailingListener(RecordingListener):
+    """Raises on the frames of one CAN id, and records the errors."""
+
+    def __init__(self, failing_id: int):
+        super().__init__()
+        self.failing_id = failing_id
+        self.errors: List[Exception] = []
+
+    def on_message_received(self, msg: Frame) -> None:
+        if msg.arbitration_id == self.failing_id:
+            raise ValueError(f"Can't handle {msg.arbitration_id:#x}")
+        super().on_message_received(msg)
+
+    def on_error(self, exc: Exception) -> None:
+        self.errors.append(exc)
+
+
+def test_listener_errors_dont_drop_the_rest_of_the_batch():
+
+    async def run() -> tuple[SocketCANReader, FailingListener, RecordingListener]:
+        receiver, sender = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        failing, recording = FailingListener(0x102), RecordingListener()
+        reader = SocketCANReader(logger, "test", [failing, recording], asyncio.get_running_loop(), open_socket = lambda: receiver)
+        reader.start()
+
+        for can_id in range(0x101, 0x106):
+            sender.send(raw_frame(can_id, bytes([can_id & 0xFF])))
+        await asyncio.sleep(0.05)
+
+        reader.stop()
+        sender.close()
+        return reader, failing, recording
+
+    reader, failing, recording = asyncio.run(run())
+
+    assert reader.wakeups == 1
+    assert [frame.arbitration_id for frame in failing.frames] == [0x101, 0x103, 0x104, 0x105]
+    assert [str(error) for error in failing.errors] == ["Can't handle 0x102"]
+    # The other listeners receive every frame.
+    assert len(recording.frames) == reader.frames_received == 5
+
+
+def test_batches_are_limited_to_batch_size():
+
+    async def run() -> SocketCANReader:
+        receiver, sender = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        reader = SocketCANReader(logger, "test", [RecordingListener()], asyncio.get_running_loop(),
+                                 batch_size = 4, open_socket = lambda: receiver)
+        reader.start()
+        for index in range(10):
+            sender.send(raw_frame(0x101, bytes([index])))
+        await asyncio.sleep(0.05)
+        reader.stop()
+        sender.close()
+        return reader
+
+    reader = asyncio.run(run())
+
+    assert reader.frames_received == 10
+    assert reader.wakeups == 3
+
+
+def test_frames_complete_message_sets(can_messages: List[can.Message]):
+
+    async def run() -> MessageHandler:
+        receiver, sender = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        message_handler = MessageHandler(logger)
+        reader = SocketCANReader(logger, "test", [message_handler], asyncio.get_running_loop(), open_socket = lambda: receiver)
+        reader.start()
+        for msg in can_messages:
+            sender.send(raw_frame(msg.arbitration_id, bytes(msg.data)))
+        await asyncio.sleep(0.05)
+        reader.stop()
+        sender.close()
+        return message_handler
+
+    message_handler = asyncio.run(run())
+
+    assert sorted(message_handler.compiled_message60X_data.keys()) == [1, 2, 3]
+    assert message_handler.completed_sets == 6
+
+
+def test_network_down_reconnects_with_backoff():
+
+    async def run() -> tuple[SocketCANReader, RecordingListener, List[float]]:
+        loop = asyncio.get_running_loop()
+        pairs = []
+        attempts: List[float] = []
+
+        def open_socket() -> DroppingSocket:
+            attempts.append(loop.time())
+            # The interface is removed for the first two attempts to reopen it.
+            if len(attempts) in (2, 3):
+                raise OSError(errno.ENODEV, "No such device")
+            receiver, sender = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            pairs.append((DroppingSocket(receiver), sender))
+            return pairs[-1][0]
+
+        listener = RecordingListener()
+        reader = SocketCANReader(logger, "test", [listener], loop, min_reconnect_delay = 0.02,
+                                 max_reconnect_delay = 0.03, open_socket = open_socket)
+        reader.start()
+
+        first, first_sender = pairs[0]
+        first_sender.send(raw_frame(0x101, bytes([0x01])))
+        await asyncio.sleep(0.01)
+        first.down = True
+        first_sender.send(raw_frame(0x101, bytes([0x02])))
+        await asyncio.sleep(0.01)
+        assert first.closed and not reader.is_connected
+
+        await asyncio.sleep(0.15)
+        assert reader.is_connected
+        pairs[1][1].send(raw_frame(0x101, bytes([0x03])))
+        await asyncio.sleep(0.01)
+
+        reader.stop()
+        for _, sender in pairs:
+            sender.close()
+        return reader, listener, attempts
+
+    reader, listener, attempts = asyncio.run(run())
+
+    assert [frame.data for frame in listener.frames] == [bytes([0x01]), bytes([0x03])]
+    assert reader.network_down_events == 1
+    assert len(attempts) == 4
+    # 0.02 s after the network went down, then 0.03 s, doubled but capped, then 0.03 s again.
+    delays = [later - earlier for earlier, later in zip(attempts[1:], attempts[2:])]
+    assert all(delay >= 0.025 for delay in delays)
+
+
+def test_stop_cancels_reconnect():
+
+    async def run() -> List[int]:
+        attempts = []
+        receiver, sender = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        dropping = DroppingSocket(receiver)
+
+        def open_socket() -> DroppingSocket:
+            attempts.append(1)
+            return dropping
+
+        reader = SocketCANReader(logger, "test", [RecordingListener()], asyncio.get_running_loop(),
+                                 min_reconnect_delay = 0.02, open_socket = open_socket)
+        reader.start()
+        dropping.down = True
+        sender.send(raw_frame(0x101, bytes([0x01])))
+        await asyncio.sleep(0.01)
+        reader.stop()
+        await asyncio.sleep(0.05)
+        sender.close()
+        return attempts
+
+    assert asyncio.run(run()) == [1]
+
+
+def test_pack_can_filters():
+    # Standard only filters match the EFF flag too, so extended ids with the same low bits don't pass.
+    assert pack_can_filters([{'can_id': 0x100, 'can_mask': 0x700, 'extended': False}]) == \
+        CAN_FILTER.pack(0x100, 0x700 | CAN_EFF_FLAG)
+    assert pack_can_filters([{'can_id': 0x18FF50E5, 'can_mask': 0x1FFFFFFF, 'extended': True}]) == \
+        CAN_FILTER.pack(0x18FF50E5 | CAN_EFF_FLAG, 0x1FFFFFFF | CAN_EFF_FLAG)
+    assert pack_can_filters([{'can_id': 0x305, 'can_mask': 0x7FF}]) == CAN_FILTER.pack(0x305, 0x7FF)
+    assert len(pack_can_filters(BATTERY_CAN_FILTERS)) == 16
+
+
+def test_battery_filters_drop_other_frames():
+    with can.Bus(interface = 'virtual', channel = 'test_battery_filters', can_filters = list(BATTERY_CAN_FILTERS)) as bus, \
+            can.Bus(interface = 'virtual', channel = 'test_battery_filters') as sender:
+        for arbitration_id, is_extended_id in [(0x351, False), (0x101, False), (0x305, False), (0x18FF50E5, True), (0x603, False)]:
+            sender.send(can.Message(arbitration_id = arbitration_id, is_extended_id = is_extended_id, data = [0x01]))
+
+        received = []
+        while msg := bus.recv(0.05):
+            received.append(msg.arbitration_id)
+
+    assert received == [0x101, 0x603]
+
+
+def test_drop_count():
+    assert drop_count([(socket.SOL_SOCKET, SO_RXQ_OVFL, struct.pack("=I", 7))]) == 7
+    assert drop_count([(socket.SOL_SOCKET, SO_RXQ_OVFL + 1, struct.pack("=I", 7))]) is None
+    assert drop_count([]) is None
+
+
+def test_kernel_timestamp():
+    timespec = struct.pack("@ll", 1715987000, 250000000)
+    assert kernel_timestamp([(socket.SOL_SOCKET, SO_RXQ_OVFL, struct.pack("=I", 7)),
+                             (socket.SOL_SOCKET, SO_TIMESTAMPNS, timespec)]) == 1715987000.25
+    assert kernel_timestamp([(socket.SOL_SOCKET, SO_RXQ_OVFL, struct.pack("=I", 7))]) is None
+
+
+def test_sustained_drops_raise_the_receive_buffer():
+
+    async def run() -> tuple[SocketCANReader, int, RecordingListener]:
+        receiver, sender = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        overflowing = OverflowingSocket(receiver)
+        listener = RecordingListener()
+        reader = SocketCANReader(logger, "test", [listener], asyncio.get_running_loop(), track_drops = True,
+                                 receive_buffer_size = 8192, max_receive_buffer_size = 24576,
+                                 drop_check_interval = 0.02, sustained_loss_checks = 2, open_socket = lambda: overflowing)
+        reader.start()
+        initial_size = reader.receive_buffer_size
+
+        # Frames are dropped between every check, for about 10 checks.
+        for drops in range(1, 21):
+            overflowing.drops = drops * 10
+            sender.send(raw_frame(0x101, bytes([drops])))
+            await asyncio.sleep(0.01)
+
+        reader.stop()
+        sender.close()
+        return reader, initial_size, listener
+
+    reader, initial_size, listener = asyncio.run(run())
+
+    assert len(listener.frames) == 20
+    assert all(previous.timestamp < frame.timestamp for previous, frame in zip(listener.frames, listener.frames[1:]))
+    assert reader.socket_drops == 200
+    # The kernel reports twice the size set. The buffer is doubled every 2 checks with drops, up to the maximum.
+    assert initial_size == 16384
+    assert reader.receive_buffer_size == 49152
+    assert reader.receive_buffer_increases == 2
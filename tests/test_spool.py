@@ -0,0 +1,44 @@
+import logging
+from eflexcan2mqtt.spool import DiskSpool
+
+logger = logging.getLogger(__name__)
+
+
+def test_payloads_are_returned_oldest_first(tmp_path):
+    spool = DiskSpool(str(tmp_path / "spool.db"), max_bytes = 1024, logger = logger)
+    spool.append([{"battery_id": "A", "time": 1}])
+    spool.append([{"battery_id": "B", "time": 2}])
+    spool.append([{"battery_id": "C", "time": 3}])
+
+    entries = spool.peek(2)
+
+    assert [payload for _, payload in entries] == [[{"battery_id": "A", "time": 1}], [{"battery_id": "B", "time": 2}]]
+    assert len(spool) == 3
+
+    spool.remove(entries[-1][0])
+
+    assert [payload for _, payload in spool.peek(10)] == [[{"battery_id": "C", "time": 3}]]
+    assert len(spool) == 1
+
+
+def test_oldest_payloads_are_evicted_at_size_cap(tmp_path):
+    payload_size = len('[{"time":0}]')
+    spool = DiskSpool(str(tmp_path / "spool.db"), max_bytes = payload_size * 3, logger = logger)
+
+    for time in range(5):
+        spool.append([{"time": time}])
+
+    assert len(spool) == 3
+    assert spool.size == payload_size * 3
+    assert [payload[0]["time"] for _, payload in spool.peek(10)] == [2, 3, 4]
+
+
+def test_payloads_survive_reopening_spool(tmp_path):
+    spool = DiskSpool(str(tmp_path / "spool.db"), max_bytes = 1024, logger = logger)
+    spool.append([{"battery_id": "A", "time": 1}])
+    spool.close()
+
+    spool = DiskSpool(str(tmp_path / "spool.db"), max_bytes = 1024, logger = logger)
+
+    assert len(spool) == 1
+    assert spool.peek(1)[0][1] == [{"battery_id": "A", "time": 1}]
@@ -0,0 +1,49 @@
+"""Only what is needed to read the CAN channels is imported on startup"""
+
+import os
+import subprocess
+import sys
+from typing import List, Set, Tuple
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Imported once the CAN channels are read, or only when their feature is used.
+DEFERRED_MODULES = ('can', 'psutil', 'paho.mqtt.client', 'multiprocessing.connection',
+                    'multiprocessing.shared_memory', 'http.client', 'sqlite3', 'cProfile', 'tracemalloc')
+
+REPEAT = 3
+
+
+def import_time(args: List[str]) -> Tuple[float, Set[str]]:
+    """The total import time in seconds of running python with args, and the modules imported. main.py
+    is run with a missing config file, so it exits once imported."""
+
+    result = subprocess.run([sys.executable, '-X', 'importtime', *args, '--config_path', os.path.join(PROJECT_ROOT, 'missing.ini')],
+                            capture_output = True, text = True, cwd = PROJECT_ROOT)
+    total = 0
+    modules = set()
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and 'cumulative' not in line:
+            _, cumulative, name = line.split('|')
+            modules.add(name.strip())
+            if not name.startswith('  '):
+                total += int(cumulative)
+    return total / 1e6, modules
+
+
+def test_deferred_modules_are_not_imported_on_startup():
+    _, modules = import_time(['main.py'])
+
+    assert 'eflexcan2mqtt.socketcan_reader' in modules
+    assert modules.isdisjoint(DEFERRED_MODULES)
+
+
+def test_startup_import_time_is_within_budget():
+    eager_imports = ''.join(f"import {module}\n" for module in DEFERRED_MODULES)
+    eager = min(import_time(['-c', f"{eager_imports}import runpy\nrunpy.run_path('main.py', run_name = '__main__')"])[0]
+                for _ in range(REPEAT))
+    startup = min(import_time(['main.py'])[0] for _ in range(REPEAT))
+
+    # Relative to importing the deferred modules eagerly, so the budget holds on slower machines too.
+    # The fastest runs are compared, as other processes only ever slow a run down.
+    assert startup < eager * 0.75